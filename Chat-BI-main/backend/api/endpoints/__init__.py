@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from . import generate_chart, insight_analysis, ai_model_config, insight_analysis_stream, dataset_upload, embedding_config, model_selection, conversation, minio_management, insight_task, monitoring, progress_stream, file_preview
+from . import generate_chart, insight_analysis, ai_model_config, insight_analysis_stream, dataset_upload, embedding_config, model_selection, conversation, minio_management, insight_task, monitoring, progress_stream, file_preview, dataset_query
 
 router = APIRouter()
 
@@ -9,6 +9,7 @@ router.include_router(insight_analysis.router, prefix="/api", tags=["insight_ana
 router.include_router(ai_model_config.router, prefix="/api", tags=["ai_model_config"])
 router.include_router(insight_analysis_stream.router, prefix="/api", tags=["insight_analysis_stream"])
 router.include_router(dataset_upload.router, prefix="/api", tags=["dataset"])
+router.include_router(dataset_query.router, prefix="/api", tags=["dataset_query"])
 router.include_router(embedding_config.router, prefix="/api", tags=["embedding_config"])
 router.include_router(model_selection.router, prefix="/api", tags=["model_selection"])
 router.include_router(conversation.router, prefix="/api", tags=["conversation"])
@@ -0,0 +1,203 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+from typing import Optional
+import json
+import logging
+
+from core.config import settings
+from services.approximate_query import query_parquet_approximate
+from services.arrow_utils import dataframe_to_json_records
+from services.query_executor import QueryQueueFullError, QueryTimeoutError
+from services.query_guard import QueryRejectedError
+from services.query_result_store import (
+    InvalidQueryError,
+    create_query_handle,
+    get_query_handle,
+    fetch_query_page,
+    iter_query_ndjson,
+    delete_query_handle,
+    validate_readonly_sql
+)
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+class DatasetQueryRequest(BaseModel):
+    sql: str  # 表名使用 dataset
+    page_size: int = 100
+
+
+class ApproximateQueryRequest(BaseModel):
+    sql: str  # 表名使用 dataset
+    sample_rate: Optional[float] = None  # 抽样率(0,1],为空时按数据集行数自动选择
+    limit: int = 1000
+
+
+def _page_response(page: dict, extra: dict = None) -> Response:
+    """
+    构造分页响应
+
+    行数据已是JSON字符串,直接拼接进响应体,避免再次解析和序列化
+    """
+    meta = {key: value for key, value in page.items() if key != 'data_json'}
+    if extra:
+        meta.update(extra)
+    body = (
+        '{"success": true, "data": '
+        + json.dumps(meta, ensure_ascii=False)[:-1]
+        + ', "rows": ' + page['data_json'] + '}}'
+    )
+    return Response(content=body, media_type="application/json")
+
+
+@router.post("/dataset/{dataset_id}/query")
+async def create_dataset_query(dataset_id: str, request: DatasetQueryRequest):
+    """
+    执行数据集查询并创建结果句柄,返回第一页数据
+
+    后续通过 /query/{handle}/page 翻页或 /query/{handle}/stream 流式读取,无需重新执行查询
+    """
+    if not 1 <= request.page_size <= settings.QUERY_PAGE_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"page_size 需在 1 到 {settings.QUERY_PAGE_MAX_SIZE} 之间"
+        )
+
+    try:
+        handle_info = await create_query_handle(dataset_id, request.sql)
+        page = await fetch_query_page(handle_info['handle'], 0, request.page_size)
+        if page is None:
+            raise HTTPException(status_code=500, detail="查询结果已失效")
+
+        return _page_response(page, {
+            'columns': handle_info['columns'],
+            'truncated': handle_info['truncated']
+        })
+
+    except HTTPException:
+        raise
+    except (InvalidQueryError, QueryRejectedError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except QueryQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except QueryTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"数据集查询失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+
+
+@router.post("/dataset/{dataset_id}/query/approximate")
+async def approximate_dataset_query(dataset_id: str, request: ApproximateQueryRequest):
+    """
+    在抽样数据上执行聚合查询,快速返回估计结果
+
+    响应中的 approximate.error_bounds 为每个聚合列每行的95%置信区间半宽;
+    approximate.approximate 为 false 时表示已执行精确查询(数据量较小或查询不适合抽样)。
+    前端可先展示该结果作为预览,再调用 /dataset/{dataset_id}/query 获取精确结果
+    """
+    if request.sample_rate is not None and not 0 < request.sample_rate <= 1:
+        raise HTTPException(status_code=400, detail="sample_rate 需在 (0, 1] 之间")
+    if not 1 <= request.limit <= settings.QUERY_PAGE_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit 需在 1 到 {settings.QUERY_PAGE_MAX_SIZE} 之间"
+        )
+
+    try:
+        sql_query = validate_readonly_sql(request.sql)
+        result = await query_parquet_approximate(
+            dataset_id, sql_query, request.sample_rate, request.limit
+        )
+        if result is None:
+            raise HTTPException(status_code=500, detail="查询失败")
+
+        df, approximate = result
+        body = (
+            '{"success": true, "data": ' + dataframe_to_json_records(df)
+            + ', "approximate": ' + json.dumps(approximate, ensure_ascii=False) + '}'
+        )
+        return Response(content=body, media_type="application/json")
+
+    except HTTPException:
+        raise
+    except (InvalidQueryError, QueryRejectedError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueryQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except QueryTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"近似查询失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+
+
+@router.get("/query/{handle}/page")
+async def get_query_page(
+    handle: str,
+    offset: int = Query(0, description="起始行", ge=0),
+    limit: int = Query(100, description="页大小", ge=1, le=settings.QUERY_PAGE_MAX_SIZE)
+):
+    """
+    读取查询结果的一页
+
+    响应中的 next_offset 为下一页的起始行,为 null 时表示已到末尾
+    """
+    try:
+        page = await fetch_query_page(handle, offset, limit)
+        if page is None:
+            raise HTTPException(status_code=404, detail="查询句柄不存在或已过期")
+        return _page_response(page)
+
+    except HTTPException:
+        raise
+    except QueryQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except QueryTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"读取查询结果失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"读取失败: {str(e)}")
+
+
+@router.get("/query/{handle}/stream")
+async def stream_query_result(
+    handle: str,
+    batch_size: int = Query(1000, description="每批行数", ge=1, le=settings.QUERY_PAGE_MAX_SIZE)
+):
+    """
+    以NDJSON格式流式输出全部查询结果(每行一个JSON对象)
+    """
+    handle_info = await get_query_handle(handle)
+    if handle_info is None:
+        raise HTTPException(status_code=404, detail="查询句柄不存在或已过期")
+
+    return StreamingResponse(
+        iter_query_ndjson(handle, batch_size),
+        media_type="application/x-ndjson",
+        headers={
+            "X-Total-Rows": str(handle_info['row_count'])
+        }
+    )
+
+
+@router.delete("/query/{handle}")
+async def delete_query(handle: str):
+    """
+    释放查询句柄及其结果文件
+    """
+    try:
+        deleted = await delete_query_handle(handle)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="查询句柄不存在或已过期")
+        return {"success": True, "message": "查询句柄已删除"}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"删除查询句柄失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"删除失败: {str(e)}")
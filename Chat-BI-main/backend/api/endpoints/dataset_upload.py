@@ -1,31 +1,94 @@
 """
 数据集文件上传API端点
-支持CSV和Excel文件上传
+支持CSV和Excel文件上传,大文件可使用可续传的分片上传
 """
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request
+from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from uuid import uuid4
 from datetime import datetime
+import asyncio
 import logging
 import os
 import hashlib
+from typing import BinaryIO, Optional
 
 from models.sys_dataset import SysDataset
 from core.minio_client import minio_client
 from core.config import settings
+from services.dataset_jobs import enqueue_dataset_job, PRIORITY_HIGH
+from services.progress_reporter import get_live_progress
 from api.dependencies.dependencies import get_async_session
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
+class _UploadTooLargeError(Exception):
+    """上传文件超过 MAX_UPLOAD_SIZE"""
+
+    def __init__(self, size: int):
+        super().__init__(f"文件超过大小上限: 已读取 {size} 字节")
+        self.size = size
+
+
+class _HashingStream:
+    """
+    包装上传文件: 读取时增量计算MD5并统计大小,超过上限时抛出 _UploadTooLargeError
+    """
+
+    def __init__(self, source: BinaryIO, max_size: int):
+        self._source = source
+        self._md5 = hashlib.md5()
+        self._max_size = max_size
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._source.read(size)
+        self.size += len(data)
+        if self.size > self._max_size:
+            raise _UploadTooLargeError(self.size)
+        self._md5.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self._md5.hexdigest()
+
+
+def _too_large_message(file_size: int) -> str:
+    return f"文件过大: {file_size / 1024 / 1024:.2f}MB. 最大允许: {settings.MAX_UPLOAD_SIZE / 1024 / 1024}MB"
+
+
+async def _check_duplicate(session: AsyncSession, file_md5: str, exclude_id=None):
+    """已存在相同MD5的文件时抛出409"""
+    query = select(SysDataset).where(SysDataset.file_md5 == file_md5)
+    if exclude_id is not None:
+        query = query.where(SysDataset.id != exclude_id)
+    result = await session.execute(query.limit(1))
+    existing_dataset = result.scalar_one_or_none()
+
+    if existing_dataset:
+        logger.warning(f"重复上传检测: 文件MD5={file_md5} 已存在,数据集ID={existing_dataset.id}")
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "error": "duplicate_file",
+                "message": f"该文件已上传过,文件名: {existing_dataset.name}",
+                "existing_dataset": {
+                    "id": str(existing_dataset.id),
+                    "name": existing_dataset.name,
+                    "created_at": existing_dataset.created_at.isoformat() if existing_dataset.created_at else None
+                }
+            }
+        )
+
+
 @router.post("/upload_dataset")
 async def upload_dataset(
     file: UploadFile = File(...),
     logical_name: str = None,
     description: str = None,
-    background_tasks: BackgroundTasks = None,
     session: AsyncSession = Depends(get_async_session)
 ):
     """
@@ -35,7 +98,6 @@ async def upload_dataset(
         file: 上传的文件
         logical_name: 逻辑名称(可选)
         description: 数据集描述(可选)
-        background_tasks: 后台任务
         session: 数据库会话
 
     Returns:
@@ -53,65 +115,40 @@ async def upload_dataset(
             detail=f"不支持的文件格式: {file_ext}. 仅支持: {', '.join(settings.ALLOWED_EXTENSIONS)}"
         )
 
-    # 读取文件数据
-    try:
-        file_data = await file.read()
-        file_size = len(file_data)
-
-        # 检查文件大小
-        if file_size > settings.MAX_UPLOAD_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"文件过大: {file_size / 1024 / 1024:.2f}MB. 最大允许: {settings.MAX_UPLOAD_SIZE / 1024 / 1024}MB"
-            )
-
-        if file_size == 0:
-            raise HTTPException(status_code=400, detail="文件为空")
-
-        # 计算文件MD5哈希值
-        file_md5 = hashlib.md5(file_data).hexdigest()
-        logger.info(f"文件MD5: {file_md5}")
-
-        # 检查是否已存在相同MD5的文件
-        result = await session.execute(
-            select(SysDataset).where(SysDataset.file_md5 == file_md5)
-        )
-        existing_dataset = result.scalar_one_or_none()
-
-        if existing_dataset:
-            logger.warning(f"重复上传检测: 文件MD5={file_md5} 已存在,数据集ID={existing_dataset.id}")
-            raise HTTPException(
-                status_code=409,
-                detail={
-                    "error": "duplicate_file",
-                    "message": f"该文件已上传过,文件名: {existing_dataset.name}",
-                    "existing_dataset": {
-                        "id": str(existing_dataset.id),
-                        "name": existing_dataset.name,
-                        "created_at": existing_dataset.created_at.isoformat() if existing_dataset.created_at else None
-                    }
-                }
-            )
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"读取上传文件失败: {e}")
-        raise HTTPException(status_code=500, detail=f"文件读取失败: {str(e)}")
+    # 已知大小(multipart请求中带有长度)时先行拒绝过大的文件
+    if file.size is not None and file.size > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=400, detail=_too_large_message(file.size))
 
     # 生成数据集ID和存储路径
     dataset_id = uuid4()
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     object_name = f"uploads/{dataset_id}_{timestamp}_{file.filename}"
 
+    # 分块读取上传文件,边计算MD5边以分片上传方式写入MinIO(在线程中执行,不阻塞事件循环)
+    stream = _HashingStream(file.file, settings.MAX_UPLOAD_SIZE)
     try:
-        # 上传到MinIO
-        file_path = minio_client.upload_file(
-            file_data,
+        file_path = await asyncio.to_thread(
+            minio_client.upload_stream,
+            stream,
             object_name,
-            content_type=file.content_type or "application/octet-stream"
+            file.content_type or "application/octet-stream"
         )
-        logger.info(f"文件已上传到MinIO: {file_path}")
+    except _UploadTooLargeError as e:
+        raise HTTPException(status_code=400, detail=_too_large_message(e.size))
+    except Exception as e:
+        logger.error(f"上传文件到MinIO失败: {e}")
+        raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
+
+    file_size = stream.size
+    file_md5 = stream.hexdigest()
+    logger.info(f"文件已上传到MinIO: {file_path}, 大小: {file_size}, MD5: {file_md5}")
+
+    try:
+        if file_size == 0:
+            raise HTTPException(status_code=400, detail="文件为空")
+
+        # 检查是否已存在相同MD5的文件
+        await _check_duplicate(session, file_md5)
 
         # 创建数据集记录
         dataset = SysDataset(
@@ -131,32 +168,353 @@ async def upload_dataset(
 
         logger.info(f"数据集记录已创建: {dataset_id}")
 
-        # 添加后台解析任务
-        from services.dataset_parser import parse_dataset_task
-        background_tasks.add_task(
-            parse_dataset_task,
-            str(dataset_id),
-            file_path,
-            file.filename
-        )
+    except Exception as e:
+        # 清理MinIO中的文件(空文件、重复文件或创建记录失败)
+        try:
+            await asyncio.to_thread(minio_client.delete_file, object_name)
+        except:
+            pass
+        if isinstance(e, HTTPException):
+            raise
+        logger.error(f"上传数据集失败: {e}")
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
 
-        return {
-            "dataset_id": str(dataset_id),
-            "status": "parsing",
-            "message": "文件上传成功,正在后台解析...",
-            "file_name": file.filename,
-            "file_size": file_size
+    # 解析任务加入队列,由worker进程执行(入队失败时数据集保持pending,可通过retry_parse重新提交)
+    await enqueue_dataset_job(
+        'parse', dataset_id, {'file_path': file_path, 'filename': file.filename}
+    )
+
+    return {
+        "dataset_id": str(dataset_id),
+        "status": "parsing",
+        "message": "文件上传成功,正在后台解析...",
+        "file_name": file.filename,
+        "file_size": file_size
+    }
+
+
+# ---- 可续传的分片上传: init -> 上传分片(可并行、可重传) -> complete ----
+# 分片直接写入MinIO分片上传,已上传的分片以MinIO为准,上传状态记录在 SysDataset.extra_metadata['upload']
+
+
+class InitUploadRequest(BaseModel):
+    filename: str
+    file_size: int
+    content_type: Optional[str] = None
+    logical_name: Optional[str] = None
+    description: Optional[str] = None
+
+
+async def _get_uploading_dataset(session: AsyncSession, dataset_id: str) -> SysDataset:
+    result = await session.execute(
+        select(SysDataset).where(SysDataset.id == dataset_id)
+    )
+    dataset = result.scalar_one_or_none()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="数据集不存在")
+    if dataset.parse_status != 'uploading' or not (dataset.extra_metadata or {}).get('upload'):
+        raise HTTPException(status_code=400, detail=f"数据集状态为 {dataset.parse_status}，不在上传中")
+    return dataset
+
+
+def _expected_part_size(upload: dict, part_number: int) -> int:
+    """除最后一个分片外,各分片大小均为 part_size"""
+    if part_number < upload['total_parts']:
+        return upload['part_size']
+    return upload['file_size'] - upload['part_size'] * (upload['total_parts'] - 1)
+
+
+@router.post("/upload_dataset/init")
+async def init_upload(
+    request: InitUploadRequest,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    创建可续传上传
+
+    客户端按返回的 part_size 切分文件,以 PUT /upload_dataset/{dataset_id}/parts/{part_number}
+    上传各分片(分片号从1开始,可并行、失败可重传),全部上传后调用 complete
+
+    Args:
+        request: 文件名、文件大小等
+        session: 数据库会话
+
+    Returns:
+        {
+            "dataset_id": "uuid",
+            "part_size": 分片大小,
+            "total_parts": 分片数
         }
+    """
+    file_ext = os.path.splitext(request.filename)[1].lower()
+    if file_ext not in settings.ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的文件格式: {file_ext}. 仅支持: {', '.join(settings.ALLOWED_EXTENSIONS)}"
+        )
+    if request.file_size <= 0:
+        raise HTTPException(status_code=400, detail="文件为空")
+    if request.file_size > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=400, detail=_too_large_message(request.file_size))
 
+    dataset_id = uuid4()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    object_name = f"uploads/{dataset_id}_{timestamp}_{request.filename}"
+    content_type = request.content_type or "application/octet-stream"
+    part_size = settings.MINIO_UPLOAD_PART_SIZE
+    total_parts = -(-request.file_size // part_size)
+
+    try:
+        upload_id = await asyncio.to_thread(minio_client.create_multipart_upload, object_name, content_type)
     except Exception as e:
-        logger.error(f"上传数据集失败: {e}")
-        # 清理MinIO中的文件
+        logger.error(f"创建分片上传失败: {e}")
+        raise HTTPException(status_code=500, detail=f"创建上传失败: {str(e)}")
+
+    try:
+        dataset = SysDataset(
+            id=dataset_id,
+            name=request.filename,
+            logical_name=request.logical_name or request.filename.rsplit('.', 1)[0],
+            description=request.description,
+            file_size=request.file_size,
+            parse_status='uploading',
+            embedding_status='pending',
+            extra_metadata={
+                'upload': {
+                    'upload_id': upload_id,
+                    'object_name': object_name,
+                    'content_type': content_type,
+                    'file_size': request.file_size,
+                    'part_size': part_size,
+                    'total_parts': total_parts
+                }
+            }
+        )
+        session.add(dataset)
+        await session.commit()
+    except Exception as e:
+        await asyncio.to_thread(minio_client.abort_multipart_upload, object_name, upload_id)
+        logger.error(f"创建上传记录失败: {e}")
+        raise HTTPException(status_code=500, detail=f"创建上传失败: {str(e)}")
+
+    logger.info(f"可续传上传已创建: {dataset_id}, 大小: {request.file_size}, 分片数: {total_parts}")
+    return {
+        "dataset_id": str(dataset_id),
+        "part_size": part_size,
+        "total_parts": total_parts
+    }
+
+
+@router.put("/upload_dataset/{dataset_id}/parts/{part_number}")
+async def upload_part(
+    dataset_id: str,
+    part_number: int,
+    request: Request,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    上传一个分片(请求体为分片的原始字节)
+
+    Args:
+        dataset_id: 数据集ID
+        part_number: 分片号(1 ~ total_parts)
+        request: 请求
+        session: 数据库会话
+
+    Returns:
+        分片号、大小和ETag
+    """
+    dataset = await _get_uploading_dataset(session, dataset_id)
+    upload = dataset.extra_metadata['upload']
+    if not 1 <= part_number <= upload['total_parts']:
+        raise HTTPException(
+            status_code=400,
+            detail=f"分片号超出范围: {part_number}. 应为 1 ~ {upload['total_parts']}"
+        )
+
+    # 分片大小固定,读取超过预期大小时立即拒绝
+    expected_size = _expected_part_size(upload, part_number)
+    data = bytearray()
+    async for block in request.stream():
+        data.extend(block)
+        if len(data) > expected_size:
+            break
+    if len(data) != expected_size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"分片 {part_number} 大小不正确: 应为 {expected_size} 字节"
+        )
+
+    try:
+        etag = await asyncio.to_thread(
+            minio_client.upload_part,
+            upload['object_name'],
+            upload['upload_id'],
+            part_number,
+            bytes(data)
+        )
+    except Exception as e:
+        logger.error(f"分片上传失败: {dataset_id} #{part_number}: {e}")
+        raise HTTPException(status_code=500, detail=f"分片上传失败: {str(e)}")
+
+    return {
+        "dataset_id": dataset_id,
+        "part_number": part_number,
+        "size": expected_size,
+        "etag": etag
+    }
+
+
+@router.get("/upload_dataset/{dataset_id}/parts")
+async def list_uploaded_parts(
+    dataset_id: str,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    查询已上传的分片,客户端断线重连后只需上传 missing_parts
+
+    Args:
+        dataset_id: 数据集ID
+        session: 数据库会话
+
+    Returns:
+        已上传和缺失的分片号
+    """
+    dataset = await _get_uploading_dataset(session, dataset_id)
+    upload = dataset.extra_metadata['upload']
+    try:
+        parts = await asyncio.to_thread(minio_client.list_parts, upload['object_name'], upload['upload_id'])
+    except Exception as e:
+        logger.error(f"查询已上传分片失败: {e}")
+        raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+
+    uploaded = [p['part_number'] for p in parts]
+    uploaded_set = set(uploaded)
+    return {
+        "dataset_id": dataset_id,
+        "part_size": upload['part_size'],
+        "total_parts": upload['total_parts'],
+        "uploaded_parts": uploaded,
+        "missing_parts": [n for n in range(1, upload['total_parts'] + 1) if n not in uploaded_set]
+    }
+
+
+@router.post("/upload_dataset/{dataset_id}/complete")
+async def complete_upload(
+    dataset_id: str,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    合并分片,按文件MD5去重后开始解析
+
+    Args:
+        dataset_id: 数据集ID
+        session: 数据库会话
+
+    Returns:
+        与 upload_dataset 相同
+    """
+    dataset = await _get_uploading_dataset(session, dataset_id)
+    upload = dataset.extra_metadata['upload']
+    object_name = upload['object_name']
+
+    try:
+        parts = await asyncio.to_thread(minio_client.list_parts, object_name, upload['upload_id'])
+    except Exception as e:
+        logger.error(f"查询已上传分片失败: {e}")
+        raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+
+    uploaded = {p['part_number'] for p in parts}
+    missing = [n for n in range(1, upload['total_parts'] + 1) if n not in uploaded]
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "missing_parts", "message": "分片未全部上传", "missing_parts": missing}
+        )
+
+    try:
+        file_path = await asyncio.to_thread(
+            minio_client.complete_multipart_upload, object_name, upload['upload_id'], parts
+        )
+    except Exception as e:
+        logger.error(f"合并分片失败: {e}")
+        raise HTTPException(status_code=500, detail=f"合并分片失败: {str(e)}")
+
+    try:
+        # 分片上传对象的ETag不是文件MD5,读取合并后的对象计算
+        file_md5 = await asyncio.to_thread(minio_client.compute_md5, object_name)
+        logger.info(f"文件已合并: {file_path}, 大小: {upload['file_size']}, MD5: {file_md5}")
+
+        # 检查是否已存在相同MD5的文件
+        await _check_duplicate(session, file_md5, exclude_id=dataset.id)
+
+        dataset.original_file_path = file_path
+        dataset.file_md5 = file_md5
+        dataset.parse_status = 'pending'
+        dataset.parse_progress = 0
+        dataset.extra_metadata = {k: v for k, v in dataset.extra_metadata.items() if k != 'upload'}
+        await session.commit()
+
+    except Exception as e:
+        # 清理合并后的文件;重复文件的上传记录一并删除
         try:
-            minio_client.delete_file(object_name)
+            await asyncio.to_thread(minio_client.delete_file, object_name)
         except:
             pass
+        try:
+            await session.rollback()
+            await session.delete(dataset)
+            await session.commit()
+        except Exception as cleanup_error:
+            logger.warning(f"删除上传记录失败: {cleanup_error}")
+        if isinstance(e, HTTPException):
+            raise
+        logger.error(f"完成上传失败: {e}")
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
 
+    # 解析任务加入队列,由worker进程执行
+    await enqueue_dataset_job(
+        'parse', dataset.id, {'file_path': file_path, 'filename': dataset.name}
+    )
+
+    return {
+        "dataset_id": str(dataset.id),
+        "status": "parsing",
+        "message": "文件上传成功,正在后台解析...",
+        "file_name": dataset.name,
+        "file_size": upload['file_size']
+    }
+
+
+@router.delete("/upload_dataset/{dataset_id}")
+async def abort_upload(
+    dataset_id: str,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    取消上传,删除已上传的分片和上传记录
+
+    Args:
+        dataset_id: 数据集ID
+        session: 数据库会话
+
+    Returns:
+        取消结果
+    """
+    dataset = await _get_uploading_dataset(session, dataset_id)
+    upload = dataset.extra_metadata['upload']
+    await asyncio.to_thread(minio_client.abort_multipart_upload, upload['object_name'], upload['upload_id'])
+
+    await session.delete(dataset)
+    await session.commit()
+    logger.info(f"上传已取消: {dataset_id}")
+
+    return {
+        "success": True,
+        "message": "上传已取消",
+        "dataset_id": dataset_id
+    }
+
 
 @router.get("/dataset/{dataset_id}/status")
 async def get_dataset_status(
@@ -182,21 +540,39 @@ async def get_dataset_status(
         if not dataset:
             raise HTTPException(status_code=404, detail="数据集不存在")
 
+        # 数据库中的进度只在检查点更新,进行中的阶段使用Redis中最近发布的进度
+        progress = {
+            'parse': dataset.parse_progress,
+            'chunk': dataset.chunk_progress,
+            'vectorize': dataset.vectorize_progress,
+            'embedding': dataset.embedding_progress,
+        }
+        in_progress = {
+            'parse': dataset.parse_status == 'parsing',
+            'chunk': dataset.chunk_status == 'chunking',
+            'vectorize': dataset.vectorize_status == 'vectorizing',
+            'embedding': dataset.embedding_status == 'embedding',
+        }
+        if any(in_progress.values()):
+            for stage, live in (await get_live_progress(dataset_id)).items():
+                if in_progress[stage] and live > (progress[stage] or 0):
+                    progress[stage] = live
+
         return {
             "dataset_id": str(dataset.id),
             "name": dataset.name,
             "logical_name": dataset.logical_name,
             "parse_status": dataset.parse_status,
-            "parse_progress": dataset.parse_progress,
+            "parse_progress": progress['parse'],
             "chunk_status": dataset.chunk_status,
-            "chunk_progress": dataset.chunk_progress,
+            "chunk_progress": progress['chunk'],
             "chunk_error": dataset.chunk_error,
             "vectorize_status": dataset.vectorize_status,
-            "vectorize_progress": dataset.vectorize_progress,
+            "vectorize_progress": progress['vectorize'],
             "vectorize_error": dataset.vectorize_error,
             # 保留旧字段以向后兼容
             "embedding_status": dataset.embedding_status,
-            "embedding_progress": dataset.embedding_progress,
+            "embedding_progress": progress['embedding'],
             "embedding_error": dataset.embedding_error,
             "row_count": dataset.row_count,
             "column_count": dataset.column_count,
@@ -219,7 +595,7 @@ async def list_datasets(
     session: AsyncSession = Depends(get_async_session)
 ):
     """
-    获取数据集列表
+    获取数据集列表(不含尚未完成上传的数据集)
 
     Args:
         skip: 跳过数量
@@ -232,6 +608,7 @@ async def list_datasets(
     try:
         result = await session.execute(
             select(SysDataset)
+            .where(SysDataset.parse_status != 'uploading')
             .order_by(SysDataset.created_at.desc())
             .offset(skip)
             .limit(limit)
@@ -264,7 +641,6 @@ async def list_datasets(
 @router.post("/dataset/{dataset_id}/retry_parse")
 async def retry_parse_dataset(
     dataset_id: str,
-    background_tasks: BackgroundTasks,
     session: AsyncSession = Depends(get_async_session)
 ):
     """
@@ -272,7 +648,6 @@ async def retry_parse_dataset(
 
     Args:
         dataset_id: 数据集ID
-        background_tasks: 后台任务
         session: 数据库会话
 
     Returns:
@@ -299,13 +674,12 @@ async def retry_parse_dataset(
         dataset.error_message = None
         await session.commit()
 
-        # 添加后台解析任务
-        from services.dataset_parser import parse_dataset_task
-        background_tasks.add_task(
-            parse_dataset_task,
-            str(dataset.id),
-            dataset.original_file_path,
-            dataset.name
+        # 用户主动重试,优先执行
+        await enqueue_dataset_job(
+            'parse',
+            dataset.id,
+            {'file_path': dataset.original_file_path, 'filename': dataset.name},
+            priority=PRIORITY_HIGH
         )
 
         return {
@@ -324,7 +698,6 @@ async def retry_parse_dataset(
 @router.post("/dataset/{dataset_id}/retry_embedding")
 async def retry_embedding(
     dataset_id: str,
-    background_tasks: BackgroundTasks,
     session: AsyncSession = Depends(get_async_session)
 ):
     """
@@ -332,7 +705,6 @@ async def retry_embedding(
 
     Args:
         dataset_id: 数据集ID
-        background_tasks: 后台任务
         session: 数据库会话
 
     Returns:
@@ -365,62 +737,7 @@ async def retry_embedding(
         dataset.embedding_error = None
         await session.commit()
 
-        # 添加后台任务生成embedding
-        async def retry_embedding_task():
-            from db.session import async_session
-            from services.embedding_service import generate_column_embeddings
-            from sqlalchemy import select as sql_select
-            from models.sys_dataset import SysDatasetColumn
-
-            async with async_session() as sess:
-                # 获取列信息
-                col_result = await sess.execute(
-                    sql_select(SysDatasetColumn)
-                    .where(SysDatasetColumn.dataset_id == dataset_id)
-                    .order_by(SysDatasetColumn.col_index)
-                )
-                columns = col_result.scalars().all()
-
-                if not columns:
-                    logger.error(f"数据集 {dataset_id} 没有列信息")
-                    return
-
-                # 构造schema_info
-                schema_info = []
-                for col in columns:
-                    schema_info.append({
-                        'name': col.col_name,
-                        'type': col.col_type,
-                        'stats': col.stats or {},
-                        'samples': col.sample_values or []
-                    })
-
-                # 更新状态为embedding
-                ds_result = await sess.execute(
-                    sql_select(SysDataset).where(SysDataset.id == dataset_id)
-                )
-                ds = ds_result.scalar_one()
-                ds.embedding_status = 'embedding'
-                ds.embedding_progress = 0
-                await sess.commit()
-
-                try:
-                    # 生成embedding
-                    await generate_column_embeddings(str(dataset_id), schema_info)
-
-                    # 更新为完成
-                    ds.embedding_status = 'completed'
-                    ds.embedding_progress = 100
-                    await sess.commit()
-                    logger.info(f"数据集 {dataset_id} embedding重新生成成功")
-
-                except Exception as e:
-                    logger.error(f"数据集 {dataset_id} embedding重新生成失败: {e}")
-                    ds.embedding_status = 'failed'
-                    ds.embedding_error = str(e)
-                    await sess.commit()
-
-        background_tasks.add_task(retry_embedding_task)
+        await enqueue_dataset_job('embedding', dataset.id, priority=PRIORITY_HIGH)
 
         return {
             "success": True,
@@ -478,6 +795,11 @@ async def delete_dataset(
         # 2. 删除MinIO中的文件
         minio_errors = []
 
+        # 未完成的分片上传
+        upload = (dataset.extra_metadata or {}).get('upload')
+        if upload:
+            minio_client.abort_multipart_upload(upload['object_name'], upload['upload_id'])
+
         # 删除原始文件
         if dataset.original_file_path:
             try:
@@ -510,11 +832,27 @@ async def delete_dataset(
                 logger.warning(error_msg)
                 minio_errors.append(error_msg)
 
+        # 删除汇总表文件
+        if dataset.extra_metadata and dataset.extra_metadata.get('rollups'):
+            from services.dataset_rollup import delete_dataset_rollups
+            delete_dataset_rollups(dataset.extra_metadata['rollups'])
+
+        # 清理本地查询缓存(Parquet文件、DuckDB视图)
+        try:
+            from services.duckdb_query import invalidate_dataset_cache
+            invalidate_dataset_cache(dataset_id)
+        except Exception as e:
+            logger.warning(f"清理本地查询缓存失败 (继续执行): {e}")
+
         # 3. 删除数据库记录
         await session.delete(dataset)
         await session.commit()
         logger.info(f"数据库记录删除成功: {dataset_id}")
 
+        # 删除提交前可能有并发请求重新缓存了元数据;同时通知其他进程清理缓存
+        from services.cache_invalidation import broadcast_dataset_invalidation
+        await broadcast_dataset_invalidation(dataset_id)
+
         # 构建响应消息
         message = "数据集已成功删除"
         if minio_errors:
@@ -545,7 +883,6 @@ async def delete_dataset(
 @router.post("/dataset/{dataset_id}/retry_chunk")
 async def retry_chunk(
     dataset_id: str,
-    background_tasks: BackgroundTasks,
     session: AsyncSession = Depends(get_async_session)
 ):
     """
@@ -553,7 +890,6 @@ async def retry_chunk(
 
     Args:
         dataset_id: 数据集ID
-        background_tasks: 后台任务
         session: 数据库会话
 
     Returns:
@@ -590,88 +926,8 @@ async def retry_chunk(
         dataset.vectorize_error = None
         await session.commit()
 
-        # 添加后台任务
-        async def retry_chunk_task():
-            from db.session import async_session
-            from models.sys_dataset import SysDatasetColumn
-            from sqlalchemy import select as sql_select
-            from services.embedding_service import build_column_description, vectorize_columns
-
-            async with async_session() as sess:
-                # 获取列信息
-                col_result = await sess.execute(
-                    sql_select(SysDatasetColumn)
-                    .where(SysDatasetColumn.dataset_id == dataset_id)
-                    .order_by(SysDatasetColumn.col_index)
-                )
-                columns = col_result.scalars().all()
-
-                if not columns:
-                    logger.error(f"数据集 {dataset_id} 没有列信息")
-                    return
-
-                # 构造schema_info
-                schema_info = []
-                for col in columns:
-                    schema_info.append({
-                        'name': col.col_name,
-                        'type': col.col_type,
-                        'stats': col.stats or {},
-                        'samples': col.sample_values or []
-                    })
-
-                # 更新为chunking状态
-                ds_result = await sess.execute(
-                    sql_select(SysDataset).where(SysDataset.id == dataset_id)
-                )
-                ds = ds_result.scalar_one()
-
-                try:
-                    # 执行分片
-                    ds.chunk_status = 'chunking'
-                    ds.chunk_progress = 0
-                    await sess.commit()
-
-                    chunked_data = []
-                    for idx, col_info in enumerate(schema_info):
-                        description = build_column_description(col_info)
-                        chunked_data.append({
-                            'index': idx,
-                            'col_info': col_info,
-                            'description': description
-                        })
-                        progress = int((idx + 1) / len(schema_info) * 100)
-                        ds.chunk_progress = progress
-                        await sess.commit()
-
-                    ds.chunk_status = 'completed'
-                    ds.chunk_progress = 100
-                    await sess.commit()
-                    logger.info(f"数据集 {dataset_id} 分片重试完成")
-
-                    # 自动执行向量化
-                    ds.vectorize_status = 'vectorizing'
-                    ds.vectorize_progress = 0
-                    await sess.commit()
-
-                    await vectorize_columns(str(dataset_id), chunked_data)
-
-                    ds.vectorize_status = 'completed'
-                    ds.vectorize_progress = 100
-                    await sess.commit()
-                    logger.info(f"数据集 {dataset_id} 向量化完成")
-
-                except Exception as e:
-                    logger.error(f"重试失败: {e}")
-                    if ds.chunk_status != 'completed':
-                        ds.chunk_status = 'failed'
-                        ds.chunk_error = str(e)
-                    else:
-                        ds.vectorize_status = 'failed'
-                        ds.vectorize_error = str(e)
-                    await sess.commit()
-
-        background_tasks.add_task(retry_chunk_task)
+        # 分片完成后由队列继续执行向量化
+        await enqueue_dataset_job('chunk', dataset.id, priority=PRIORITY_HIGH)
 
         return {
             "success": True,
@@ -689,7 +945,6 @@ async def retry_chunk(
 @router.post("/dataset/{dataset_id}/retry_vectorize")
 async def retry_vectorize(
     dataset_id: str,
-    background_tasks: BackgroundTasks,
     session: AsyncSession = Depends(get_async_session)
 ):
     """
@@ -697,7 +952,6 @@ async def retry_vectorize(
 
     Args:
         dataset_id: 数据集ID
-        background_tasks: 后台任务
         session: 数据库会话
 
     Returns:
@@ -736,67 +990,7 @@ async def retry_vectorize(
         dataset.vectorize_error = None
         await session.commit()
 
-        # 添加后台任务
-        async def retry_vectorize_task():
-            from db.session import async_session
-            from models.sys_dataset import SysDatasetColumn
-            from sqlalchemy import select as sql_select
-            from services.embedding_service import build_column_description, vectorize_columns
-
-            async with async_session() as sess:
-                # 获取列信息
-                col_result = await sess.execute(
-                    sql_select(SysDatasetColumn)
-                    .where(SysDatasetColumn.dataset_id == dataset_id)
-                    .order_by(SysDatasetColumn.col_index)
-                )
-                columns = col_result.scalars().all()
-
-                if not columns:
-                    logger.error(f"数据集 {dataset_id} 没有列信息")
-                    return
-
-                # 重新构造chunked_data
-                chunked_data = []
-                for idx, col in enumerate(columns):
-                    col_info = {
-                        'name': col.col_name,
-                        'type': col.col_type,
-                        'stats': col.stats or {},
-                        'samples': col.sample_values or []
-                    }
-                    description = build_column_description(col_info)
-                    chunked_data.append({
-                        'index': idx,
-                        'col_info': col_info,
-                        'description': description
-                    })
-
-                # 更新为vectorizing状态
-                ds_result = await sess.execute(
-                    sql_select(SysDataset).where(SysDataset.id == dataset_id)
-                )
-                ds = ds_result.scalar_one()
-
-                try:
-                    ds.vectorize_status = 'vectorizing'
-                    ds.vectorize_progress = 0
-                    await sess.commit()
-
-                    await vectorize_columns(str(dataset_id), chunked_data)
-
-                    ds.vectorize_status = 'completed'
-                    ds.vectorize_progress = 100
-                    await sess.commit()
-                    logger.info(f"数据集 {dataset_id} 向量化重试成功")
-
-                except Exception as e:
-                    logger.error(f"向量化重试失败: {e}")
-                    ds.vectorize_status = 'failed'
-                    ds.vectorize_error = str(e)
-                    await sess.commit()
-
-        background_tasks.add_task(retry_vectorize_task)
+        await enqueue_dataset_job('vectorize', dataset.id, priority=PRIORITY_HIGH)
 
         return {
             "success": True,
@@ -13,8 +13,10 @@ import pandas as pd
 import json
 
 from models.sys_dataset import SysDataset
+from core.config import settings
 from core.minio_client import minio_client
 from api.dependencies.dependencies import get_async_session
+from services.csv_reader import detect_encoding, read_csv_head
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -70,25 +72,8 @@ async def get_original_file_preview(
         if file_name.endswith('.csv'):
             # CSV文件预览
             try:
-                # 尝试不同的编码
-                encodings = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig']
-                df = None
-                used_encoding = None
-                
-                for encoding in encodings:
-                    try:
-                        df = pd.read_csv(
-                            io.BytesIO(file_data),
-                            encoding=encoding,
-                            nrows=lines
-                        )
-                        used_encoding = encoding
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                
-                if df is None:
-                    raise HTTPException(status_code=500, detail="无法解析CSV文件编码")
+                # 由文件开头的样本检测编码,样本之后的内容无法解码时改用下一个候选编码
+                df, used_encoding = read_csv_head(file_data, lines)
                 
                 # 转换为JSON格式返回
                 preview_data = df.to_dict('records')
@@ -223,20 +208,9 @@ async def get_original_file_preview(
                 # 策略4: 尝试CSV格式读取（某些Excel文件可能是CSV格式）
                 if df is None:
                     try:
-                        # 尝试不同编码
-                        encodings = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig', 'latin1']
-                        for encoding in encodings:
-                            try:
-                                df = pd.read_csv(
-                                    io.BytesIO(file_data),
-                                    encoding=encoding,
-                                    nrows=lines
-                                )
-                                success_method = f"CSV格式读取({encoding})"
-                                logger.info(f"策略4成功: {success_method}")
-                                break
-                            except UnicodeDecodeError:
-                                continue
+                        df, encoding = read_csv_head(file_data, lines)
+                        success_method = f"CSV格式读取({encoding})"
+                        logger.info(f"策略4成功: {success_method}")
                         
                     except Exception as e4:
                         errors.append(f"CSV格式读取: {str(e4)}")
@@ -284,17 +258,13 @@ async def get_original_file_preview(
             # 其他文件类型，返回原始文本内容
             try:
                 # 尝试以文本形式读取
-                encodings = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig']
                 content = None
-                used_encoding = None
-                
-                for encoding in encodings:
+                used_encoding = detect_encoding(file_data[:settings.PARSE_ENCODING_SAMPLE_BYTES])
+                if used_encoding != 'latin1':
                     try:
-                        content = file_data.decode(encoding)
-                        used_encoding = encoding
-                        break
+                        content = file_data.decode(used_encoding)
                     except UnicodeDecodeError:
-                        continue
+                        pass
                 
                 if content is None:
                     # 如果无法解码为文本，返回二进制信息
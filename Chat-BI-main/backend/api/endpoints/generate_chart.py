@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 from api.schemas.user_input import UserInput
@@ -13,6 +14,7 @@ from api.dependencies.dependencies import get_async_session, redis_client
 from services.intent_router import classify_intent, IntentType
 from services.embedding_service import search_relevant_columns
 from services.duckdb_query import query_parquet_with_duckdb
+from services.query_guard import QueryRejectedError
 from services.multi_dataset_query import smart_multi_dataset_query
 from services.conversation_service import (
     save_user_message,
@@ -21,15 +23,15 @@ from services.conversation_service import (
     update_conversation_summary
 )
 from services.agents import judge_visualization_type
+from services.arrow_utils import dataframe_to_json_records
 from api.utils.error_utils import format_error_message
 from api.utils.logger import error_logger
 from api.endpoints.progress_stream import get_progress_manager  # 导入进度管理器
+from core.config import settings
 import logging
 import asyncio
 import pandas as pd
 import time
-import math
-import numpy as np
 import json
 import uuid  # 用于生成任务ID
 
@@ -171,17 +173,26 @@ async def generate_chart(
                         for col in relevant_columns[:10]
                     ])
 
-                    # 生成SQL查询
-                    sql_query = await generate_sql_for_dataset(
-                        user_input.user_input,
-                        relevant_columns,
-                        dataset_id
-                    )
+                    # 生成SQL查询并执行,被准入检查拒绝时带上拒绝原因重新生成
+                    feedback = None
+                    for attempt in range(settings.QUERY_GUARD_MAX_RETRIES + 1):
+                        sql_query = await generate_sql_for_dataset(
+                            user_input.user_input,
+                            relevant_columns,
+                            dataset_id,
+                            feedback=feedback
+                        )
+                        if not sql_query:
+                            break
 
-                    if sql_query:
-                        # 使用DuckDB查询Parquet
-                        df = await query_parquet_with_duckdb(dataset_id, sql_query)
-                        logger.info(f"DuckDB查询成功: {len(df) if df is not None else 0} 行")
+                        try:
+                            # 使用DuckDB查询Parquet
+                            df = await query_parquet_with_duckdb(dataset_id, sql_query)
+                            logger.info(f"DuckDB查询成功: {len(df) if df is not None else 0} 行")
+                            break
+                        except QueryRejectedError as e:
+                            logger.warning(f"SQL被准入检查拒绝(第{attempt + 1}次): {e}")
+                            feedback = f"上一次生成的SQL因代价过高被拒绝执行。\nSQL: {sql_query}\n原因: {e}"
 
                 except Exception as e:
                     logger.error(f"查询用户数据集失败: {e}")
@@ -303,6 +314,9 @@ async def generate_chart(
         visualization_type = viz_judgment["visualization_type"]
         logger.info(f"Agent判断可视化类型: {visualization_type} (置信度: {viz_judgment['confidence']}, 理由: {viz_judgment['reason']})")
 
+        # 查询结果只序列化一次(按列向量化处理日期和空值),后续复用
+        data_json = dataframe_to_json_records(df)
+
         # 步骤5: 根据可视化类型决定后续处理
         refined_data = None
         chart_type = "bar"
@@ -317,7 +331,7 @@ async def generate_chart(
                 )
                 chart_type_task = determine_chart_type(
                     user_input.user_input,
-                    df.to_json(orient="records"),
+                    data_json,
                     user_id=user_input.user_id
                 )
 
@@ -351,7 +365,7 @@ async def generate_chart(
         try:
             task_data = {
                 "user_input": user_input.user_input,
-                "data": df.to_json(orient="records"),
+                "data": data_json,
                 "user_id": user_input.user_id,
                 "conversation_id": conversation_id
             }
@@ -371,7 +385,7 @@ async def generate_chart(
                 execute_insight_analysis_task(
                     insight_task_id,
                     user_input.user_input,
-                    df.to_json(orient="records"),
+                    data_json,
                     user_input.user_id
                 )
             )
@@ -381,22 +395,7 @@ async def generate_chart(
 
         logger.info(f"数据处理完成: visualization_type={visualization_type}, refined_data={refined_data}, chart_type={chart_type}")
 
-        # 将日期对象转换为字符串格式，并处理无效的float值
-        data_records = df.to_dict(orient="records")
-        for record in data_records:
-            for key, value in record.items():
-                if isinstance(value, datetime):
-                    record[key] = value.strftime("%Y-%m-%d")
-                elif isinstance(value, (float, np.float64, np.float32)):
-                    # 处理无效的float值
-                    if math.isnan(value) or math.isinf(value):
-                        record[key] = None
-                    else:
-                        record[key] = float(value)
-                elif isinstance(value, (np.int64, np.int32)):
-                    record[key] = int(value)
-                elif pd.isna(value):
-                    record[key] = None
+        data_records = json.loads(data_json)
 
         # 步骤7: 完成处理
         await progress_manager.update_progress(task_id, "query_execution", 100, "数据处理完成")
@@ -418,11 +417,11 @@ async def generate_chart(
         # 将数据存储到Redis供流式分析使用
         await redis_client.set(
             f"chart_data:{user_input.user_input}",
-            df.to_json(orient="records"),
+            data_json,
             ex=3600  # 1小时过期
         )
 
-        logger.info("Successfully generated chart data:\n %s", result)
+        logger.info(f"Successfully generated chart data: {len(data_records)} 行, visualization_type={visualization_type}")
 
         # 保存AI回复到数据库(包含图表数据)
         if conversation_id:
@@ -481,7 +480,8 @@ async def generate_chart(
 
         # 洞察分析任务已在上面启动，无需额外处理
 
-        return result
+        # 结果均为原生JSON类型,直接序列化返回,跳过逐单元格的jsonable_encoder
+        return JSONResponse(content=result)
 
     except Exception as e:
         logger.exception("An error occurred while generating chart")
@@ -553,12 +553,16 @@ async def generate_chart(
 async def generate_sql_for_dataset(
     user_query: str,
     relevant_columns: list,
-    dataset_id: str
+    dataset_id: str,
+    feedback: str = None
 ) -> str:
     """
     为用户数据集生成SQL查询
 
     使用LLM生成更智能的SQL查询
+
+    Args:
+        feedback: 上一次SQL被拒绝的原因,不为空时要求LLM据此修改
     """
     from api.utils.ai_utils import call_configured_ai_model
 
@@ -603,6 +607,12 @@ SELECT ...
 - 如果问题涉及数据内容，使用 SELECT * 或选择相关列
 - 如果需要聚合，使用合适的GROUP BY
 - 优先使用相关度高的列
+- 避免笛卡尔积(多表必须有等值连接条件),对大量数据排序时必须带LIMIT
+"""
+    if feedback:
+        system_prompt += f"""
+**上一次生成的SQL未通过检查,请据此修改:**
+{feedback}
 """
 
     try:
@@ -1,5 +1,7 @@
 from fastapi import APIRouter, HTTPException, Query
 from api.utils.monitoring import error_monitor
+from services.query_executor import query_executor
+from services.query_result_cache import query_result_cache
 from typing import Optional
 
 router = APIRouter()
@@ -70,6 +72,38 @@ async def get_performance_statistics(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取性能统计失败: {str(e)}")
 
+@router.get("/query-executor")
+async def get_query_executor_statistics():
+    """
+    获取DuckDB查询执行器指标
+
+    Returns:
+        排队深度、运行中数量、超时/拒绝次数等
+    """
+    try:
+        return {
+            "success": True,
+            "data": query_executor.get_stats()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取查询执行器指标失败: {str(e)}")
+
+@router.get("/query-cache")
+async def get_query_cache_statistics():
+    """
+    获取DuckDB查询结果缓存指标
+
+    Returns:
+        缓存条目数、占用字节数、命中率等
+    """
+    try:
+        return {
+            "success": True,
+            "data": query_result_cache.get_stats()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取查询缓存指标失败: {str(e)}")
+
 @router.get("/health-check")
 async def health_check():
     """
@@ -40,6 +40,7 @@ class Settings:
     MINIO_SECRET_KEY: str = os.getenv("MINIO_SECRET_KEY", "minioadmin123")
     MINIO_BUCKET: str = os.getenv("MINIO_BUCKET", "chatbi-datasets")
     MINIO_SECURE: bool = os.getenv("MINIO_SECURE", "False").lower() in ("true", "1", "t")
+    MINIO_UPLOAD_PART_SIZE: int = int(os.getenv("MINIO_UPLOAD_PART_SIZE", 16 * 1024 * 1024))  # 流式上传的分片大小(不小于5MB)
 
     # Qdrant向量数据库配置
     QDRANT_URL: str = os.getenv("QDRANT_URL", "http://localhost:6333")
@@ -53,8 +54,108 @@ class Settings:
 
     # 文件上传配置
     MAX_UPLOAD_SIZE: int = int(os.getenv("MAX_UPLOAD_SIZE", 100 * 1024 * 1024))  # 100MB
+    UPLOAD_EXPIRE_SECONDS: int = int(os.getenv("UPLOAD_EXPIRE_SECONDS", 24 * 3600))  # 可续传上传创建后超过该时间未完成即清理
+    UPLOAD_SWEEP_INTERVAL: int = int(os.getenv("UPLOAD_SWEEP_INTERVAL", 600))  # worker清理过期上传的间隔(秒)
     ALLOWED_EXTENSIONS: list = [".csv", ".xlsx", ".xls", ".et"]  # 支持CSV和Excel (.et为WPS格式，可能需要转换)
 
+    # Parquet写入布局配置(按日期/低基数列排序,控制行组大小,便于DuckDB按统计信息跳过行组)
+    PARQUET_ROW_GROUP_TARGET_BYTES: int = int(os.getenv("PARQUET_ROW_GROUP_TARGET_BYTES", 16 * 1024 * 1024))  # 16MB
+    PARQUET_ROW_GROUP_MIN_ROWS: int = int(os.getenv("PARQUET_ROW_GROUP_MIN_ROWS", 10000))
+    PARQUET_ROW_GROUP_MAX_ROWS: int = int(os.getenv("PARQUET_ROW_GROUP_MAX_ROWS", 122880))  # DuckDB默认行组大小
+    PARQUET_SORT_MAX_CARDINALITY: int = int(os.getenv("PARQUET_SORT_MAX_CARDINALITY", 1000))
+
+    # 数据集解析配置(分块读取并写入Parquet,峰值内存与块大小成正比)
+    PARSE_CHUNK_ROWS: int = int(os.getenv("PARSE_CHUNK_ROWS", 100000))
+    PARSE_TEMP_DIR: str = os.getenv("PARSE_TEMP_DIR", "cache/parse_tmp")
+    PARSE_EXACT_DISTINCT_LIMIT: int = int(os.getenv("PARSE_EXACT_DISTINCT_LIMIT", 100000))  # 超过后不同值数改为估计
+    PARSE_STATS_SAMPLE_SIZE: int = int(os.getenv("PARSE_STATS_SAMPLE_SIZE", 10000))  # 估计中位数的抽样数
+    PARSE_TYPE_SAMPLE_SIZE: int = int(os.getenv("PARSE_TYPE_SAMPLE_SIZE", 1000))  # 推断文本列类型时先检查的样本数
+    PARSE_PROFILE_WORKERS: int = int(os.getenv("PARSE_PROFILE_WORKERS", 4))  # 列统计进程数,不大于1时在解析线程中计算
+    PARSE_PROFILE_MIN_COLUMNS: int = int(os.getenv("PARSE_PROFILE_MIN_COLUMNS", 8))  # 列数达到该值才使用进程池
+    PARSE_PROGRESS_INTERVAL: float = float(os.getenv("PARSE_PROGRESS_INTERVAL", 1.0))  # 解析进度的更新间隔(秒)
+    PARSE_CSV_NATIVE: bool = os.getenv("PARSE_CSV_NATIVE", "True").lower() in ("true", "1", "t")  # 使用PyArrow多线程读取CSV,失败时回退pandas
+    PARSE_CSV_BLOCK_SIZE: int = int(os.getenv("PARSE_CSV_BLOCK_SIZE", 8 * 1024 * 1024))  # PyArrow每次读取的字节数
+    PARSE_ENCODING_SAMPLE_BYTES: int = int(os.getenv("PARSE_ENCODING_SAMPLE_BYTES", 65536))  # 检测编码的样本字节数
+
+    # 数据集后台任务队列配置(Redis持久化,由 worker.py 独立进程执行 解析/分片/向量化)
+    JOB_CONCURRENCY_PARSE: int = int(os.getenv("JOB_CONCURRENCY_PARSE", 2))  # 各阶段在所有worker上同时执行的任务数上限
+    JOB_CONCURRENCY_CHUNK: int = int(os.getenv("JOB_CONCURRENCY_CHUNK", 4))
+    JOB_CONCURRENCY_VECTORIZE: int = int(os.getenv("JOB_CONCURRENCY_VECTORIZE", 2))
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+    JOB_RETRY_BASE_DELAY: float = float(os.getenv("JOB_RETRY_BASE_DELAY", 30))  # 重试间隔(秒),每次失败后翻倍
+    JOB_RETRY_MAX_DELAY: float = float(os.getenv("JOB_RETRY_MAX_DELAY", 600))
+    JOB_LEASE_SECONDS: int = int(os.getenv("JOB_LEASE_SECONDS", 300))  # worker未续租超过该时间视为已退出,任务重新入队
+    JOB_POLL_INTERVAL: float = float(os.getenv("JOB_POLL_INTERVAL", 1.0))  # 队列为空时的轮询间隔(秒)
+    JOB_RESULT_TTL: int = int(os.getenv("JOB_RESULT_TTL", 7 * 24 * 3600))  # 任务记录保留时间(秒)
+    JOB_WORKER_EMBEDDED: bool = os.getenv("JOB_WORKER_EMBEDDED", "False").lower() in ("true", "1", "t")  # 在API进程内运行worker(仅用于开发环境)
+
+    # 数据集处理进度上报配置(节流后发布到Redis供SSE推送,只在检查点写入数据库)
+    PROGRESS_PUBLISH_INTERVAL: float = float(os.getenv("PROGRESS_PUBLISH_INTERVAL", 0.5))  # 发布间隔(秒)
+    PROGRESS_PUBLISH_STEP: int = int(os.getenv("PROGRESS_PUBLISH_STEP", 5))  # 进度增加达到该值时立即发布
+    PROGRESS_CHECKPOINT_INTERVAL: float = float(os.getenv("PROGRESS_CHECKPOINT_INTERVAL", 10))  # 写入数据库的间隔(秒)
+    PROGRESS_CHECKPOINT_STEP: int = int(os.getenv("PROGRESS_CHECKPOINT_STEP", 25))  # 进度增加达到该值时写入数据库
+
+    # Parquet本地缓存配置(DuckDB查询时避免重复从MinIO下载)
+    PARQUET_CACHE_DIR: str = os.getenv("PARQUET_CACHE_DIR", "cache/parquet")
+    PARQUET_CACHE_MAX_BYTES: int = int(os.getenv("PARQUET_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))  # 2GB
+
+    # DuckDB引擎配置
+    DUCKDB_POOL_SIZE: int = int(os.getenv("DUCKDB_POOL_SIZE", 4))
+    DUCKDB_THREADS: int = int(os.getenv("DUCKDB_THREADS", 4))
+    DUCKDB_MEMORY_LIMIT: str = os.getenv("DUCKDB_MEMORY_LIMIT", "2GB")
+    DUCKDB_TEMP_DIRECTORY: str = os.getenv("DUCKDB_TEMP_DIRECTORY", "cache/duckdb_tmp")
+    DUCKDB_MAX_TEMP_DIRECTORY_SIZE: str = os.getenv("DUCKDB_MAX_TEMP_DIRECTORY_SIZE", "10GB")  # 单个大查询溢写磁盘的上限
+    DUCKDB_RESTRICT_FILE_ACCESS: bool = os.getenv("DUCKDB_RESTRICT_FILE_ACCESS", "True").lower() in ("true", "1", "t")  # 只允许读写缓存目录下的文件
+
+    # 查询准入检查配置(执行前EXPLAIN估算代价,拒绝笛卡尔积、超大连接和无界排序)
+    QUERY_GUARD_ENABLED: bool = os.getenv("QUERY_GUARD_ENABLED", "True").lower() in ("true", "1", "t")
+    QUERY_GUARD_MAX_COST: float = float(os.getenv("QUERY_GUARD_MAX_COST", 1e10))
+    QUERY_GUARD_MAX_JOIN_ROWS: float = float(os.getenv("QUERY_GUARD_MAX_JOIN_ROWS", 1e8))
+    QUERY_GUARD_MAX_SORT_ROWS: float = float(os.getenv("QUERY_GUARD_MAX_SORT_ROWS", 1e7))
+    QUERY_GUARD_MAX_RETRIES: int = int(os.getenv("QUERY_GUARD_MAX_RETRIES", 2))  # 被拒绝后带原因重新生成SQL的次数
+
+    # DuckDB查询执行器配置(线程池,避免阻塞事件循环)
+    QUERY_EXECUTOR_WORKERS: int = int(os.getenv("QUERY_EXECUTOR_WORKERS", 4))
+    QUERY_EXECUTOR_MAX_QUEUE: int = int(os.getenv("QUERY_EXECUTOR_MAX_QUEUE", 32))
+    QUERY_TIMEOUT_SECONDS: float = float(os.getenv("QUERY_TIMEOUT_SECONDS", 60))
+    MULTI_DATASET_QUERY_CONCURRENCY: int = int(os.getenv("MULTI_DATASET_QUERY_CONCURRENCY", 4))  # 多数据集查询的并发上限
+
+    # DuckDB查询结果缓存配置
+    QUERY_RESULT_CACHE_ENABLED: bool = os.getenv("QUERY_RESULT_CACHE_ENABLED", "True").lower() in ("true", "1", "t")
+    QUERY_RESULT_CACHE_MAX_BYTES: int = int(os.getenv("QUERY_RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # 256MB
+    QUERY_RESULT_CACHE_TTL: int = int(os.getenv("QUERY_RESULT_CACHE_TTL", 600))  # 10分钟
+
+    # 数据集元数据缓存配置(多数据集查询时的数据集及列信息,进程内缓存)
+    DATASET_METADATA_CACHE_TTL: int = int(os.getenv("DATASET_METADATA_CACHE_TTL", 300))  # 秒, 0表示不缓存
+    DATASET_METADATA_CACHE_MAX_ENTRIES: int = int(os.getenv("DATASET_METADATA_CACHE_MAX_ENTRIES", 1024))
+
+    # 汇总表配置(解析后为常用 维度×指标 预聚合,分组查询改写到汇总表执行)
+    ROLLUP_ENABLED: bool = os.getenv("ROLLUP_ENABLED", "True").lower() in ("true", "1", "t")
+    ROLLUP_MIN_ROWS: int = int(os.getenv("ROLLUP_MIN_ROWS", 100000))
+    ROLLUP_MAX_DIMENSIONS: int = int(os.getenv("ROLLUP_MAX_DIMENSIONS", 3))
+    ROLLUP_MAX_MEASURES: int = int(os.getenv("ROLLUP_MAX_MEASURES", 10))
+    ROLLUP_MAX_DIMENSION_CARDINALITY: int = int(os.getenv("ROLLUP_MAX_DIMENSION_CARDINALITY", 10000))
+
+    # 近似查询配置(大数据集在抽样数据上执行聚合,返回估计值和误差范围)
+    APPROX_QUERY_MIN_ROWS: int = int(os.getenv("APPROX_QUERY_MIN_ROWS", 1000000))  # 行数低于此值时执行精确查询
+    APPROX_QUERY_TARGET_ROWS: int = int(os.getenv("APPROX_QUERY_TARGET_ROWS", 500000))  # 自动抽样率的目标样本行数
+    APPROX_QUERY_MIN_SAMPLE_RATE: float = float(os.getenv("APPROX_QUERY_MIN_SAMPLE_RATE", 0.001))
+    APPROX_QUERY_MAX_SAMPLE_RATE: float = float(os.getenv("APPROX_QUERY_MAX_SAMPLE_RATE", 0.5))  # 超过时抽样收益不大,执行精确查询
+    APPROX_QUERY_SEED: int = int(os.getenv("APPROX_QUERY_SEED", 42))
+
+    # 跨数据集连接规划配置(按列名、列向量和取值重合度识别连接键,生成一条JOIN查询)
+    JOIN_PLANNER_ENABLED: bool = os.getenv("JOIN_PLANNER_ENABLED", "True").lower() in ("true", "1", "t")
+    JOIN_SKETCH_SIZE: int = int(os.getenv("JOIN_SKETCH_SIZE", 128))  # 解析时每列保存的取值哈希数
+    JOIN_MIN_SCORE: float = float(os.getenv("JOIN_MIN_SCORE", 0.6))
+    JOIN_MIN_OVERLAP: float = float(os.getenv("JOIN_MIN_OVERLAP", 0.3))  # 较小取值集合被另一侧包含的最低比例
+    JOIN_KEY_MIN_UNIQUE_RATIO: float = float(os.getenv("JOIN_KEY_MIN_UNIQUE_RATIO", 0.95))  # 至少一侧需接近唯一,避免多对多连接
+
+    # 查询结果分页/流式读取配置(结果物化为Parquet文件,通过句柄分页读取)
+    QUERY_RESULT_DIR: str = os.getenv("QUERY_RESULT_DIR", "cache/query_results")
+    QUERY_HANDLE_TTL: int = int(os.getenv("QUERY_HANDLE_TTL", 1800))  # 30分钟
+    QUERY_RESULT_MAX_ROWS: int = int(os.getenv("QUERY_RESULT_MAX_ROWS", 1000000))
+    QUERY_PAGE_MAX_SIZE: int = int(os.getenv("QUERY_PAGE_MAX_SIZE", 5000))
+
     @property
     def RELOAD(self) -> bool:
         return self.FASTAPI_ENV == "development"
@@ -3,11 +3,13 @@ MinIO对象存储客户端封装
 用于文件上传、下载和管理
 """
 from minio import Minio
+from minio.datatypes import Part
 from minio.error import S3Error
 from core.config import settings
+import hashlib
 import io
 import logging
-from typing import Optional
+from typing import BinaryIO, List, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -69,6 +71,205 @@ class MinIOClient:
             logger.error(f"文件上传失败: {e}")
             raise
 
+    def upload_stream(self, stream: BinaryIO, object_name: str, content_type: str = "application/octet-stream") -> str:
+        """
+        以未知长度的分片上传方式流式上传文件对象
+
+        每次只读取一个分片(MINIO_UPLOAD_PART_SIZE)到内存;读取出错时中止分片上传,不留下不完整的对象
+
+        Args:
+            stream: 可读的文件对象(read(size) 返回 bytes)
+            object_name: 对象名称(路径)
+            content_type: 文件MIME类型
+
+        Returns:
+            文件的完整路径
+        """
+        try:
+            self.client.put_object(
+                settings.MINIO_BUCKET,
+                object_name,
+                stream,
+                length=-1,
+                part_size=settings.MINIO_UPLOAD_PART_SIZE,
+                content_type=content_type
+            )
+            file_path = f"{settings.MINIO_BUCKET}/{object_name}"
+            logger.info(f"文件上传成功: {file_path}")
+            return file_path
+        except S3Error as e:
+            logger.error(f"文件上传失败: {e}")
+            raise
+
+    # ---- 客户端驱动的分片上传 ----
+    # minio-py 的 put_object 只支持在单次调用内完成分片上传,
+    # 跨请求的可续传上传需要直接调用 Minio 上对应的 S3 API 方法
+    # (这些是内部方法,签名随版本变化,requirements.txt 中限定了minio的版本范围)
+
+    def create_multipart_upload(self, object_name: str, content_type: str = "application/octet-stream") -> str:
+        """
+        创建分片上传
+
+        Args:
+            object_name: 对象名称(路径)
+            content_type: 文件MIME类型
+
+        Returns:
+            upload_id
+        """
+        try:
+            upload_id = self.client._create_multipart_upload(
+                settings.MINIO_BUCKET, object_name, {"Content-Type": content_type}
+            )
+            logger.info(f"创建分片上传: {object_name}, upload_id={upload_id}")
+            return upload_id
+        except S3Error as e:
+            logger.error(f"创建分片上传失败: {e}")
+            raise
+
+    def upload_part(self, object_name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        """
+        上传一个分片,同一分片号重复上传时覆盖之前的数据
+
+        Args:
+            object_name: 对象名称(路径)
+            upload_id: 分片上传ID
+            part_number: 分片号(从1开始)
+            data: 分片数据
+
+        Returns:
+            分片的ETag
+        """
+        try:
+            return self.client._upload_part(
+                settings.MINIO_BUCKET, object_name, data, None, upload_id, part_number
+            )
+        except S3Error as e:
+            logger.error(f"分片上传失败: {object_name} #{part_number}: {e}")
+            raise
+
+    def list_parts(self, object_name: str, upload_id: str) -> List[dict]:
+        """
+        列出已上传的分片
+
+        Args:
+            object_name: 对象名称(路径)
+            upload_id: 分片上传ID
+
+        Returns:
+            按分片号排序的分片列表 [{part_number, etag, size}]
+        """
+        try:
+            parts = []
+            marker = None
+            while True:
+                result = self.client._list_parts(
+                    settings.MINIO_BUCKET, object_name, upload_id, part_number_marker=marker
+                )
+                parts.extend(
+                    {'part_number': p.part_number, 'etag': p.etag, 'size': p.size}
+                    for p in result.parts
+                )
+                if not result.is_truncated or not result.next_part_number_marker:
+                    break
+                marker = str(result.next_part_number_marker)
+            return sorted(parts, key=lambda p: p['part_number'])
+        except S3Error as e:
+            logger.error(f"列出分片失败: {e}")
+            raise
+
+    def complete_multipart_upload(self, object_name: str, upload_id: str, parts: List[dict]) -> str:
+        """
+        合并分片为完整对象
+
+        Args:
+            object_name: 对象名称(路径)
+            upload_id: 分片上传ID
+            parts: list_parts 返回的分片列表
+
+        Returns:
+            文件的完整路径
+        """
+        try:
+            self.client._complete_multipart_upload(
+                settings.MINIO_BUCKET,
+                object_name,
+                upload_id,
+                [Part(p['part_number'], p['etag']) for p in parts]
+            )
+            file_path = f"{settings.MINIO_BUCKET}/{object_name}"
+            logger.info(f"分片上传完成: {file_path}, 分片数: {len(parts)}")
+            return file_path
+        except S3Error as e:
+            logger.error(f"合并分片失败: {e}")
+            raise
+
+    def abort_multipart_upload(self, object_name: str, upload_id: str) -> bool:
+        """
+        中止分片上传并删除已上传的分片
+
+        Returns:
+            是否中止成功
+        """
+        try:
+            self.client._abort_multipart_upload(settings.MINIO_BUCKET, object_name, upload_id)
+            logger.info(f"分片上传已中止: {object_name}")
+            return True
+        except S3Error as e:
+            logger.error(f"中止分片上传失败: {e}")
+            return False
+
+    def compute_md5(self, object_name: str) -> str:
+        """
+        流式读取对象计算MD5(分片上传对象的ETag不是内容的MD5)
+
+        Args:
+            object_name: 对象名称(路径)
+
+        Returns:
+            MD5十六进制字符串
+        """
+        response = None
+        try:
+            md5 = hashlib.md5()
+            response = self.client.get_object(settings.MINIO_BUCKET, object_name)
+            for data in response.stream(settings.MINIO_UPLOAD_PART_SIZE):
+                md5.update(data)
+            return md5.hexdigest()
+        except S3Error as e:
+            logger.error(f"计算文件MD5失败: {e}")
+            raise
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
+
+    def upload_local_file(self, file_path: str, object_name: str, content_type: str = "application/octet-stream") -> str:
+        """
+        上传本地文件到MinIO(分片流式上传,不整体加载到内存)
+
+        Args:
+            file_path: 本地文件路径
+            object_name: 对象名称(路径)
+            content_type: 文件MIME类型
+
+        Returns:
+            文件的完整路径
+        """
+        try:
+            self.client.fput_object(
+                settings.MINIO_BUCKET,
+                object_name,
+                file_path,
+                content_type=content_type
+            )
+            file_path = f"{settings.MINIO_BUCKET}/{object_name}"
+            logger.info(f"文件上传成功: {file_path}")
+            return file_path
+        except S3Error as e:
+            logger.error(f"文件上传失败: {e}")
+            raise
+
     def download_file(self, object_name: str) -> bytes:
         """
         从MinIO下载文件
@@ -90,6 +291,49 @@ class MinIOClient:
             logger.error(f"文件下载失败: {e}")
             raise
 
+    def download_to_file(self, object_name: str, file_path: str) -> str:
+        """
+        从MinIO流式下载文件到本地路径(不整体加载到内存)
+
+        Args:
+            object_name: 对象名称(路径)
+            file_path: 本地文件路径
+
+        Returns:
+            本地文件路径
+        """
+        try:
+            self.client.fget_object(settings.MINIO_BUCKET, object_name, file_path)
+            logger.debug(f"文件下载到本地成功: {object_name} -> {file_path}")
+            return file_path
+        except S3Error as e:
+            logger.error(f"文件下载失败: {e}")
+            raise
+
+    def download_range(self, object_name: str, offset: int, length: int) -> bytes:
+        """
+        按字节范围读取文件的一部分(如Parquet文件尾部的元数据)
+
+        Args:
+            object_name: 对象名称(路径)
+            offset: 起始字节
+            length: 读取长度
+
+        Returns:
+            字节数据
+        """
+        try:
+            response = self.client.get_object(
+                settings.MINIO_BUCKET, object_name, offset=offset, length=length
+            )
+            data = response.read()
+            response.close()
+            response.release_conn()
+            return data
+        except S3Error as e:
+            logger.error(f"文件范围读取失败: {e}")
+            raise
+
     def delete_file(self, object_name: str) -> bool:
         """
         删除MinIO中的文件
@@ -56,6 +56,9 @@ echo.
 echo [4/5] 启动ChatBI后端服务...
 start "ChatBI Backend" cmd /k "cd /d C:\Users\KC\Desktop\POC\Chat-BI-main\backend && conda activate chatbi && set PYTHONPATH=C:\Users\KC\Desktop\POC\Chat-BI-main\backend && echo 启动ChatBI后端服务... && python main.py"
 
+REM 数据集解析/分片/向量化任务由独立的worker进程执行
+start "ChatBI Worker" cmd /k "cd /d C:\Users\KC\Desktop\POC\Chat-BI-main\backend && conda activate chatbi && set PYTHONPATH=C:\Users\KC\Desktop\POC\Chat-BI-main\backend && echo 启动数据集任务worker... && python worker.py"
+
 echo 等待后端启动...
 timeout /t 5 /nobreak >nul
 
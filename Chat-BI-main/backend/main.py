@@ -1,3 +1,4 @@
+import asyncio
 import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -18,10 +19,15 @@ from api.endpoints import (
     embedding_config,
     model_selection,
     insight_task,
-    monitoring
+    monitoring,
+    dataset_query
 )
 from contextlib import asynccontextmanager
 from api.dependencies.dependencies import redis_client, engine
+from services.query_executor import query_executor
+from services.column_profiler import shutdown_profile_pool
+from services.dataset_jobs import run_worker
+from services.cache_invalidation import run_invalidation_listener
 from core.logging import setup_logging
 from db.init_db import init_db, insert_default_data  # 导入数据库初始化和插入默认数据函数
 
@@ -33,8 +39,20 @@ async def lifespan(app: FastAPI):
     # 在应用启动时执行的代码
     await init_db()  # 调用数据库初始化函数
     await insert_default_data()  # 插入默认数据
+    # 开发环境可在API进程内运行任务worker,生产环境使用独立进程: python worker.py
+    worker_stop, worker_task = asyncio.Event(), None
+    if settings.JOB_WORKER_EMBEDDED:
+        worker_task = asyncio.create_task(run_worker(stop=worker_stop))
+    # 接收worker进程解析完成、其他API进程删除数据集时的缓存失效通知
+    listener_task = asyncio.create_task(run_invalidation_listener(worker_stop))
     yield
     # 在应用关闭时执行的代码
+    worker_stop.set()
+    if worker_task:
+        await worker_task
+    await listener_task
+    query_executor.shutdown()
+    shutdown_profile_pool()
     await redis_client.close()
     await engine.dispose()
 
@@ -57,6 +75,7 @@ app.add_middleware(
 # 注册路由
 app.include_router(conversation.router, prefix="/api", tags=["对话"])
 app.include_router(dataset.router, prefix="/api", tags=["数据集"])
+app.include_router(dataset_query.router, prefix="/api", tags=["数据集查询"])
 app.include_router(file_preview.router, prefix="/api", tags=["文件预览"])
 app.include_router(document_preview.router, prefix="/api", tags=["通用文档预览"])
 app.include_router(progress_stream.router, prefix="/api", tags=["进度流"])
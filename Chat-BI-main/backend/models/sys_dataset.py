@@ -33,7 +33,7 @@ class SysDataset(Base):
     parse_status = Column(
         String(50),
         default='pending',
-        comment='解析状态: pending/parsing/parsed/failed'
+        comment='解析状态: uploading/pending/parsing/parsed/failed'
     )
     parse_progress = Column(Integer, default=0, comment='解析进度(0-100)')
     error_message = Column(Text, comment='错误信息')
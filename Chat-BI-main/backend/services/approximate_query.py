@@ -0,0 +1,649 @@
+"""
+近似查询服务
+对大数据集的探索性问题("大概有多少"、"趋势如何")在DuckDB抽样数据上执行聚合查询,
+COUNT/SUM按抽样率放大,并为每个聚合结果给出95%置信区间的误差范围,
+用于先快速返回预览结果,再由精确查询刷新
+"""
+import logging
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from core.config import settings
+from services.arrow_utils import fetch_arrow_table, normalize_arrow_table, arrow_to_dataframe
+from services.duckdb_engine import duckdb_engine
+from services.duckdb_query import get_parsed_dataset, get_parquet_location, query_parquet_with_duckdb
+from services.metadata_query import get_parquet_schema, describe_query_result
+from services.parquet_cache import parquet_cache
+from services.query_executor import query_executor, QueryContext
+from services.query_guard import admit_query, QueryRejectedError
+from services.query_result_cache import query_result_cache
+
+logger = logging.getLogger(__name__)
+
+# DuckDB的system抽样以向量(2048行)为单位选取,误差估计按向量整群计算
+SAMPLE_VECTOR_SIZE = 2048
+
+# 95%置信区间对应的正态分位数
+CONFIDENCE_LEVEL = 0.95
+CONFIDENCE_Z = 1.96
+
+# 改写后SQL中的内部列名
+_CLUSTER_COLUMN = '__approx_cluster'
+_ERROR_COLUMN_PREFIX = '__approx_se_'
+
+_IDENTIFIER = r'"(?:[^"]|"")+"|[^\W\d]\w*'
+
+_IDENTIFIER_TOKEN = re.compile(_IDENTIFIER)
+
+# 单引号字符串、双引号标识符、注释
+_LITERAL_PATTERN = re.compile(
+    r"('(?:[^']|'')*')|(\"(?:[^\"]|\"\")*\")|(--[^\n]*)|(/\*.*?\*/)",
+    re.DOTALL
+)
+
+_FUNCTION_CALL = re.compile(r'\b([^\W\d]\w*)\s*\(')
+
+# 可以按抽样分解估计的聚合函数
+_SAMPLED_AGGREGATES = ('count', 'sum', 'avg', 'min', 'max')
+
+_UNSUPPORTED_KEYWORDS = re.compile(
+    r'\b(join|over|union|intersect|except|qualify|sample|tablesample|window|lateral|'
+    r'pivot|unpivot|grouping|rollup|cube|columns|exclude|replace)\b',
+    re.IGNORECASE
+)
+
+_CLAUSE_KEYWORDS = re.compile(r'\b(where|group\s+by|having|order\s+by|limit|offset)\b', re.IGNORECASE)
+
+_FROM_CLAUSE = re.compile(
+    rf'^from\s+dataset(?:\s+(?:as\s+)?(?P<alias>{_IDENTIFIER}))?\s*$',
+    re.IGNORECASE
+)
+
+# SELECT项末尾的别名: "表达式 AS 别名" 或 "表达式 别名"
+_ITEM_ALIAS_SUFFIX = re.compile(rf'(?:\s+(as))?\s+({_IDENTIFIER})\s*$', re.IGNORECASE)
+
+# 可能出现在表达式末尾、不是别名的关键字
+_NON_ALIAS_WORDS = {'end', 'and', 'or', 'not', 'null', 'true', 'false', 'is', 'then', 'else', 'distinct'}
+
+_aggregate_names: Optional[frozenset] = None
+_aggregate_names_lock = threading.Lock()
+
+
+class SampledQuery:
+    """改写后的抽样查询"""
+
+    def __init__(self, sql: str, item_count: int, error_items: Dict[int, str]):
+        self.sql = sql
+        # 原查询SELECT列表的项数(结果中前 item_count 列)
+        self.item_count = item_count
+        # 结果列下标 -> 误差列名
+        self.error_items = error_items
+
+
+def _mask_literals(sql_query: str) -> str:
+    """
+    将字符串、带引号的标识符和注释替换为等长的占位内容,便于按位置分析SQL结构
+
+    字符串保留引号、内容替换为空格;带引号的标识符替换为 "___";注释替换为空格
+    """
+    def mask(match: re.Match) -> str:
+        text = match.group(0)
+        if match.group(1):
+            return "'" + ' ' * (len(text) - 2) + "'"
+        if match.group(2):
+            return '"' + '_' * (len(text) - 2) + '"'
+        return ' ' * len(text)
+
+    return _LITERAL_PATTERN.sub(mask, sql_query)
+
+
+def _paren_depths(masked: str) -> List[int]:
+    """每个字符所在的括号深度"""
+    depths = []
+    depth = 0
+    for ch in masked:
+        if ch == ')':
+            depth -= 1
+        depths.append(depth)
+        if ch == '(':
+            depth += 1
+    return depths
+
+
+def _top_level(pattern: re.Pattern, masked: str, depths: List[int], start: int = 0):
+    """查找顶层(括号外)的第一个匹配"""
+    for match in pattern.finditer(masked, start):
+        if depths[match.start()] == 0:
+            return match
+    return None
+
+
+def _closing_paren(masked: str, open_pos: int) -> int:
+    depth = 0
+    for pos in range(open_pos, len(masked)):
+        if masked[pos] == '(':
+            depth += 1
+        elif masked[pos] == ')':
+            depth -= 1
+            if depth == 0:
+                return pos
+    return -1
+
+
+def _split_top_level(masked: str, depths: List[int], start: int, end: int) -> List[Tuple[int, int]]:
+    """按顶层逗号拆分 [start, end) 区间,返回各项的位置"""
+    spans = []
+    item_start = start
+    for pos in range(start, end):
+        if masked[pos] == ',' and depths[pos] == 0:
+            spans.append((item_start, pos))
+            item_start = pos + 1
+    spans.append((item_start, end))
+    return spans
+
+
+def _unquote(identifier: str) -> str:
+    if identifier.startswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier
+
+
+def _resolve_name(identifier: str, names: List[str]) -> Optional[str]:
+    """匹配列名: 带引号时精确匹配,否则忽略大小写"""
+    if identifier.startswith('"'):
+        name = _unquote(identifier)
+        return name if name in names else None
+    matches = [name for name in names if name.lower() == identifier.lower()]
+    return matches[0] if len(matches) == 1 else None
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _get_aggregate_names(cur) -> frozenset:
+    """DuckDB中全部聚合函数名(用于识别无法在抽样上分解的聚合)"""
+    global _aggregate_names
+    if _aggregate_names is None:
+        rows = cur.execute(
+            "SELECT DISTINCT lower(function_name) FROM duckdb_functions() "
+            "WHERE function_type = 'aggregate'"
+        ).fetchall()
+        with _aggregate_names_lock:
+            _aggregate_names = frozenset(row[0] for row in rows)
+    return _aggregate_names
+
+
+def rewrite_for_sample(
+    sql_query: str,
+    columns: List[str],
+    parquet_path: str,
+    sample_rate: float,
+    aggregate_names: frozenset,
+    seed: int = 0
+) -> Optional[SampledQuery]:
+    """
+    将单表聚合SQL改写为在抽样数据上执行的两层查询
+
+    内层在抽样数据上按 (引用到的列, 抽样向量) 分组计算部分聚合;外层按原SQL重新聚合:
+    - COUNT/SUM 除以抽样率得到总体估计,误差按整群抽样的方差估计
+    - AVG 由 SUM/COUNT 比值估计,误差按比值估计量的线性化方差估计
+    - MIN/MAX 直接取样本值,不给出误差范围
+
+    Args:
+        sql_query: SQL查询语句(表名为 dataset)
+        columns: 数据集列名
+        parquet_path: 本地Parquet文件路径
+        sample_rate: 抽样率(0,1)
+        aggregate_names: DuckDB聚合函数名
+        seed: 抽样随机种子
+
+    Returns:
+        改写后的查询,无法在抽样上估计时返回None(由调用方执行精确查询)
+    """
+    sql_query = sql_query.strip().rstrip(';').strip()
+    masked = _mask_literals(sql_query)
+    masked_lower = masked.lower()
+    depths = _paren_depths(masked)
+
+    # 只支持单表、单层SELECT
+    if not masked_lower.startswith('select') or len(re.findall(r'\bselect\b', masked_lower)) != 1:
+        return None
+    if _UNSUPPORTED_KEYWORDS.search(masked) or re.search(r'\bdistinct\s+on\b', masked_lower):
+        return None
+
+    from_match = _top_level(re.compile(r'\bfrom\b', re.IGNORECASE), masked, depths)
+    if from_match is None:
+        return None
+
+    clause_match = _top_level(_CLAUSE_KEYWORDS, masked, depths, from_match.end())
+    from_end = clause_match.start() if clause_match else len(masked)
+    from_clause = _FROM_CLAUSE.match(masked[from_match.start():from_end].strip())
+    if from_clause is None:
+        return None
+    alias = 'dataset'
+    if from_clause.group('alias'):
+        from_text = sql_query[from_match.start():from_end].strip()
+        alias = from_text[from_clause.start('alias'):from_clause.end('alias')]
+
+    # 顶层子句位置: WHERE移入内层, GROUP BY用于确定误差计算的分组键
+    clauses = []
+    if clause_match:
+        clause = clause_match
+        while clause is not None:
+            clauses.append(clause)
+            clause = _top_level(_CLAUSE_KEYWORDS, masked, depths, clause.end())
+
+    where_span = None
+    group_span = None
+    for index, clause in enumerate(clauses):
+        keyword = re.sub(r'\s+', ' ', clause.group(1).lower())
+        clause_end = clauses[index + 1].start() if index + 1 < len(clauses) else len(masked)
+        if keyword == 'where':
+            if where_span is not None:
+                return None
+            where_span = (clause.start(), clause_end)
+        elif keyword == 'group by':
+            if group_span is not None:
+                return None
+            group_span = (clause.end(), clause_end)
+
+    # 识别聚合调用
+    aggregates = []
+    for match in _FUNCTION_CALL.finditer(masked):
+        if any(agg['start'] <= match.start() < agg['end'] for agg in aggregates):
+            if match.group(1).lower() in aggregate_names:
+                return None
+            continue
+        func = match.group(1).lower()
+        if func not in _SAMPLED_AGGREGATES:
+            if func in aggregate_names:
+                return None
+            continue
+
+        open_pos = match.end() - 1
+        close_pos = _closing_paren(masked, open_pos)
+        if close_pos < 0:
+            return None
+        if where_span and where_span[0] <= match.start() < where_span[1]:
+            return None
+        if re.match(r'\s*filter\b', masked_lower[close_pos + 1:]):
+            return None
+
+        arg_masked = masked_lower[open_pos + 1:close_pos].strip()
+        if re.match(r'distinct\b', arg_masked):
+            return None
+        arg = sql_query[open_pos + 1:close_pos].strip()
+        if re.match(r'all\b', arg_masked):
+            arg = arg[3:].strip()
+        if not arg:
+            return None
+
+        aggregates.append({
+            'func': func,
+            'arg': None if arg in ('*', '1') and func == 'count' else arg,
+            'start': match.start(),
+            'end': close_pos + 1
+        })
+
+    # 明细查询不做抽样
+    if not aggregates:
+        return None
+
+    def in_aggregate(pos: int) -> bool:
+        return any(agg['start'] <= pos < agg['end'] for agg in aggregates)
+
+    def in_where(pos: int) -> bool:
+        return where_span is not None and where_span[0] <= pos < where_span[1]
+
+    # 聚合之外引用的列需要在内层保留,外层才能分组/计算
+    dimensions = []
+    for match in _IDENTIFIER_TOKEN.finditer(masked):
+        pos = match.start()
+        if in_aggregate(pos) or in_where(pos) or from_match.start() <= pos < from_end:
+            continue
+        name = _resolve_name(sql_query[pos:match.end()], columns)
+        if name is not None and name not in dimensions:
+            dimensions.append(name)
+
+    # 拆分SELECT列表,记录由单个聚合构成的项(可给出误差范围)
+    select_start = re.match(r'select\s+(distinct\s+)?', masked_lower).end()
+    items = _split_top_level(masked, depths, select_start, from_match.start())
+    item_exprs = []
+    item_aliases = []
+    item_has_aggregate = []
+    item_aggregates = {}
+    for index, (start, end) in enumerate(items):
+        text = masked[start:end]
+        if text.strip() == '*' or text.strip().endswith('.*'):
+            return None
+        lead = start + len(text) - len(text.lstrip())
+        alias_match = _ITEM_ALIAS_SUFFIX.search(text)
+        expr_end = end
+        item_alias = None
+        if alias_match and (alias_match.group(1) or (
+            re.search(r'[\w)"\']$', text[:alias_match.start()].rstrip())
+            and alias_match.group(2).lower() not in _NON_ALIAS_WORDS
+        )):
+            expr_end = start + alias_match.start()
+            item_alias = sql_query[start + alias_match.start(2):start + alias_match.end(2)]
+
+        item_exprs.append(sql_query[lead:expr_end].strip())
+        item_aliases.append(item_alias)
+        item_has_aggregate.append(any(start <= agg['start'] < end for agg in aggregates))
+        for agg in aggregates:
+            if agg['start'] == lead and agg['end'] >= start + len(masked[start:expr_end].rstrip()):
+                item_aggregates[index] = agg
+
+    # 外层分组键(原文表达式),用于计算每个抽样向量在各分组内的合计
+    group_keys = []
+    if group_span:
+        for start, end in _split_top_level(masked, depths, group_span[0], group_span[1]):
+            key = masked[start:end].strip().lower()
+            key_text = sql_query[start:end].strip()
+            if key == 'all':
+                group_keys.extend(
+                    expr for expr, has_agg in zip(item_exprs, item_has_aggregate) if not has_agg
+                )
+            elif key.isdigit():
+                position = int(key) - 1
+                if not 0 <= position < len(items) or item_has_aggregate[position]:
+                    return None
+                group_keys.append(item_exprs[position])
+            elif _IDENTIFIER_TOKEN.fullmatch(key_text) and _resolve_name(key_text, columns) is None:
+                # 引用SELECT别名时替换为对应表达式
+                positions = [
+                    i for i, item_alias in enumerate(item_aliases)
+                    if item_alias and _resolve_name(key_text, [_unquote(item_alias)])
+                ]
+                if len(positions) != 1 or item_has_aggregate[positions[0]]:
+                    return None
+                group_keys.append(item_exprs[positions[0]])
+            else:
+                group_keys.append(key_text)
+
+    # 内层: 抽样数据上按 (引用列, 抽样向量) 的部分聚合
+    rate = repr(float(sample_rate))
+    partials = ['COUNT(*) AS "__approx_n"']
+    outer_exprs = []
+    for i, agg in enumerate(aggregates):
+        func, arg = agg['func'], agg['arg']
+        count_col = f'"__approx_{i}_c"'
+        sum_col = f'"__approx_{i}_s"'
+        value_col = f'"__approx_{i}_v"'
+
+        if func == 'count':
+            if arg is None:
+                count_col = '"__approx_n"'
+            else:
+                partials.append(f"COUNT({arg}) AS {count_col}")
+            outer_exprs.append(f"COALESCE(CAST(ROUND(SUM({count_col}) / {rate}) AS BIGINT), 0)")
+            agg['totals'] = {'tc': count_col}
+        elif func == 'sum':
+            partials.append(f"SUM({arg}) AS {sum_col}")
+            outer_exprs.append(f"(SUM({sum_col}) / {rate})")
+            agg['totals'] = {'ts': sum_col}
+        elif func == 'avg':
+            partials.append(f"SUM({arg}) AS {sum_col}")
+            partials.append(f"COUNT({arg}) AS {count_col}")
+            outer_exprs.append(f"(SUM({sum_col}) / SUM({count_col}))")
+            agg['totals'] = {'ts': sum_col, 'tc': count_col}
+        else:
+            partials.append(f"{func.upper()}({arg}) AS {value_col}")
+            outer_exprs.append(f"{func.upper()}({value_col})")
+            agg['totals'] = None
+        agg['count_col'] = count_col
+        agg['sum_col'] = sum_col
+
+    escaped_path = parquet_path.replace("'", "''")
+    inner_items = [_quote(name) for name in dimensions]
+    inner_items.append(f"file_row_number // {SAMPLE_VECTOR_SIZE} AS {_CLUSTER_COLUMN}")
+    inner_items.extend(partials)
+    inner_sql = (
+        f"SELECT {', '.join(inner_items)} "
+        f"FROM (SELECT * FROM read_parquet('{escaped_path}', file_row_number = true) "
+        f"USING SAMPLE {float(sample_rate) * 100!r}% (system, {int(seed)})) AS {alias}"
+    )
+    if where_span:
+        inner_sql += f" {sql_query[where_span[0]:where_span[1]].strip()}"
+    inner_sql += " GROUP BY ALL"
+
+    # 误差: 整群抽样下总量估计的方差为 (1-p)/p^2 * Σ(每个向量在该分组内的合计)^2,
+    # 用 Σ(部分聚合 × 所在向量的分组合计) 计算,向量合计由窗口函数按 (分组键, 向量) 求得
+    error_items = {}
+    error_sql = []
+    window_items = []
+    for index, agg in sorted(item_aggregates.items()):
+        if agg['totals'] is None:
+            continue
+        i = aggregates.index(agg)
+        totals = {}
+        for name, column in agg['totals'].items():
+            totals[name] = f'"__approx_{i}_{name}"'
+            window_items.append(
+                f"SUM(CAST({column} AS DOUBLE)) OVER __approx_window AS {totals[name]}"
+            )
+
+        count_col, sum_col = agg['count_col'], agg['sum_col']
+        if agg['func'] == 'count':
+            error = f"SQRT((1 - {rate}) * SUM({count_col} * {totals['tc']})) / {rate}"
+        elif agg['func'] == 'sum':
+            error = f"SQRT((1 - {rate}) * SUM({sum_col} * {totals['ts']})) / {rate}"
+        else:
+            ratio = f"(SUM({sum_col}) / SUM({count_col}))"
+            error = (
+                f"SQRT((1 - {rate}) * GREATEST(SUM({sum_col} * {totals['ts']}) "
+                f"- 2 * {ratio} * SUM({sum_col} * {totals['tc']}) "
+                f"+ {ratio} ^ 2 * SUM({count_col} * {totals['tc']}), 0)) / SUM({count_col})"
+            )
+
+        column = f"{_ERROR_COLUMN_PREFIX}{index}"
+        error_items[index] = column
+        error_sql.append(f", {error} AS {_quote(column)}")
+
+    if window_items:
+        partition = ', '.join(group_keys + [_CLUSTER_COLUMN])
+        inner_sql = (
+            f"SELECT *, {', '.join(window_items)} FROM ({inner_sql}) AS {alias} "
+            f"WINDOW __approx_window AS (PARTITION BY {partition})"
+        )
+
+    # 外层: 原SQL中的聚合替换为部分聚合的再聚合,FROM替换为内层查询,WHERE移入内层
+    edits = [(agg['start'], agg['end'], expr) for agg, expr in zip(aggregates, outer_exprs)]
+    edits.append((items[-1][1], items[-1][1], ''.join(error_sql) + ' '))
+    edits.append((from_match.start(), from_end, f"FROM ({inner_sql}) AS {alias} "))
+    if where_span:
+        edits.append((where_span[0], where_span[1], ''))
+
+    rewritten = sql_query
+    for start, end, text in sorted(edits, key=lambda edit: (edit[0], edit[1]), reverse=True):
+        rewritten = rewritten[:start] + text + rewritten[end:]
+
+    return SampledQuery(rewritten, len(items), error_items)
+
+
+def choose_sample_rate(row_count: Optional[int], sample_rate: Optional[float] = None) -> Optional[float]:
+    """
+    确定抽样率
+
+    Args:
+        row_count: 数据集行数
+        sample_rate: 用户指定的抽样率,None表示按目标样本行数自动选择
+
+    Returns:
+        抽样率,数据量较小不值得抽样时返回None
+    """
+    if sample_rate is not None:
+        return sample_rate if sample_rate < 1 else None
+
+    if not row_count or row_count < settings.APPROX_QUERY_MIN_ROWS:
+        return None
+    rate = max(settings.APPROX_QUERY_TARGET_ROWS / row_count, settings.APPROX_QUERY_MIN_SAMPLE_RATE)
+    return rate if rate <= settings.APPROX_QUERY_MAX_SAMPLE_RATE else None
+
+
+def _execute_sampled_query(
+    ctx: QueryContext,
+    dataset_id: str,
+    object_name: str,
+    parquet_version: Optional[str],
+    sql_query: str,
+    sample_rate: float,
+    limit: Optional[int],
+    cache_key: Optional[str]
+) -> Optional[pa.Table]:
+    """
+    在查询执行器线程中执行: 改写并在抽样数据上执行查询
+
+    Returns:
+        结果表(末尾附带误差列),无法抽样估计时返回None
+
+    Raises:
+        QueryRejectedError: 查询计划代价过高,被准入检查拒绝
+    """
+    schema = get_parquet_schema(ctx, dataset_id, object_name, parquet_version)
+    parquet_path = parquet_cache.get_local_path(dataset_id, object_name, version=parquet_version)
+    ctx.check_cancelled()
+
+    if limit and 'LIMIT' not in sql_query.upper():
+        sql_query += f" LIMIT {limit}"
+
+    with duckdb_engine.cursor() as cur:
+        ctx.bind_cursor(cur)
+        try:
+            sampled = rewrite_for_sample(
+                sql_query,
+                schema.names,
+                parquet_path,
+                sample_rate,
+                _get_aggregate_names(cur),
+                settings.APPROX_QUERY_SEED
+            )
+            if sampled is None:
+                return None
+
+            expected_schema = describe_query_result(cur, schema, sql_query)
+            # 改写后的SQL执行前同样做代价检查
+            sampled_sql = admit_query(cur, sampled.sql, limit)
+            logger.info(f"执行DuckDB抽样查询: {sampled_sql}")
+            table = fetch_arrow_table(cur.execute(sampled_sql))
+        finally:
+            ctx.release_cursor()
+
+    if table.num_columns != sampled.item_count + len(sampled.error_items) \
+            or len(expected_schema) != sampled.item_count:
+        raise ValueError("抽样查询结果列数与原查询不一致")
+
+    # 结果列名与原查询保持一致,误差列以 "__approx_se_<列名>" 附在末尾
+    names = list(expected_schema.names) + list(sampled.error_items.values())
+    for index, column in sampled.error_items.items():
+        names[table.column_names.index(column)] = f"{_ERROR_COLUMN_PREFIX}{names[index]}"
+    table = normalize_arrow_table(table.rename_columns(names))
+
+    if cache_key:
+        try:
+            query_result_cache.set(cache_key, dataset_id, table)
+        except Exception as e:
+            logger.warning(f"写入查询结果缓存失败: {e}")
+    return table
+
+
+def _split_error_bounds(table: pa.Table) -> Tuple[pa.Table, Dict[str, List[Optional[float]]]]:
+    """拆出误差列,按 列名 -> 每行置信区间半宽 返回"""
+    error_bounds = {}
+    keep = []
+    for name in table.column_names:
+        if name.startswith(_ERROR_COLUMN_PREFIX):
+            column = pc.multiply(table.column(name).cast(pa.float64()), CONFIDENCE_Z)
+            error_bounds[name[len(_ERROR_COLUMN_PREFIX):]] = [
+                value if value is not None and value == value else None
+                for value in column.to_pylist()
+            ]
+        else:
+            keep.append(name)
+    return table.select(keep), error_bounds
+
+
+async def query_parquet_approximate(
+    dataset_id: str,
+    sql_query: str,
+    sample_rate: Optional[float] = None,
+    limit: Optional[int] = 1000
+) -> Optional[Tuple[pd.DataFrame, Dict[str, Any]]]:
+    """
+    在抽样数据上执行聚合查询,返回估计结果和误差范围
+
+    数据量较小、不是聚合查询或包含无法在抽样上估计的语法(JOIN、窗口函数、COUNT DISTINCT等)时,
+    执行精确查询并在返回信息中标记 approximate=False
+
+    Args:
+        dataset_id: 数据集ID
+        sql_query: SQL查询语句(表名为 dataset)
+        sample_rate: 抽样率(0,1],None表示自动选择
+        limit: 最大返回行数
+
+    Returns:
+        (查询结果DataFrame, 近似信息),失败返回None
+        近似信息: {'approximate', 'sample_rate', 'sample_method', 'confidence',
+                   'error_bounds': {列名: [每行置信区间半宽]}}
+    """
+    try:
+        dataset_info = await get_parsed_dataset(dataset_id)
+        if dataset_info is None:
+            return None
+
+        rate = choose_sample_rate(dataset_info.row_count, sample_rate)
+        if rate is not None:
+            object_name, parquet_version = get_parquet_location(dataset_info)
+            cache_key = query_result_cache.build_key(
+                str(dataset_id),
+                f"{dataset_info.file_md5}:{parquet_version}",
+                sql_query,
+                limit,
+                params=['approximate', rate, settings.APPROX_QUERY_SEED]
+            )
+            table = query_result_cache.get(cache_key)
+            if table is None:
+                table = await query_executor.run(
+                    _execute_sampled_query,
+                    str(dataset_id),
+                    object_name,
+                    parquet_version,
+                    sql_query,
+                    rate,
+                    limit,
+                    cache_key
+                )
+
+            if table is not None:
+                table, error_bounds = _split_error_bounds(table)
+                logger.info(f"抽样查询成功(抽样率={rate:.4g}),返回 {table.num_rows} 行数据")
+                return arrow_to_dataframe(table), {
+                    'approximate': True,
+                    'sample_rate': rate,
+                    'sample_method': 'system',
+                    'confidence': CONFIDENCE_LEVEL,
+                    'error_bounds': error_bounds
+                }
+
+        df = await query_parquet_with_duckdb(dataset_id, sql_query, limit)
+        if df is None:
+            return None
+        return df, {
+            'approximate': False,
+            'sample_rate': 1.0,
+            'sample_method': None,
+            'confidence': None,
+            'error_bounds': {}
+        }
+
+    except QueryRejectedError:
+        raise
+    except Exception as e:
+        logger.error(f"DuckDB抽样查询失败: {e}", exc_info=True)
+        return None
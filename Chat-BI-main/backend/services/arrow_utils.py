@@ -0,0 +1,91 @@
+"""
+Arrow结果处理工具
+DuckDB查询结果以Arrow表在服务内流转,并以列式向量化方式序列化为JSON
+"""
+import logging
+from typing import Any
+
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_arrow_table(result: Any) -> pa.Table:
+    """
+    从DuckDB查询结果获取Arrow表(兼容新旧版本DuckDB的方法名)
+
+    Args:
+        result: DuckDB execute()返回的连接/游标
+
+    Returns:
+        Arrow表
+    """
+    if hasattr(result, 'to_arrow_table'):
+        return result.to_arrow_table()
+    return result.fetch_arrow_table()
+
+
+def normalize_arrow_table(table: pa.Table) -> pa.Table:
+    """
+    统一Arrow列类型: DECIMAL(如SUM(INTEGER)的结果)转换为float64,
+    与DuckDB .df() 的行为保持一致,避免下游得到Decimal对象
+    """
+    for idx, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(
+                idx,
+                pa.field(field.name, pa.float64()),
+                table.column(idx).cast(pa.float64())
+            )
+    return table
+
+
+def arrow_to_dataframe(table: pa.Table) -> pd.DataFrame:
+    """Arrow表转换为DataFrame(日期列转换为datetime64)"""
+    return normalize_arrow_table(table).to_pandas(date_as_object=False)
+
+
+def dataframe_to_json_records(df: pd.DataFrame, lines: bool = False) -> str:
+    """
+    将查询结果序列化为records格式的JSON字符串
+
+    - 日期/时间列统一格式化为 YYYY-MM-DD
+    - NaN、Inf、NaT 统一输出为 null
+    - 所有处理均按列向量化完成,不逐单元格遍历
+
+    Args:
+        df: 查询结果DataFrame
+        lines: 是否输出NDJSON(每行一条记录)
+
+    Returns:
+        JSON字符串,形如 [{"col": value, ...}, ...]; lines=True时每行一个JSON对象
+    """
+    # 与 to_dict(orient="records") 一致: 重名列保留最后一列
+    if not df.columns.is_unique:
+        df = df.loc[:, ~df.columns.duplicated(keep='last')]
+
+    df = df.copy(deep=False)
+    for idx in range(df.shape[1]):
+        col_data = df.iloc[:, idx]
+
+        if pd.api.types.is_datetime64_any_dtype(col_data):
+            df.isetitem(idx, col_data.dt.strftime('%Y-%m-%d'))
+        elif col_data.dtype == object:
+            inferred = pd.api.types.infer_dtype(col_data, skipna=True)
+            if inferred in ('datetime', 'datetime64', 'date'):
+                try:
+                    df.isetitem(idx, pd.to_datetime(col_data, errors='coerce').dt.strftime('%Y-%m-%d'))
+                except Exception as e:
+                    logger.debug(f"列 {df.columns[idx]} 日期格式化失败: {e}")
+            elif inferred == 'decimal':
+                df.isetitem(idx, col_data.astype(float))
+
+    # pandas的JSON序列化在C层完成,NaN/Inf/None均输出为null;
+    # 浮点数默认只保留10位有效数字,使用允许的最大精度15位
+    if lines:
+        if df.empty:
+            return ''
+        ndjson = df.to_json(orient='records', force_ascii=False, lines=True, double_precision=15)
+        return ndjson if ndjson.endswith('\n') else ndjson + '\n'
+    return df.to_json(orient='records', force_ascii=False, double_precision=15)
@@ -0,0 +1,73 @@
+"""
+数据集缓存失效广播
+解析在worker进程中执行,进程内的查询缓存(DuckDB视图、本地Parquet文件、查询结果、
+文件统计信息、数据集元数据)需要通过Redis发布订阅通知到各API进程
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from api.dependencies.dependencies import redis_client
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "dataset_cache_invalidation"
+
+# 订阅断开后重连的等待时间(秒)
+RECONNECT_DELAY = 5
+
+
+def _invalidate_local(dataset_id: str):
+    from services.duckdb_query import invalidate_dataset_cache
+    invalidate_dataset_cache(dataset_id)
+
+
+async def broadcast_dataset_invalidation(dataset_id: str):
+    """
+    清理本进程中数据集相关的缓存,并通知其他进程清理
+
+    Args:
+        dataset_id: 数据集ID
+    """
+    dataset_id = str(dataset_id)
+    _invalidate_local(dataset_id)
+    try:
+        await redis_client.publish(INVALIDATION_CHANNEL, dataset_id)
+    except Exception as e:
+        # 通知失败时其他进程的元数据缓存在 DATASET_METADATA_CACHE_TTL 后过期
+        logger.warning(f"发布缓存失效通知失败: {dataset_id}: {e}")
+
+
+async def run_invalidation_listener(stop: Optional[asyncio.Event] = None):
+    """
+    订阅缓存失效通知并清理本进程的缓存,直到 stop 被设置
+
+    断线期间可能错过通知,(重新)订阅成功后清空全部数据集元数据缓存
+    """
+    from services.multi_dataset_query import invalidate_datasets_metadata
+
+    stop = stop or asyncio.Event()
+    while not stop.is_set():
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            invalidate_datasets_metadata()
+            while not stop.is_set():
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message and message['type'] == 'message':
+                    dataset_id = message['data']
+                    if isinstance(dataset_id, bytes):
+                        dataset_id = dataset_id.decode()
+                    _invalidate_local(dataset_id)
+                    logger.debug(f"收到缓存失效通知: {dataset_id}")
+        except Exception as e:
+            logger.warning(f"缓存失效订阅中断,{RECONNECT_DELAY}秒后重连: {e}")
+            try:
+                await asyncio.wait_for(stop.wait(), RECONNECT_DELAY)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            try:
+                await pubsub.close()
+            except Exception:
+                pass
@@ -0,0 +1,461 @@
+"""
+列统计服务
+增量推断列类型、计算统计信息和示例值;较宽的表按列分组交给进程池并行计算,
+各进程的结果再合并
+
+本模块只依赖配置和取值哈希工具,进程池子进程导入时不会连接MinIO或数据库
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from core.config import settings
+from services.join_planner import hash_values, make_value_sketch, sorted_unique, value_hashes
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    """解析日期(抑制格式推断警告),无法解析时抛出异常"""
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return pd.to_datetime(values, errors='raise')
+
+
+def _infer_type_and_values(non_null: pd.Series) -> Tuple[str, Optional[pd.Series]]:
+    """
+    推断非空值的类型,并返回推断过程中转换得到的数值/日期序列(供统计复用)
+
+    文本列先在前 PARSE_TYPE_SAMPLE_SIZE 个值上尝试转换,样本无法转换时不再解析整列;
+    样本可以转换时再在整列上确认
+
+    Returns:
+        (类型, 转换后的值),无需转换时值为None
+    """
+    if len(non_null) == 0:
+        return 'string', None
+
+    dtype = non_null.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bool', None
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'date', non_null
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'int', non_null
+    if pd.api.types.is_float_dtype(dtype):
+        return 'float', non_null
+    if pd.api.types.is_numeric_dtype(dtype):
+        # 复数等其他数值类型
+        return 'float', None
+
+    sample = non_null.iloc[:settings.PARSE_TYPE_SAMPLE_SIZE]
+
+    try:
+        pd.to_numeric(sample, errors='raise')
+        numeric = pd.to_numeric(non_null, errors='raise')
+    except (ValueError, TypeError):
+        numeric = None
+    if numeric is not None:
+        values = numeric.to_numpy(dtype=float, na_value=np.nan)
+        values = values[~np.isnan(values)]
+        # 全部为有限整数值时视为整数(inf 不能转换为整数)
+        if np.isfinite(values).all() and (values == np.floor(values)).all():
+            return 'int', numeric
+        return 'float', numeric
+
+    try:
+        _parse_dates(sample)
+        return 'date', _parse_dates(non_null)
+    except (ValueError, TypeError, OverflowError):
+        pass
+
+    return 'string', None
+
+
+def get_sample_values(col_data: pd.Series, num_samples: int = 5) -> List[Any]:
+    """
+    获取列的示例值
+
+    Args:
+        col_data: pandas Series
+        num_samples: 示例数量
+
+    Returns:
+        示例值列表
+    """
+    # 移除空值
+    non_null_data = col_data.dropna()
+
+    if len(non_null_data) == 0:
+        return []
+
+    # 获取前N个唯一值(先在列首部查找,不足时再对整列去重)
+    samples = non_null_data.iloc[:num_samples * 100].drop_duplicates().head(num_samples).tolist()
+    if len(samples) < num_samples and len(non_null_data) > num_samples * 100:
+        samples = non_null_data.drop_duplicates().head(num_samples).tolist()
+
+    # 转换为可序列化的格式
+    serializable_samples = []
+    for sample in samples:
+        if isinstance(sample, (np.integer, np.floating)):
+            serializable_samples.append(float(sample))
+        elif isinstance(sample, (datetime, pd.Timestamp)):
+            serializable_samples.append(str(sample))
+        elif pd.isna(sample):
+            continue
+        else:
+            serializable_samples.append(str(sample))
+
+    return serializable_samples
+
+
+class ColumnProfiler:
+    """
+    增量推断单列的类型并计算统计信息和示例值
+
+    内存占用与数据量无关: 不同值超过 PARSE_EXACT_DISTINCT_LIMIT 后只保留最小的若干个取值哈希
+    估计不同值数,中位数由固定大小的均匀抽样估计
+    """
+
+    # 估计不同值数时保留的最小哈希数(相对误差约 1/sqrt(n))
+    DISTINCT_SKETCH_SIZE = 4096
+
+    def __init__(self, name: str, seed: int = 0):
+        self.name = name
+        self.types = set()
+        self.total_count = 0
+        self.null_count = 0
+        # 不同值哈希: 精确集合,超过上限后为None,改用 smallest 估计
+        self.distinct: Optional[np.ndarray] = np.empty(0, dtype=np.uint64)
+        self.smallest = np.empty(0, dtype=np.uint64)
+        # 按键值规范化(整数转字符串、去空白、忽略空串)的取值哈希,用于连接草图;
+        # 任一块不适合作为连接键时 key_hashes 为False,不再累加
+        self.key_hashes = True
+        self.key_distinct: Optional[np.ndarray] = np.empty(0, dtype=np.uint64)
+        self.key_smallest = np.empty(0, dtype=np.uint64)
+        self.numeric_count = 0
+        self.numeric_mean = 0.0
+        self.numeric_m2 = 0.0
+        self.numeric_min = None
+        self.numeric_max = None
+        self.sample_keys = np.empty(0)
+        self.sample_values = np.empty(0)
+        self.length_count = 0
+        self.length_total = 0
+        self.length_min = None
+        self.length_max = None
+        self.min_date = None
+        self.max_date = None
+        self.samples: List[Any] = []
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, col_data: pd.Series):
+        """累加一块数据"""
+        self.total_count += len(col_data)
+        null_count = int(col_data.isna().sum())
+        self.null_count += null_count
+        if null_count == len(col_data):
+            return
+
+        non_null = col_data.dropna()
+        # 推断类型时转换得到的数值/日期直接用于统计,不再重复解析
+        dtype, values = _infer_type_and_values(non_null)
+        self.types.add(dtype)
+
+        self._update_distinct(non_null if values is None else values, dtype)
+        if dtype in ('int', 'float'):
+            self._update_numeric(non_null if values is None else values)
+        elif dtype == 'string':
+            self._update_lengths(non_null)
+        elif dtype == 'date':
+            self._update_dates(non_null if values is None else values)
+
+        if len(self.samples) < 5:
+            self._add_samples(get_sample_values(non_null, num_samples=5))
+
+    def _update_distinct(self, non_null: pd.Series, dtype: str):
+        key_hashes = value_hashes(non_null, dtype) if self.key_hashes else None
+        # 不同值数按原始取值统计(与 COUNT(DISTINCT) 一致);整数列规范化前后不同值相同,直接复用
+        hashes = key_hashes if dtype == 'int' and key_hashes is not None else hash_values(non_null)
+        self.distinct, self.smallest = self._add_hashes(self.distinct, self.smallest, hashes, exact=True)
+        self._add_key_hashes(key_hashes, exact=True)
+
+    def _add_key_hashes(self, hashes: Optional[np.ndarray], exact: bool):
+        if hashes is None:
+            self.key_hashes = False
+            self.key_distinct, self.key_smallest = None, np.empty(0, dtype=np.uint64)
+        elif self.key_hashes:
+            self.key_distinct, self.key_smallest = self._add_hashes(
+                self.key_distinct, self.key_smallest, hashes, exact
+            )
+
+    @classmethod
+    def _add_hashes(
+        cls,
+        distinct: Optional[np.ndarray],
+        smallest: np.ndarray,
+        hashes: np.ndarray,
+        exact: bool
+    ) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """
+        合并升序去重的取值哈希; exact 为False时 hashes 只是最小的若干个
+
+        Returns:
+            合并后的 (精确集合, 最小哈希)
+        """
+        if distinct is not None and exact:
+            distinct = sorted_unique(np.concatenate([distinct, hashes]))
+            if len(distinct) > settings.PARSE_EXACT_DISTINCT_LIMIT:
+                return None, distinct[:cls.DISTINCT_SKETCH_SIZE]
+            return distinct, smallest
+        current = distinct if distinct is not None else smallest
+        return None, sorted_unique(np.concatenate([
+            current[:cls.DISTINCT_SKETCH_SIZE], hashes[:cls.DISTINCT_SKETCH_SIZE]
+        ]))[:cls.DISTINCT_SKETCH_SIZE]
+
+    def _update_numeric(self, non_null: pd.Series):
+        values = pd.to_numeric(non_null, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+
+        count, mean = len(values), float(values.mean())
+        self._add_numeric(
+            count, mean, float(((values - mean) ** 2).sum()),
+            float(values.min()), float(values.max()),
+            # 为每个值分配随机键,保留键最小的若干个,即为全部数据的均匀抽样
+            self._rng.random(count), values
+        )
+
+    def _add_numeric(self, count: int, mean: float, m2: float, low: float, high: float,
+                     keys: np.ndarray, values: np.ndarray):
+        # 合并均值和平方差(Chan等人的并行算法)
+        total = self.numeric_count + count
+        delta = mean - self.numeric_mean
+        self.numeric_mean += delta * count / total
+        self.numeric_m2 += m2 + delta ** 2 * self.numeric_count * count / total
+        self.numeric_count = total
+
+        self.numeric_min = low if self.numeric_min is None else min(self.numeric_min, low)
+        self.numeric_max = high if self.numeric_max is None else max(self.numeric_max, high)
+
+        keys = np.concatenate([self.sample_keys, keys])
+        values = np.concatenate([self.sample_values, values])
+        sample_size = settings.PARSE_STATS_SAMPLE_SIZE
+        if len(keys) > sample_size:
+            keep = np.argpartition(keys, sample_size)[:sample_size]
+            keys, values = keys[keep], values[keep]
+        self.sample_keys, self.sample_values = keys, values
+
+    def _update_lengths(self, non_null: pd.Series):
+        lengths = non_null.astype(str).str.len()
+        self._add_lengths(len(lengths), int(lengths.sum()), int(lengths.min()), int(lengths.max()))
+
+    def _add_lengths(self, count: int, total: int, low: int, high: int):
+        self.length_count += count
+        self.length_total += total
+        self.length_min = low if self.length_min is None else min(self.length_min, low)
+        self.length_max = high if self.length_max is None else max(self.length_max, high)
+
+    def _update_dates(self, non_null: pd.Series):
+        if pd.api.types.is_datetime64_any_dtype(non_null):
+            values = non_null.dropna()
+        else:
+            import warnings
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                values = pd.to_datetime(non_null, errors='coerce').dropna()
+        if len(values) == 0:
+            return
+        self._add_dates(values.min(), values.max())
+
+    def _add_dates(self, low: Any, high: Any):
+        try:
+            self.min_date = low if self.min_date is None else min(self.min_date, low)
+            self.max_date = high if self.max_date is None else max(self.max_date, high)
+        except TypeError:
+            # 不同块的时区不一致,无法比较
+            pass
+
+    def _add_samples(self, samples: List[Any]):
+        for sample in samples:
+            if sample not in self.samples and len(self.samples) < 5:
+                self.samples.append(sample)
+
+    def merge(self, other: 'ColumnProfiler'):
+        """合并另一部分数据(例如在其他进程中累加的数据块)的统计结果"""
+        self.total_count += other.total_count
+        self.null_count += other.null_count
+        if not other.types:
+            return
+
+        self.types |= other.types
+        if other.distinct is not None:
+            self.distinct, self.smallest = self._add_hashes(self.distinct, self.smallest, other.distinct, exact=True)
+        else:
+            self.distinct, self.smallest = self._add_hashes(self.distinct, self.smallest, other.smallest, exact=False)
+        if not other.key_hashes:
+            self._add_key_hashes(None, exact=True)
+        elif other.key_distinct is not None:
+            self._add_key_hashes(other.key_distinct, exact=True)
+        else:
+            self._add_key_hashes(other.key_smallest, exact=False)
+        if other.numeric_count:
+            self._add_numeric(
+                other.numeric_count, other.numeric_mean, other.numeric_m2,
+                other.numeric_min, other.numeric_max,
+                other.sample_keys, other.sample_values
+            )
+        if other.length_count:
+            self._add_lengths(other.length_count, other.length_total, other.length_min, other.length_max)
+        if other.min_date is not None:
+            self._add_dates(other.min_date, other.max_date)
+        self._add_samples(other.samples)
+
+    def _final_type(self) -> str:
+        if not self.types:
+            return 'string'
+        if len(self.types) == 1:
+            return next(iter(self.types))
+        if self.types <= {'int', 'float'}:
+            return 'float'
+        return 'string'
+
+    @staticmethod
+    def _count_distinct(distinct: Optional[np.ndarray], smallest: np.ndarray) -> int:
+        if distinct is not None:
+            return len(distinct)
+        # 第k小的哈希在哈希空间 [0, 2^53) 中的位置估计不同值数
+        k = len(smallest)
+        return int((k - 1) * float(1 << 53) / (float(smallest[-1]) + 1))
+
+    def result(self) -> Dict[str, Any]:
+        """
+        Returns:
+            列信息 {name, type, stats, samples}
+        """
+        dtype = self._final_type()
+        unique_count = self._count_distinct(self.distinct, self.smallest)
+        stats = {
+            'null_count': self.null_count,
+            'unique_count': unique_count,
+            'total_count': self.total_count
+        }
+
+        if dtype in ('int', 'float') and self.numeric_count:
+            stats['min'] = self.numeric_min
+            stats['max'] = self.numeric_max
+            stats['mean'] = self.numeric_mean
+            stats['std'] = (
+                float(np.sqrt(self.numeric_m2 / (self.numeric_count - 1)))
+                if self.numeric_count > 1 else None
+            )
+            stats['median'] = float(np.median(self.sample_values))
+        elif dtype == 'string' and self.length_count:
+            stats['max_length'] = self.length_max
+            stats['min_length'] = self.length_min
+            stats['avg_length'] = self.length_total / self.length_count
+        elif dtype == 'date':
+            stats['min_date'] = str(self.min_date) if self.min_date is not None else None
+            stats['max_date'] = str(self.max_date) if self.max_date is not None else None
+
+        # 键列的取值草图,供跨数据集连接规划估计取值重合度
+        if self.key_hashes and self.types:
+            value_sketch = make_value_sketch(
+                self.key_distinct if self.key_distinct is not None else self.key_smallest,
+                self._count_distinct(self.key_distinct, self.key_smallest),
+                self.total_count - self.null_count
+            )
+            if value_sketch and dtype in ('int', 'string'):
+                stats['value_sketch'] = value_sketch
+
+        return {
+            'name': self.name,
+            'type': dtype,
+            'stats': stats,
+            'samples': self.samples
+        }
+
+
+def _profile_columns(chunk: pd.DataFrame, seed: int) -> List[ColumnProfiler]:
+    """在进程池中执行: 统计一块数据中的若干列"""
+    profilers = []
+    for name in chunk.columns:
+        profiler = ColumnProfiler(name, seed=seed)
+        profiler.update(chunk[name])
+        profilers.append(profiler)
+    return profilers
+
+
+_profile_pool: Optional[ProcessPoolExecutor] = None
+_profile_pool_lock = threading.Lock()
+
+
+def _profile_workers() -> int:
+    """列统计进程数: PARSE_PROFILE_WORKERS,不超过CPU核数"""
+    return min(settings.PARSE_PROFILE_WORKERS, os.cpu_count() or 1)
+
+
+def _get_profile_pool() -> Optional[ProcessPoolExecutor]:
+    """获取列统计进程池(首次使用时创建),进程数不大于1时返回None"""
+    global _profile_pool
+    workers = _profile_workers()
+    if workers <= 1:
+        return None
+    with _profile_pool_lock:
+        if _profile_pool is None:
+            # 使用spawn启动: 服务进程中已有DuckDB等线程,fork后子进程可能死锁
+            _profile_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            logger.info(f"列统计进程池已创建: {workers} 个进程")
+        return _profile_pool
+
+
+def shutdown_profile_pool():
+    """关闭列统计进程池"""
+    global _profile_pool
+    with _profile_pool_lock:
+        if _profile_pool is not None:
+            _profile_pool.shutdown(wait=False, cancel_futures=True)
+            _profile_pool = None
+
+
+def submit_chunk_profile(chunk: pd.DataFrame, seed: int = 0) -> List[Future]:
+    """
+    提交一块数据的列统计
+
+    列数不少于 PARSE_PROFILE_MIN_COLUMNS 时按列分组提交到进程池,否则在当前线程中完成
+
+    Args:
+        chunk: 数据块(列名唯一)
+        seed: 中位数抽样的随机种子,各块应不同
+
+    Returns:
+        Future列表,结果为 ColumnProfiler 列表,依次合并即为整块的统计结果
+    """
+    pool = _get_profile_pool()
+    column_count = len(chunk.columns)
+    if pool is None or column_count < settings.PARSE_PROFILE_MIN_COLUMNS:
+        future = Future()
+        future.set_result(_profile_columns(chunk, seed))
+        return [future]
+
+    groups = np.array_split(np.arange(column_count), min(_profile_workers(), column_count))
+    return [pool.submit(_profile_columns, chunk.iloc[:, group], seed) for group in groups]
+
+
+def merge_chunk_profile(profilers: Dict[str, ColumnProfiler], futures: List[Future]):
+    """等待一块数据的列统计完成,合并到各列的累计结果"""
+    for future in futures:
+        for partial in future.result():
+            profilers[partial.name].merge(partial)
@@ -0,0 +1,216 @@
+"""
+CSV读取工具
+从文件开头的字节样本一次性检测编码,再用PyArrow多线程CSV读取器分块读取;
+PyArrow无法处理的文件(列数不齐、后续块类型与推断不符等)回退到pandas继续读取。
+样本之后才出现无法按检测结果解码的内容时,改用下一个候选编码继续读取
+"""
+import codecs
+import io
+import logging
+import os
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 依次尝试的编码: GB18030 兼容 GBK/GB2312,latin1 可解码任意字节,作为最后的选择
+_ENCODING_CANDIDATES = ('utf-8', 'gb18030')
+_FALLBACK_ENCODING = 'latin1'
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    根据字节样本检测文本编码
+
+    样本末尾可能截断在多字节字符中间,使用增量解码器忽略末尾不完整的字符
+
+    Args:
+        sample: 文件开头的字节
+
+    Returns:
+        Python编码名
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    for encoding in _ENCODING_CANDIDATES:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return _FALLBACK_ENCODING
+
+
+def _next_encoding(encoding: str) -> Optional[str]:
+    """解码失败时改用的下一个编码,latin1 可解码任意字节,之后不再更换"""
+    if encoding in ('utf-8', 'utf-8-sig'):
+        return 'gb18030'
+    if encoding != _FALLBACK_ENCODING:
+        return _FALLBACK_ENCODING
+    return None
+
+
+def _is_decode_error(error: Exception) -> bool:
+    # PyArrow按UTF-8读取时,后续块中的非法字节报 "invalid UTF8 data"
+    return isinstance(error, UnicodeDecodeError) or 'UTF8' in str(error)
+
+
+def read_csv_head(data: bytes, nrows: int) -> Tuple[pd.DataFrame, str]:
+    """
+    读取CSV内容的前若干行(用于预览)
+
+    由样本检测编码,前若干行中出现无法按该编码解码的内容时改用下一个候选编码
+
+    Args:
+        data: CSV文件内容
+        nrows: 读取行数
+
+    Returns:
+        (DataFrame, 使用的编码)
+    """
+    encoding = detect_encoding(data[:settings.PARSE_ENCODING_SAMPLE_BYTES])
+    while True:
+        try:
+            return pd.read_csv(io.BytesIO(data), encoding=encoding, nrows=nrows), encoding
+        except UnicodeDecodeError as e:
+            next_encoding = _next_encoding(encoding)
+            if next_encoding is None:
+                raise
+            logger.warning(f"CSV内容无法按 {encoding} 解码,改用 {next_encoding}: {e}")
+            encoding = next_encoding
+
+
+def detect_file_encoding(path: str) -> str:
+    """读取文件开头的样本检测编码"""
+    with open(path, 'rb') as f:
+        return detect_encoding(f.read(settings.PARSE_ENCODING_SAMPLE_BYTES))
+
+
+def _open_arrow_reader(source: BinaryIO, encoding: str) -> pa_csv.CSVStreamingReader:
+    # 传入文件对象而非路径: 按路径打开时PyArrow会预读整个文件,内存占用与文件大小成正比
+    # PyArrow原生处理UTF-8(含BOM),其他编码通过Python编解码器转码
+    arrow_encoding = 'utf8' if encoding in ('utf-8', 'utf-8-sig') else encoding
+    read_options = pa_csv.ReadOptions(
+        encoding=arrow_encoding,
+        block_size=settings.PARSE_CSV_BLOCK_SIZE,
+        use_threads=True
+    )
+    # 与pandas一致: 空字符串视为空值
+    convert_options = pa_csv.ConvertOptions(strings_can_be_null=True)
+
+    # 先用第一块数据推断各列类型(与流式读取器的推断范围相同)。
+    # 与pandas一致: 日期时间列保留原始文本,由类型推断识别为日期
+    head = source.read(settings.PARSE_CSV_BLOCK_SIZE)
+    source.seek(0)
+    # 样本末尾截断的行会被当作列数不齐的完整行,只保留到最后一个换行符
+    last_newline = head.rfind(b'\n')
+    if last_newline > 0:
+        head = head[:last_newline + 1]
+    probe = pa_csv.open_csv(pa.BufferReader(head), read_options=read_options, convert_options=convert_options)
+    convert_options.column_types = {
+        field.name: pa.string() for field in probe.schema if pa.types.is_temporal(field.type)
+    }
+    probe.close()
+
+    reader = pa_csv.open_csv(source, read_options=read_options, convert_options=convert_options)
+    # 文本文件中推断出二进制列,说明有内容不是合法的UTF-8,按解码失败处理
+    binary_columns = [field.name for field in reader.schema if pa.types.is_binary(field.type)]
+    if binary_columns:
+        reader.close()
+        raise UnicodeDecodeError(encoding, b'', 0, 0, f"列 {binary_columns} 含有无法解码的内容")
+    return reader
+
+
+def _iter_arrow_chunks(reader: pa_csv.CSVStreamingReader, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """将PyArrow按字节块读出的批次重新组合为固定行数的DataFrame"""
+    pending: List[pa.RecordBatch] = []
+    pending_rows = 0
+    for batch in reader:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= chunk_rows:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, chunk_rows).to_pandas()
+            pending = table.slice(chunk_rows).to_batches()
+            pending_rows -= chunk_rows
+    if pending_rows:
+        yield pa.Table.from_batches(pending).to_pandas()
+
+
+def iter_csv_chunks(
+    path: str,
+    chunk_rows: int,
+    encoding: Optional[str] = None,
+    on_progress: Optional[Callable[[float], None]] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    分块读取CSV文件
+
+    Args:
+        path: 本地文件路径
+        chunk_rows: 每块行数
+        encoding: 文件编码,为空时自动检测
+        on_progress: 每读出一块后以读取进度(0~1,按样本的平均行长估计)回调
+    """
+    with open(path, 'rb') as f:
+        sample = f.read(settings.PARSE_ENCODING_SAMPLE_BYTES)
+    encoding = encoding or detect_encoding(sample)
+    logger.info(f"CSV文件编码: {encoding}")
+    estimated_rows = max(os.path.getsize(path) * sample.count(b'\n') / max(len(sample), 1) - 1, 1)
+
+    rows_read = 0
+
+    def report():
+        if on_progress:
+            on_progress(min(rows_read / estimated_rows, 1.0))
+
+    native = settings.PARSE_CSV_NATIVE
+    while native:
+        try:
+            with open(path, 'rb') as source:
+                reader = _open_arrow_reader(source, encoding)
+                try:
+                    for chunk in _iter_arrow_chunks(reader, chunk_rows):
+                        rows_read += len(chunk)
+                        yield chunk
+                        report()
+                    return
+                finally:
+                    reader.close()
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, UnicodeDecodeError) as e:
+            if not _is_decode_error(e):
+                logger.warning(f"PyArrow读取CSV失败,从第 {rows_read} 行起改用pandas读取: {e}")
+                break
+            next_encoding = _next_encoding(encoding)
+            logger.warning(f"第 {rows_read} 行后的内容无法按 {encoding} 解码,改用 {next_encoding}: {e}")
+            encoding = next_encoding
+            # 尚未读出数据时用新编码重新读取,否则由pandas跳过已读出的行继续读取
+            native = rows_read == 0
+
+    while True:
+        # 已读出的行跳过(保留表头行)
+        skiprows = range(1, rows_read + 1) if rows_read else None
+        try:
+            with pd.read_csv(
+                path,
+                encoding=encoding,
+                low_memory=False,
+                skiprows=skiprows,
+                chunksize=chunk_rows
+            ) as reader:
+                for chunk in reader:
+                    rows_read += len(chunk)
+                    yield chunk
+                    report()
+            return
+        except UnicodeDecodeError as e:
+            next_encoding = _next_encoding(encoding)
+            if next_encoding is None:
+                raise
+            logger.warning(f"第 {rows_read} 行后的内容无法按 {encoding} 解码,改用 {next_encoding}: {e}")
+            encoding = next_encoding
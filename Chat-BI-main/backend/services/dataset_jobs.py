@@ -0,0 +1,387 @@
+"""
+数据集后台任务队列
+解析、分片、向量化任务持久化在Redis中,由独立的worker进程(worker.py)执行:
+API进程重启不丢失任务,繁重的解析工作也不再与请求处理争抢同一进程
+
+- 每个阶段一个就绪队列(有序集合,按 优先级、入队时间 排序)
+- 领取任务与阶段并发上限检查在同一Lua脚本中原子完成,上限对所有worker生效
+- 执行中的任务带租约,worker定期续租;租约过期(worker退出)的任务按失败处理并重试
+- 失败后按指数退避重试,状态同步到 SysDataset 对应阶段的状态/错误字段
+- 阶段成功后自动将下一阶段(解析 -> 分片 -> 向量化)以相同优先级入队
+"""
+import asyncio
+import importlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Set
+
+from api.dependencies.dependencies import redis_client
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+JOB_KEY_PREFIX = "dataset_job"
+QUEUE_KEY_PREFIX = "dataset_jobs"
+
+# 优先级: 数值越小越先执行
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+# 阶段 -> 执行函数(延迟导入,避免循环依赖)
+STAGE_HANDLERS = {
+    'parse': ('services.dataset_parser', 'parse_dataset_task'),
+    'chunk': ('services.dataset_tasks', 'chunk_dataset_task'),
+    'vectorize': ('services.dataset_tasks', 'vectorize_dataset_task'),
+    'embedding': ('services.dataset_tasks', 'embedding_dataset_task'),
+}
+
+# 阶段成功后自动入队的下一阶段
+NEXT_STAGE = {
+    'parse': 'chunk',
+    'chunk': 'vectorize',
+}
+
+# 阶段 -> SysDataset 的 (状态字段, 错误字段)
+STATUS_COLUMNS = {
+    'parse': ('parse_status', 'error_message'),
+    'chunk': ('chunk_status', 'chunk_error'),
+    'vectorize': ('vectorize_status', 'vectorize_error'),
+    'embedding': ('embedding_status', 'embedding_error'),
+}
+
+# 原子地领取一个任务: 阶段内执行中的任务数未达上限时,弹出优先级最高的任务并登记租约
+_CLAIM_SCRIPT = redis_client.register_script("""
+if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[1]) then
+    return false
+end
+local item = redis.call('ZPOPMIN', KEYS[1])
+if #item == 0 then
+    return false
+end
+redis.call('ZADD', KEYS[2], ARGV[2], item[1])
+return item[1]
+""")
+
+
+def _job_key(job_id: str) -> str:
+    return f"{JOB_KEY_PREFIX}:{job_id}"
+
+
+def _ready_key(stage: str) -> str:
+    return f"{QUEUE_KEY_PREFIX}:ready:{stage}"
+
+
+def _running_key(stage: str) -> str:
+    return f"{QUEUE_KEY_PREFIX}:running:{stage}"
+
+
+def _delayed_key() -> str:
+    return f"{QUEUE_KEY_PREFIX}:delayed"
+
+
+def _active_key(stage: str, dataset_id: str) -> str:
+    """同一数据集同一阶段只保留一个未结束的任务"""
+    return f"{QUEUE_KEY_PREFIX}:active:{stage}:{dataset_id}"
+
+
+def _score(priority: int) -> float:
+    # 优先级占高位,同优先级按入队时间先后
+    return priority * 1e10 + time.time()
+
+
+def _stage_limit(stage: str) -> int:
+    if stage == 'parse':
+        return settings.JOB_CONCURRENCY_PARSE
+    if stage == 'chunk':
+        return settings.JOB_CONCURRENCY_CHUNK
+    return settings.JOB_CONCURRENCY_VECTORIZE
+
+
+def _decode(value) -> Optional[str]:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def _load_job(job_id: str) -> Optional[Dict[str, Any]]:
+    data = await redis_client.get(_job_key(job_id))
+    return json.loads(data) if data else None
+
+
+async def _save_job(job: Dict[str, Any], ttl: Optional[int] = None):
+    job['updated_at'] = datetime.now().isoformat()
+    await redis_client.set(_job_key(job['id']), json.dumps(job, ensure_ascii=False), ex=ttl)
+
+
+async def _mirror_status(dataset_id: str, stage: str, status: str, error: Optional[str] = None):
+    """将任务状态同步到 SysDataset"""
+    from db.session import async_session
+    from models.sys_dataset import SysDataset
+    from sqlalchemy import update
+
+    status_column, error_column = STATUS_COLUMNS[stage]
+    try:
+        async with async_session() as session:
+            await session.execute(
+                update(SysDataset)
+                .where(SysDataset.id == dataset_id)
+                .values({status_column: status, error_column: error})
+            )
+            await session.commit()
+    except Exception as e:
+        logger.warning(f"同步任务状态到数据集失败: {dataset_id} {stage}={status}: {e}")
+
+
+async def _dataset_exists(dataset_id: str) -> bool:
+    from db.session import async_session
+    from models.sys_dataset import SysDataset
+    from sqlalchemy import select
+
+    async with async_session() as session:
+        result = await session.execute(select(SysDataset.id).where(SysDataset.id == dataset_id))
+        return result.scalar_one_or_none() is not None
+
+
+async def enqueue_dataset_job(
+    stage: str,
+    dataset_id: str,
+    args: Optional[Dict[str, Any]] = None,
+    priority: int = PRIORITY_NORMAL
+) -> str:
+    """
+    将数据集任务加入队列
+
+    同一数据集同一阶段已有未结束的任务时不重复入队,返回已有任务的ID
+
+    Args:
+        stage: 阶段(parse/chunk/vectorize/embedding)
+        dataset_id: 数据集ID
+        args: 传给执行函数的其他参数
+        priority: 优先级,数值越小越先执行
+
+    Returns:
+        任务ID
+    """
+    if stage not in STAGE_HANDLERS:
+        raise ValueError(f"未知的任务阶段: {stage}")
+
+    dataset_id = str(dataset_id)
+    job_id = uuid.uuid4().hex
+    active_key = _active_key(stage, dataset_id)
+    if not await redis_client.set(active_key, job_id, nx=True, ex=settings.JOB_RESULT_TTL):
+        existing = _decode(await redis_client.get(active_key))
+        if existing and await redis_client.exists(_job_key(existing)):
+            logger.info(f"数据集 {dataset_id} 已有未结束的 {stage} 任务: {existing}")
+            return existing
+        await redis_client.set(active_key, job_id, ex=settings.JOB_RESULT_TTL)
+
+    job = {
+        'id': job_id,
+        'stage': stage,
+        'dataset_id': dataset_id,
+        'args': args or {},
+        'priority': priority,
+        'attempts': 0,
+        'status': 'queued',
+        'error': None,
+        'created_at': datetime.now().isoformat()
+    }
+    await _save_job(job)
+    await redis_client.zadd(_ready_key(stage), {job_id: _score(priority)})
+    logger.info(f"任务已入队: {stage} 数据集={dataset_id} 任务={job_id} 优先级={priority}")
+    return job_id
+
+
+async def _finish_job(job: Dict[str, Any], status: str, error: Optional[str] = None):
+    job['status'] = status
+    job['error'] = error
+    await _save_job(job, ttl=settings.JOB_RESULT_TTL)
+    # 只删除仍指向本任务的去重标记
+    active_key = _active_key(job['stage'], job['dataset_id'])
+    if _decode(await redis_client.get(active_key)) == job['id']:
+        await redis_client.delete(active_key)
+
+
+async def _job_failed(job: Dict[str, Any], error: BaseException):
+    """
+    失败后按指数退避重试;数据错误(ValueError,如文件无法解析)重试也无法成功,直接标记失败
+    """
+    message = str(error)
+    retryable = not isinstance(error, ValueError)
+    if retryable and job['attempts'] < settings.JOB_MAX_ATTEMPTS:
+        delay = min(
+            settings.JOB_RETRY_BASE_DELAY * 2 ** max(job['attempts'] - 1, 0),
+            settings.JOB_RETRY_MAX_DELAY
+        )
+        job['status'] = 'retrying'
+        job['error'] = message
+        await _save_job(job)
+        await redis_client.zadd(_delayed_key(), {job['id']: time.time() + delay})
+        logger.warning(
+            f"任务失败,{delay:.0f}秒后重试({job['attempts']}/{settings.JOB_MAX_ATTEMPTS}): "
+            f"{job['stage']} 数据集={job['dataset_id']}: {message}"
+        )
+        await _mirror_status(
+            job['dataset_id'], job['stage'], 'pending',
+            f"第{job['attempts']}次执行失败,{delay:.0f}秒后重试: {message}"
+        )
+    else:
+        await _finish_job(job, 'failed', message)
+        logger.error(f"任务失败: {job['stage']} 数据集={job['dataset_id']} 任务={job['id']}: {message}")
+        await _mirror_status(job['dataset_id'], job['stage'], 'failed', message)
+
+
+async def _promote_jobs(stages: Iterable[str]):
+    """将到期的重试任务放回就绪队列,租约过期的任务按失败处理"""
+    now = time.time()
+    for job_id in await redis_client.zrangebyscore(_delayed_key(), '-inf', now):
+        # ZREM 成功的worker负责处理,避免多个worker重复入队
+        if not await redis_client.zrem(_delayed_key(), job_id):
+            continue
+        job = await _load_job(_decode(job_id))
+        if job:
+            job['status'] = 'queued'
+            await _save_job(job)
+            await redis_client.zadd(_ready_key(job['stage']), {job['id']: _score(job['priority'])})
+
+    for stage in stages:
+        for job_id in await redis_client.zrangebyscore(_running_key(stage), '-inf', now):
+            if not await redis_client.zrem(_running_key(stage), job_id):
+                continue
+            job = await _load_job(_decode(job_id))
+            if job:
+                logger.warning(f"任务租约过期(worker已退出): {stage} 任务={job['id']}")
+                await _job_failed(job, RuntimeError("执行任务的worker已退出"))
+
+
+async def _claim(stage: str) -> Optional[str]:
+    job_id = await _CLAIM_SCRIPT(
+        keys=[_ready_key(stage), _running_key(stage)],
+        args=[_stage_limit(stage), time.time() + settings.JOB_LEASE_SECONDS]
+    )
+    return _decode(job_id) if job_id else None
+
+
+async def _keep_lease(stage: str, job_id: str):
+    while True:
+        await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
+        await redis_client.zadd(
+            _running_key(stage), {job_id: time.time() + settings.JOB_LEASE_SECONDS}, xx=True
+        )
+
+
+async def _recover_job(stage: str, job_id: str, job: Optional[Dict[str, Any]], error: BaseException) -> bool:
+    """
+    任务流程本身出错(如Redis、数据库连接异常)时按失败处理: 安排重试,或标记失败并清除去重标记
+
+    Returns:
+        是否处理成功;失败时保留执行中登记,租约过期后由 _promote_jobs 按失败重试
+    """
+    try:
+        if job is None:
+            job = await _load_job(job_id)
+            if job is not None:
+                job['attempts'] += 1
+        if job is not None:
+            await _job_failed(job, RuntimeError(f"执行任务出错: {error}"))
+        return True
+    except Exception as e:
+        logger.error(f"任务状态更新失败,租约过期后重试: {stage} 任务={job_id}: {e}")
+        return False
+
+
+async def _run_job(stage: str, job_id: str):
+    lease = asyncio.create_task(_keep_lease(stage, job_id))
+    job = None
+    # 任务已结束或已安排重试,可以移出执行中队列
+    settled = False
+    try:
+        job = await _load_job(job_id)
+        if job is None:
+            logger.warning(f"任务记录不存在,跳过: {stage} 任务={job_id}")
+            settled = True
+            return
+        # 出错时也计入重试次数,避免执行前的异常无限重试
+        job['attempts'] += 1
+        if not await _dataset_exists(job['dataset_id']):
+            logger.info(f"数据集已删除,取消任务: {stage} 数据集={job['dataset_id']}")
+            await _finish_job(job, 'cancelled')
+            settled = True
+            return
+
+        job['status'] = 'running'
+        await _save_job(job)
+
+        module_name, func_name = STAGE_HANDLERS[stage]
+        handler = getattr(importlib.import_module(module_name), func_name)
+        logger.info(f"开始执行任务: {stage} 数据集={job['dataset_id']} 第{job['attempts']}次")
+        try:
+            await handler(job['dataset_id'], **job['args'])
+        except Exception as e:
+            await _job_failed(job, e)
+            settled = True
+            return
+
+        await _finish_job(job, 'completed')
+        settled = True
+        logger.info(f"任务完成: {stage} 数据集={job['dataset_id']}")
+        if stage in NEXT_STAGE:
+            await enqueue_dataset_job(NEXT_STAGE[stage], job['dataset_id'], priority=job['priority'])
+    except Exception as e:
+        logger.error(f"执行任务出错: {stage} 任务={job_id}: {e}", exc_info=True)
+        if not settled:
+            settled = await _recover_job(stage, job_id, job, e)
+    finally:
+        lease.cancel()
+        if settled:
+            await redis_client.zrem(_running_key(stage), job_id)
+
+
+async def run_worker(stages: Optional[Iterable[str]] = None, stop: Optional[asyncio.Event] = None):
+    """
+    循环领取并执行任务,直到 stop 被设置;退出前等待执行中的任务结束
+
+    Args:
+        stages: 处理的阶段,默认全部
+        stop: 停止信号
+    """
+    from services.upload_expiry import expire_stale_uploads
+
+    stages = list(stages or STAGE_HANDLERS)
+    stop = stop or asyncio.Event()
+    running: Dict[str, Set[asyncio.Task]] = {stage: set() for stage in stages}
+    next_sweep = 0.0
+    logger.info(f"任务worker已启动,处理阶段: {', '.join(stages)}")
+
+    while not stop.is_set():
+        claimed = False
+        try:
+            await _promote_jobs(stages)
+            if time.monotonic() >= next_sweep:
+                next_sweep = time.monotonic() + settings.UPLOAD_SWEEP_INTERVAL
+                await expire_stale_uploads()
+            for stage in stages:
+                while len(running[stage]) < _stage_limit(stage):
+                    job_id = await _claim(stage)
+                    if job_id is None:
+                        break
+                    task = asyncio.create_task(_run_job(stage, job_id))
+                    running[stage].add(task)
+                    task.add_done_callback(running[stage].discard)
+                    claimed = True
+        except Exception as e:
+            logger.error(f"领取任务失败: {e}")
+
+        if not claimed:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=settings.JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    pending = set().union(*running.values())
+    if pending:
+        logger.info(f"等待 {len(pending)} 个执行中的任务结束")
+        await asyncio.wait(pending)
+    logger.info("任务worker已停止")
@@ -5,14 +5,35 @@
 import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from models.sys_dataset import SysDataset, SysDatasetColumn
 from db.session import async_session
 from core.minio_client import minio_client
+from core.config import settings
+from services.cache_invalidation import broadcast_dataset_invalidation
+from services.csv_reader import iter_csv_chunks
+from services.excel_reader import (
+    ExcelReadError,
+    detect_header_rows_in_preview,
+    excel_engines,
+    iter_excel_chunks,
+    open_excel_rows,
+)
+from services.progress_reporter import DatasetProgressReporter
+from services.column_profiler import (
+    ColumnProfiler,
+    merge_chunk_profile,
+    submit_chunk_profile
+)
+import asyncio
+import duckdb
 import io
+import itertools
 import logging
-from typing import List, Dict, Any
-from datetime import datetime
+import os
+import shutil
+import tempfile
+from typing import List, Dict, Any, Callable, Iterator, Optional
 import numpy as np
 
 logger = logging.getLogger(__name__)
@@ -26,12 +47,12 @@ def detect_header_rows(
 ) -> List[int]:
     """
     智能检测Excel表头行数（支持任意层级）
-    
-    策略：动态检测，直到遇到明显的数据行为止
-    
+
+    只流式读取开头 max_rows+2 行,检测规则见 excel_reader.detect_header_rows_in_preview
+
     Args:
         file_data: Excel文件数据（bytes）
-        engine: pandas读取引擎
+        engine: 读取引擎(openpyxl / xlrd)
         max_rows: 最大检测行数（防止无限循环，默认10行）
         min_data_confidence: 判断为数据行的最小置信度（0-1）
     
@@ -39,77 +60,14 @@ def detect_header_rows(
         表头行索引列表，例如 [0] 表示单行表头，[0, 1, 2] 表示三行表头
     """
     try:
-        # 读取更多行用于检测（增加检测范围）
-        preview_buffer = io.BytesIO(file_data)
-        preview_df = pd.read_excel(
-            preview_buffer,
-            nrows=max_rows + 2,  # 多读几行，用于对比判断
-            header=None,
-            engine=engine
+        rows, _, close = open_excel_rows(io.BytesIO(file_data), engine)
+        try:
+            preview = list(itertools.islice(rows, max_rows + 2))  # 多读几行，用于对比判断
+        finally:
+            close()
+        return detect_header_rows_in_preview(
+            pd.DataFrame(preview), max_rows=max_rows, min_data_confidence=min_data_confidence
         )
-        
-        if len(preview_df) == 0:
-            return [0]
-        
-        # 检查每行的特征，动态判断
-        header_candidates = [0]  # 至少第一行是表头
-        
-        for i in range(1, min(max_rows, len(preview_df))):
-            row = preview_df.iloc[i]
-            
-            if len(row) == 0:
-                # 空行，跳过
-                continue
-            
-            # 计算各种特征
-            null_ratio = row.isna().sum() / len(row)
-            unique_ratio = row.nunique() / len(row)
-            
-            # 检查数据类型：表头通常是字符串，数据行通常有数值
-            string_count = sum(1 for val in row if pd.notna(val) and isinstance(val, str))
-            numeric_count = sum(1 for val in row if pd.notna(val) and isinstance(val, (int, float)))
-            string_ratio = string_count / len(row) if len(row) > 0 else 0
-            numeric_ratio = numeric_count / len(row) if len(row) > 0 else 0
-            
-            # 判断是否为表头行的综合指标
-            is_likely_header = False
-            
-            # 条件1：空值比例高（可能是合并单元格）
-            if null_ratio > 0.3:
-                is_likely_header = True
-            
-            # 条件2：唯一值比例低（可能是重复的表头结构）
-            elif unique_ratio < 0.5:
-                is_likely_header = True
-            
-            # 条件3：整行都是字符串（更可能是表头）
-            elif string_ratio > 0.8 and numeric_ratio < 0.2:
-                is_likely_header = True
-            
-            # 条件4：与上一行对比，如果结构相似（都有空值），可能是同一层级表头
-            if i > 0:
-                prev_row = preview_df.iloc[i-1]
-                prev_null_ratio = prev_row.isna().sum() / len(prev_row) if len(prev_row) > 0 else 0
-                # 如果两行都有较高的空值比例，可能是多层级表头
-                if null_ratio > 0.2 and prev_null_ratio > 0.2:
-                    is_likely_header = True
-            
-            if is_likely_header:
-                header_candidates.append(i)
-            else:
-                # 这一行看起来像数据，停止检测
-                # 但需要确认：如果数值比例很高，几乎肯定是数据行
-                if numeric_ratio > min_data_confidence:
-                    logger.info(f"在第 {i+1} 行检测到数据特征（数值比例: {numeric_ratio:.2f}），停止检测")
-                    break
-        
-        # 如果检测到多行表头，返回所有候选行
-        if len(header_candidates) > 1:
-            logger.info(f"检测到 {len(header_candidates)} 行表头: {header_candidates}")
-            return header_candidates
-        
-        # 默认单行表头
-        return [0]
     except Exception as e:
         logger.warning(f"表头行数检测失败，使用单行表头: {e}")
         return [0]  # 失败时降级为单行表头
@@ -122,89 +80,194 @@ def read_excel_with_multilevel_header(
 ) -> pd.DataFrame:
     """
     读取Excel，自动处理多行表头
+
+    工作簿只打开一次,表头检测与数据读取共用同一个行迭代器(见 excel_reader.iter_excel_chunks)
     
     Args:
         file_data: Excel文件数据（bytes）
-        engine: pandas读取引擎
+        engine: 读取引擎(openpyxl / xlrd)
         detect_headers: 是否自动检测表头行数
     
     Returns:
         处理后的DataFrame，多行表头已合并为单层列名
     """
-    file_buffer = io.BytesIO(file_data)
-    
-    try:
-        if detect_headers:
-            # 尝试检测表头行数（支持任意层级）
-            header_rows = detect_header_rows(file_data, engine, max_rows=10)
-            file_buffer.seek(0)
-        else:
-            header_rows = [0]
-        
-        # 读取数据
-        if len(header_rows) > 1:
-            # 多行表头：使用MultiIndex
-            logger.info(f"使用多行表头读取: header={header_rows}")
-            df = pd.read_excel(
-                file_buffer,
-                header=header_rows,
-                engine=engine
+    chunks = list(iter_excel_chunks(
+        io.BytesIO(file_data), [engine], settings.PARSE_CHUNK_ROWS, detect_headers=detect_headers
+    ))
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+
+def read_excel_dataset(file_data: bytes, filename: str) -> pd.DataFrame:
+    """
+    读取Excel/WPS文件,依次尝试可用的解析引擎
+
+    Args:
+        file_data: 文件数据
+        filename: 原始文件名(用于判断格式)
+
+    Returns:
+        DataFrame,多行表头已合并为单层列名
+    """
+    # Excel/WPS文件,尝试多种引擎
+    df = None
+    errors = []
+
+    # 尝试顺序: openpyxl -> xlrd (for .et files, try both)
+    for engine in excel_engines(filename):
+        try:
+            # 使用多表头支持函数读取
+            df = read_excel_with_multilevel_header(
+                file_data,
+                engine=engine,
+                detect_headers=True
             )
-            
-            # 将MultiIndex转换为单层列名
-            # 处理逻辑：合并非空值，用下划线连接
-            def merge_column_names(col_tuple):
-                """合并MultiIndex列名为单个字符串"""
-                # 过滤掉空值、nan、空字符串
-                parts = []
-                for col in col_tuple:
-                    col_str = str(col).strip()
-                    if col_str and col_str.lower() not in ['nan', 'none', '']:
-                        parts.append(col_str)
-                
-                # 用下划线连接
-                merged = '_'.join(parts)
-                
-                # 如果合并后为空，使用默认列名
-                return merged if merged else None
-            
-            # 转换列名
-            new_columns = []
-            for i, col_tuple in enumerate(df.columns.values):
-                merged_name = merge_column_names(col_tuple)
-                if merged_name:
-                    new_columns.append(merged_name)
-                else:
-                    new_columns.append(f'Column_{i}')
-            
-            df.columns = new_columns
-            
-            logger.info(f"多表头合并完成，列名示例: {new_columns[:5]}")
-            
-        else:
-            # 单行表头：正常读取
-            df = pd.read_excel(
-                file_buffer,
-                header=0,
-                engine=engine
+            logger.info(f"使用{engine}引擎解析成功（支持多表头）")
+            break
+        except Exception as e:
+            error_msg = str(e)
+            errors.append(f"{engine}: {error_msg}")
+            logger.warning(f"{engine}解析失败: {e}")
+
+            # 如果是 DataValidation 错误，尝试多种降级策略
+            if "DataValidation" in error_msg and engine == "openpyxl":
+                # 策略1: 使用 openpyxl 底层 API 跳过验证
+                try:
+                    import openpyxl
+                    from openpyxl.worksheet.datavalidation import DataValidation as DV
+
+                    # 临时禁用 DataValidation 的参数检查
+                    original_init = DV.__init__
+                    def patched_init(self, *args, **kwargs):
+                        # 移除不兼容的参数
+                        kwargs.pop('id', None)
+                        original_init(self, *args, **kwargs)
+
+                    DV.__init__ = patched_init
+
+                    try:
+                        # 降级策略：使用openpyxl手动读取
+                        # 注意：这个降级策略只支持单行表头，因为已经是降级路径了
+                        wb = openpyxl.load_workbook(io.BytesIO(file_data), data_only=True)
+                        ws = wb.active
+                        data = list(ws.values)
+
+                        if data and len(data) > 0:
+                            # 尝试检测多表头（简单版本）
+                            # 检查前两行，如果有大量空值，可能是多表头
+                            if len(data) >= 2:
+                                first_row = data[0]
+                                second_row = data[1]
+                                null_count = sum(1 for val in first_row if val is None or val == '')
+
+                                # 如果第一行空值多，尝试合并前两行
+                                if null_count > len(first_row) * 0.3:
+                                    # 合并表头：用第二行填充第一行的空值
+                                    merged_cols = []
+                                    for i, (first_val, second_val) in enumerate(zip(first_row, second_row)):
+                                        if first_val and str(first_val).strip():
+                                            if second_val and str(second_val).strip():
+                                                merged_cols.append(f"{first_val}_{second_val}")
+                                            else:
+                                                merged_cols.append(str(first_val))
+                                        elif second_val and str(second_val).strip():
+                                            merged_cols.append(str(second_val))
+                                        else:
+                                            merged_cols.append(f'Column_{i}')
+                                    cols = merged_cols
+                                    rows = data[2:]  # 从第三行开始
+                                    logger.info("检测到多表头，已合并（降级模式）")
+                                else:
+                                    # 单行表头
+                                    cols = data[0]
+                                    cols = [str(col) if col is not None else f'Column_{i}' for i, col in enumerate(cols)]
+                                    rows = data[1:]
+                            else:
+                                # 数据不足，使用单行表头
+                                cols = data[0]
+                                cols = [str(col) if col is not None else f'Column_{i}' for i, col in enumerate(cols)]
+                                rows = data[1:]
+
+                            # 确保每行数据长度与列数一致
+                            clean_rows = []
+                            for row in rows:
+                                # 转换为列表，确保长度与列数一致
+                                row_list = list(row) if row else []
+                                # 填充或截断到正确的列数
+                                if len(row_list) < len(cols):
+                                    row_list.extend([None] * (len(cols) - len(row_list)))
+                                elif len(row_list) > len(cols):
+                                    row_list = row_list[:len(cols)]
+                                clean_rows.append(row_list)
+
+                            # 创建 DataFrame
+                            df = pd.DataFrame(clean_rows, columns=cols)
+
+                        wb.close()
+                        logger.info(f"使用{engine}引擎(补丁模式)解析成功")
+                        break
+                    finally:
+                        # 恢复原始方法
+                        DV.__init__ = original_init
+
+                except Exception as e2:
+                    errors.append(f"{engine}(补丁模式): {str(e2)}")
+                    logger.warning(f"{engine}补丁模式失败: {e2}")
+
+                # 策略2: 尝试使用 pyxlsb (如果是 xlsb 格式)
+                try:
+                    import pyxlsb
+                    from pyxlsb import open_workbook
+                    with open_workbook(io.BytesIO(file_data)) as wb:
+                        with wb.get_sheet(1) as sheet:
+                            data = [[item.v if item else None for item in row] for row in sheet.rows()]
+                            if data:
+                                cols = data[0]
+                                df = pd.DataFrame(data[1:], columns=cols)
+                    logger.info(f"使用 pyxlsb 引擎解析成功")
+                    break
+                except (ImportError, Exception) as e3:
+                    errors.append(f"pyxlsb: {str(e3)}")
+                    logger.warning(f"pyxlsb 解析失败: {e3}")
+
+            continue
+
+    if df is None:
+        # 如果所有引擎都失败
+        if filename.endswith('.et'):
+            raise ValueError(
+                f".et文件解析失败。WPS .et格式与Excel不完全兼容，所有解析引擎均失败。"
+                f"请将文件另存为 .xlsx 或 .csv 格式后重新上传。"
             )
-        
-        return df
-        
-    except Exception as e:
-        # 降级：尝试单行表头
-        logger.warning(f"多表头读取失败，降级为单行表头: {e}")
-        file_buffer.seek(0)
-        try:
-            return pd.read_excel(file_buffer, header=0, engine=engine)
-        except Exception as e2:
-            logger.error(f"单行表头读取也失败: {e2}")
-            raise
+        else:
+            raise ValueError(f"Excel文件解析失败: {'; '.join(errors)}")
+
+    return df
+
+
+async def _await_with_progress(
+    progress: DatasetProgressReporter,
+    task: asyncio.Future,
+    state: Dict[str, float],
+    start: int,
+    end: int
+) -> Any:
+    """
+    等待后台线程中的任务完成,期间每隔 PARSE_PROGRESS_INTERVAL 秒
+    按 state['fraction'](0~1)将解析进度上报到 start~end 之间
+
+    Returns:
+        任务结果
+    """
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=settings.PARSE_PROGRESS_INTERVAL)
+        if done:
+            return task.result()
+        await progress.update(start + int((end - start) * state['fraction']), "正在解析文件")
 
 
 async def parse_dataset_task(dataset_id: str, file_path: str, filename: str):
     """
-    后台任务: 解析上传的CSV/Excel文件
+    后台任务: 解析上传的CSV/Excel文件(由任务队列执行,成功后继续分片和向量化)
 
     Args:
         dataset_id: 数据集ID
@@ -212,14 +275,18 @@ async def parse_dataset_task(dataset_id: str, file_path: str, filename: str):
         filename: 原始文件名
 
     流程:
-        1. 从MinIO下载文件
-        2. 根据格式解析(CSV/Excel)
-        3. 推断Schema和统计信息
-        4. 转换为Parquet并上传MinIO
-        5. 保存列信息到数据库
-        6. 更新数据集状态
+        1. 从MinIO下载文件到本地
+        2. 分块解析(CSV/Excel),增量推断Schema和统计信息,逐块写入本地Parquet
+        3. 按布局合并为一个Parquet文件并上传MinIO
+        4. 保存列信息到数据库
+        5. 更新数据集状态
+
+    Raises:
+        Exception: 解析失败时标记状态后抛出
     """
+    progress = DatasetProgressReporter(dataset_id, 'parse')
     async with async_session() as session:
+        work_dir = None
         try:
             # 1. 更新状态为parsing
             result = await session.execute(
@@ -228,221 +295,86 @@ async def parse_dataset_task(dataset_id: str, file_path: str, filename: str):
             dataset = result.scalar_one()
             dataset.parse_status = 'parsing'
             dataset.parse_progress = 10
+            dataset.error_message = None
             await session.commit()
+            await progress.checkpoint(10, "开始解析", persist=False)
 
             logger.info(f"开始解析数据集: {dataset_id}")
 
-            # 2. 从MinIO下载文件
+            # 2. 从MinIO下载文件到本地工作目录(不整体加载到内存)
+            os.makedirs(settings.PARSE_TEMP_DIR, exist_ok=True)
+            work_dir = tempfile.mkdtemp(dir=settings.PARSE_TEMP_DIR)
             object_name = file_path.split('/')[-1]
-            file_data = minio_client.download_file(f"uploads/{object_name}")
-            logger.info(f"文件已下载: {len(file_data)} bytes")
-
-            dataset.parse_progress = 20
-            await session.commit()
-
-            # 3. 根据格式解析文件
+            source_path = os.path.join(work_dir, 'source')
+            await asyncio.to_thread(minio_client.download_to_file, f"uploads/{object_name}", source_path)
+            logger.info(f"文件已下载: {os.path.getsize(source_path)} bytes")
+
+            await progress.checkpoint(20, "文件已下载")
+
+            # 3. 分块解析文件,推断Schema、生成统计信息并逐块写入本地Parquet
+            read_progress = {'fraction': 0.0}
+            conversion_task = asyncio.ensure_future(asyncio.to_thread(
+                convert_chunks_to_parquet,
+                iter_file_chunks(
+                    source_path,
+                    filename,
+                    on_progress=lambda fraction: read_progress.update(fraction=fraction)
+                ),
+                work_dir
+            ))
             try:
-                if filename.endswith('.csv'):
-                    df = pd.read_csv(
-                        io.BytesIO(file_data),
-                        encoding='utf-8',
-                        low_memory=False
-                    )
-                elif filename.endswith(('.xlsx', '.xls', '.et')):
-                    # Excel/WPS文件,尝试多种引擎
-                    df = None
-                    errors = []
-
-                    # 尝试顺序: openpyxl -> xlrd (for .et files, try both)
-                    engines_to_try = []
-                    if filename.endswith('.xlsx'):
-                        engines_to_try = ['openpyxl']
-                    elif filename.endswith('.xls'):
-                        engines_to_try = ['xlrd']
-                    elif filename.endswith('.et'):
-                        # .et文件尝试所有可用引擎
-                        engines_to_try = ['openpyxl', 'xlrd']
-
-                    for engine in engines_to_try:
-                        try:
-                            # 使用多表头支持函数读取
-                            df = read_excel_with_multilevel_header(
-                                file_data,
-                                engine=engine,
-                                detect_headers=True
-                            )
-                            logger.info(f"使用{engine}引擎解析成功（支持多表头）")
-                            break
-                        except Exception as e:
-                            error_msg = str(e)
-                            errors.append(f"{engine}: {error_msg}")
-                            logger.warning(f"{engine}解析失败: {e}")
-
-                            # 如果是 DataValidation 错误，尝试多种降级策略
-                            if "DataValidation" in error_msg and engine == "openpyxl":
-                                # 策略1: 使用 openpyxl 底层 API 跳过验证
-                                try:
-                                    import openpyxl
-                                    from openpyxl.worksheet.datavalidation import DataValidation as DV
-
-                                    # 临时禁用 DataValidation 的参数检查
-                                    original_init = DV.__init__
-                                    def patched_init(self, *args, **kwargs):
-                                        # 移除不兼容的参数
-                                        kwargs.pop('id', None)
-                                        original_init(self, *args, **kwargs)
-
-                                    DV.__init__ = patched_init
-
-                                    try:
-                                        # 降级策略：使用openpyxl手动读取
-                                        # 注意：这个降级策略只支持单行表头，因为已经是降级路径了
-                                        wb = openpyxl.load_workbook(io.BytesIO(file_data), data_only=True)
-                                        ws = wb.active
-                                        data = list(ws.values)
-
-                                        if data and len(data) > 0:
-                                            # 尝试检测多表头（简单版本）
-                                            # 检查前两行，如果有大量空值，可能是多表头
-                                            if len(data) >= 2:
-                                                first_row = data[0]
-                                                second_row = data[1]
-                                                null_count = sum(1 for val in first_row if val is None or val == '')
-                                                
-                                                # 如果第一行空值多，尝试合并前两行
-                                                if null_count > len(first_row) * 0.3:
-                                                    # 合并表头：用第二行填充第一行的空值
-                                                    merged_cols = []
-                                                    for i, (first_val, second_val) in enumerate(zip(first_row, second_row)):
-                                                        if first_val and str(first_val).strip():
-                                                            if second_val and str(second_val).strip():
-                                                                merged_cols.append(f"{first_val}_{second_val}")
-                                                            else:
-                                                                merged_cols.append(str(first_val))
-                                                        elif second_val and str(second_val).strip():
-                                                            merged_cols.append(str(second_val))
-                                                        else:
-                                                            merged_cols.append(f'Column_{i}')
-                                                    cols = merged_cols
-                                                    rows = data[2:]  # 从第三行开始
-                                                    logger.info("检测到多表头，已合并（降级模式）")
-                                                else:
-                                                    # 单行表头
-                                                    cols = data[0]
-                                                    cols = [str(col) if col is not None else f'Column_{i}' for i, col in enumerate(cols)]
-                                                    rows = data[1:]
-                                            else:
-                                                # 数据不足，使用单行表头
-                                                cols = data[0]
-                                                cols = [str(col) if col is not None else f'Column_{i}' for i, col in enumerate(cols)]
-                                                rows = data[1:]
-
-                                            # 确保每行数据长度与列数一致
-                                            clean_rows = []
-                                            for row in rows:
-                                                # 转换为列表，确保长度与列数一致
-                                                row_list = list(row) if row else []
-                                                # 填充或截断到正确的列数
-                                                if len(row_list) < len(cols):
-                                                    row_list.extend([None] * (len(cols) - len(row_list)))
-                                                elif len(row_list) > len(cols):
-                                                    row_list = row_list[:len(cols)]
-                                                clean_rows.append(row_list)
-
-                                            # 创建 DataFrame
-                                            df = pd.DataFrame(clean_rows, columns=cols)
-
-                                        wb.close()
-                                        logger.info(f"使用{engine}引擎(补丁模式)解析成功")
-                                        break
-                                    finally:
-                                        # 恢复原始方法
-                                        DV.__init__ = original_init
-
-                                except Exception as e2:
-                                    errors.append(f"{engine}(补丁模式): {str(e2)}")
-                                    logger.warning(f"{engine}补丁模式失败: {e2}")
-
-                                # 策略2: 尝试使用 pyxlsb (如果是 xlsb 格式)
-                                try:
-                                    import pyxlsb
-                                    from pyxlsb import open_workbook
-                                    with open_workbook(io.BytesIO(file_data)) as wb:
-                                        with wb.get_sheet(1) as sheet:
-                                            data = [[item.v if item else None for item in row] for row in sheet.rows()]
-                                            if data:
-                                                cols = data[0]
-                                                df = pd.DataFrame(data[1:], columns=cols)
-                                    logger.info(f"使用 pyxlsb 引擎解析成功")
-                                    break
-                                except (ImportError, Exception) as e3:
-                                    errors.append(f"pyxlsb: {str(e3)}")
-                                    logger.warning(f"pyxlsb 解析失败: {e3}")
-
-                            continue
-
-                    if df is None:
-                        # 如果所有引擎都失败
-                        if filename.endswith('.et'):
-                            raise ValueError(
-                                f".et文件解析失败。WPS .et格式与Excel不完全兼容，所有解析引擎均失败。"
-                                f"请将文件另存为 .xlsx 或 .csv 格式后重新上传。"
-                            )
-                        else:
-                            raise ValueError(f"Excel文件解析失败: {'; '.join(errors)}")
-                else:
-                    raise ValueError(f"不支持的文件格式: {filename}")
-
-                logger.info(f"文件解析成功: {len(df)} 行, {len(df.columns)} 列")
+                conversion = await _await_with_progress(progress, conversion_task, read_progress, 20, 60)
             except Exception as e:
                 raise ValueError(f"文件解析失败: {str(e)}")
 
-            dataset.parse_progress = 40
-            await session.commit()
-
-            # 4. 清理列名(移除特殊字符)
-            df.columns = [clean_column_name(col) for col in df.columns]
-
-            # 5. 推断Schema并生成统计信息
-            schema_info = infer_schema(df)
-            logger.info(f"Schema推断完成: {len(schema_info)} 列")
-
-            dataset.parse_progress = 60
-            await session.commit()
+            schema_info = conversion['schema_info']
+            logger.info(f"文件解析成功: {conversion['row_count']} 行, {len(schema_info)} 列")
 
-            # 6. 清理数据类型,确保PyArrow能够正确转换
-            df = clean_dataframe_for_parquet(df)
-            logger.info("数据类型清理完成")
+            await progress.checkpoint(60, "正在写入Parquet")
 
-            # 7. 转换为Parquet并上传MinIO
+            # 4. 按日期/低基数列排序并控制行组大小,合并为一个Parquet文件后上传MinIO
             parquet_filename = f"{dataset_id}.parquet"
-            parquet_buffer = io.BytesIO()
-
-            # 使用pyarrow写入Parquet
+            parquet_local_path = os.path.join(work_dir, parquet_filename)
             try:
-                table = pa.Table.from_pandas(df)
-                pq.write_table(
-                    table,
-                    parquet_buffer,
-                    compression='snappy',
-                    use_dictionary=True
-                )
+                parquet_layout = await asyncio.to_thread(finalize_parquet, conversion, parquet_local_path)
+                logger.info(f"Parquet布局: {parquet_layout}")
             except Exception as e:
-                logger.error(f"PyArrow转换失败: {e}")
+                logger.error(f"Parquet写入失败: {e}")
                 raise ValueError(f"数据格式转换失败，请检查文件中是否有混合类型的列: {str(e)}")
 
-            parquet_data = parquet_buffer.getvalue()
-            parquet_path = minio_client.upload_file(
-                parquet_data,
+            parquet_path = await asyncio.to_thread(
+                minio_client.upload_local_file,
+                parquet_local_path,
                 f"parquet/{parquet_filename}",
                 content_type="application/x-parquet"
             )
             logger.info(f"Parquet文件已上传: {parquet_path}")
+            await asyncio.to_thread(shutil.rmtree, work_dir, ignore_errors=True)
+            work_dir = None
+
+            # 记录Parquet版本(ETag)供查询缓存使用,并清理重新解析前的本地缓存
+            parquet_stats = await asyncio.to_thread(minio_client.get_file_stats, f"parquet/{parquet_filename}")
+            # 旧的汇总表已失效(提交后再删除文件,失败回滚时元数据不会指向已删除的文件)
+            previous_metadata = dict(dataset.extra_metadata or {})
+            stale_rollups = previous_metadata.pop('rollups', None)
+            dataset.extra_metadata = {
+                **previous_metadata,
+                'parquet_etag': parquet_stats['etag'] if parquet_stats else None,
+                'parquet_layout': parquet_layout
+            }
+            await broadcast_dataset_invalidation(dataset_id)
 
             dataset.parse_progress = 80
             await session.commit()
-
-            # 8. 保存列信息到数据库
+            if stale_rollups:
+                from services.dataset_rollup import delete_dataset_rollups
+                await asyncio.to_thread(delete_dataset_rollups, stale_rollups)
+            await progress.checkpoint(80, "正在保存列信息", persist=False)
+
+            # 5. 保存列信息到数据库(重新解析时替换旧的列信息)
+            await session.execute(
+                delete(SysDatasetColumn).where(SysDatasetColumn.dataset_id == dataset_id)
+            )
             for idx, col_info in enumerate(schema_info):
                 col = SysDatasetColumn(
                     dataset_id=dataset_id,
@@ -454,78 +386,51 @@ async def parse_dataset_task(dataset_id: str, file_path: str, filename: str):
                 )
                 session.add(col)
 
-            # 9. 更新数据集状态
+            # 6. 更新数据集状态
             dataset.parsed_path = parquet_path
-            dataset.row_count = len(df)
-            dataset.column_count = len(df.columns)
+            dataset.row_count = conversion['row_count']
+            dataset.column_count = len(schema_info)
             dataset.parse_status = 'parsed'
             dataset.parse_progress = 100
             await session.commit()
+            await progress.checkpoint(100, "解析完成", persist=False)
+            # 行数和列信息已更新,通知各API进程清理缓存(解析期间可能缓存了旧的元数据)
+            await broadcast_dataset_invalidation(dataset_id)
 
             logger.info(f"数据集 {dataset_id} 解析成功")
 
-            # 10. 数据分片准备(构造列描述)
-            try:
-                dataset.chunk_status = 'chunking'
-                dataset.chunk_progress = 0
-                await session.commit()
-
-                # 分片逻辑：为每一列构造描述文本
-                from services.embedding_service import build_column_description
-                chunked_data = []
-                for idx, col_info in enumerate(schema_info):
-                    description = build_column_description(col_info)
-                    chunked_data.append({
-                        'index': idx,
-                        'col_info': col_info,
-                        'description': description
-                    })
-                    # 更新分片进度
-                    progress = int((idx + 1) / len(schema_info) * 100)
-                    dataset.chunk_progress = progress
-                    await session.commit()
-
-                dataset.chunk_status = 'completed'
-                dataset.chunk_progress = 100
-                await session.commit()
-                logger.info(f"数据集 {dataset_id} 分片准备完成，共 {len(chunked_data)} 个列")
-
-                # 11. 向量化生成
-                dataset.vectorize_status = 'vectorizing'
-                dataset.vectorize_progress = 0
-                await session.commit()
-
-                from services.embedding_service import vectorize_columns
-                await vectorize_columns(str(dataset_id), chunked_data)
-
-                dataset.vectorize_status = 'completed'
-                dataset.vectorize_progress = 100
-                await session.commit()
-                logger.info(f"数据集 {dataset_id} 向量化完成")
-
-            except Exception as e:
-                error_msg = str(e)
-                # 判断是哪个步骤失败
-                if dataset.chunk_status != 'completed':
-                    logger.error(f"数据分片失败: {e}")
-                    dataset.chunk_status = 'failed'
-                    dataset.chunk_error = error_msg
-                else:
-                    logger.error(f"向量化失败: {e}")
-                    dataset.vectorize_status = 'failed'
-                    dataset.vectorize_error = error_msg
-                await session.commit()
-                # 不影响主流程,文件仍然可用
+            # 6.1 构建汇总表(可选,失败不影响数据集使用)
+            if settings.ROLLUP_ENABLED:
+                try:
+                    from services.dataset_rollup import build_dataset_rollups
+                    rollups = await build_dataset_rollups(
+                        str(dataset_id),
+                        f"parquet/{parquet_filename}",
+                        dataset.extra_metadata.get('parquet_etag'),
+                        schema_info,
+                        dataset.row_count
+                    )
+                    if rollups:
+                        dataset.extra_metadata = {**dataset.extra_metadata, 'rollups': rollups}
+                        await session.commit()
+                except Exception as e:
+                    logger.warning(f"构建汇总表失败(不影响数据集使用): {e}")
 
         except Exception as e:
             logger.error(f"解析数据集失败: {e}", exc_info=True)
-            # 更新为失败状态
+            # 更新为失败状态(丢弃未提交的列信息),异常交给任务队列决定是否重试
             try:
+                await session.rollback()
                 dataset.parse_status = 'failed'
                 dataset.error_message = str(e)
                 await session.commit()
             except:
                 pass
+            await progress.fail(str(e))
+            raise
+        finally:
+            if work_dir:
+                await asyncio.to_thread(shutil.rmtree, work_dir, ignore_errors=True)
 
 
 def clean_column_name(col_name: str) -> str:
@@ -612,204 +517,322 @@ def clean_dataframe_for_parquet(df: pd.DataFrame) -> pd.DataFrame:
     return df_clean
 
 
-def infer_schema(df: pd.DataFrame) -> List[Dict[str, Any]]:
+def choose_parquet_layout(
+    schema: pa.Schema,
+    schema_info: List[Dict[str, Any]],
+    num_rows: int,
+    bytes_per_row: float
+) -> Dict[str, Any]:
     """
-    推断DataFrame的Schema并生成统计信息
+    选择Parquet写入布局
+
+    - 排序列: 优先日期列(时间范围查询最常见),其次是低基数分类列,
+      排序后每个行组的min/max范围收窄,DuckDB可按统计信息跳过不相关的行组;
+      CSV等文本格式的日期以字符串存储,按列统计推断的类型识别,写入时按解析后的值排序
+    - 行组大小: 按平均行宽估算,使每个行组约为目标字节数
 
     Args:
-        df: pandas DataFrame
+        schema: 待写入数据的Arrow schema
+        schema_info: 列信息(含统计)
+        num_rows: 总行数
+        bytes_per_row: 平均行宽(Arrow内存字节数)
 
     Returns:
-        列信息列表,每列包含: name, type, stats, samples
+        {'sort_by': [列名], 'row_group_size': 行组行数}
     """
-    schema_info = []
-
-    for col in df.columns:
-        col_data = df[col]
-
-        # 推断类型
-        dtype = infer_column_type(col_data)
-
-        # 生成统计信息
-        stats = generate_column_stats(col_data, dtype)
-
-        # 获取示例值
-        samples = get_sample_values(col_data, num_samples=5)
-
-        schema_info.append({
-            'name': col,
-            'type': dtype,
-            'stats': stats,
-            'samples': samples
-        })
-
-    return schema_info
-
-
-def infer_column_type(col_data: pd.Series) -> str:
+    column_stats = {col['name']: col.get('stats') or {} for col in schema_info}
+
+    # 日期列: 优先原生日期类型,其次选择空值最少的一列
+    column_types = {col['name']: col.get('type') for col in schema_info}
+    date_columns = []
+    for field in schema:
+        if pa.types.is_timestamp(field.type) or pa.types.is_date(field.type):
+            date_columns.append((0, column_stats.get(field.name, {}).get('null_count', 0), field.name))
+        elif pa.types.is_string(field.type) and column_types.get(field.name) == 'date':
+            date_columns.append((1, column_stats.get(field.name, {}).get('null_count', 0), field.name))
+    date_columns.sort()
+
+    # 低基数分类列: 选择不同值最少(且多于1个)的一列
+    category_columns = []
+    for field in schema:
+        if not (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+                or pa.types.is_boolean(field.type) or pa.types.is_integer(field.type)):
+            continue
+        unique_count = column_stats.get(field.name, {}).get('unique_count')
+        if (unique_count and 1 < unique_count <= settings.PARQUET_SORT_MAX_CARDINALITY
+                and unique_count * 10 <= num_rows):
+            category_columns.append((unique_count, field.name))
+    category_columns.sort()
+
+    sort_by = []
+    if date_columns:
+        sort_by.append(date_columns[0][2])
+    if category_columns:
+        sort_by.append(category_columns[0][1])
+
+    row_group_size = int(settings.PARQUET_ROW_GROUP_TARGET_BYTES / max(bytes_per_row, 1))
+    row_group_size = max(settings.PARQUET_ROW_GROUP_MIN_ROWS,
+                         min(row_group_size, settings.PARQUET_ROW_GROUP_MAX_ROWS))
+
+    return {'sort_by': sort_by, 'row_group_size': row_group_size}
+
+
+def iter_file_chunks(
+    source_path: str,
+    filename: str,
+    chunk_rows: Optional[int] = None,
+    on_progress: Optional[Callable[[float], None]] = None
+) -> Iterator[pd.DataFrame]:
     """
-    推断列的数据类型
+    分块读取上传的文件
 
-    Args:
-        col_data: pandas Series
+    CSV检测编码后按块流式读取(见 csv_reader);Excel以只读模式流式读取工作表,
+    开头几行检测表头后继续分块读出数据(见 excel_reader),工作簿只加载一次
 
-    Returns:
-        类型字符串: int/float/date/bool/string
+    Args:
+        source_path: 本地文件路径
+        filename: 原始文件名(用于判断格式)
+        chunk_rows: 每块行数,默认 PARSE_CHUNK_ROWS
+        on_progress: 每读出一块后以读取进度(0~1)回调
     """
-    # 确保 col_data 是一个标准的 pandas Series
-    if not isinstance(col_data, pd.Series):
-        return 'string'
-
-    # 先检查是否全为空
-    try:
-        if col_data.isna().all():
-            return 'string'
-    except (ValueError, TypeError, AttributeError):
-        # 如果检查失败，继续后续判断
-        pass
-
-    # 检查布尔类型
-    try:
-        if pd.api.types.is_bool_dtype(col_data):
-            return 'bool'
-    except:
-        pass
-
-    # 检查日期类型
-    try:
-        if pd.api.types.is_datetime64_any_dtype(col_data):
-            return 'date'
-    except:
-        pass
+    chunk_rows = chunk_rows or settings.PARSE_CHUNK_ROWS
 
-    # 检查数值类型
-    try:
-        if pd.api.types.is_integer_dtype(col_data):
-            return 'int'
-    except:
-        pass
+    if filename.endswith('.csv'):
+        yield from iter_csv_chunks(source_path, chunk_rows, on_progress=on_progress)
+    elif filename.endswith(('.xlsx', '.xls', '.et')):
+        try:
+            yield from iter_excel_chunks(
+                source_path, excel_engines(filename), chunk_rows, on_progress=on_progress
+            )
+            return
+        except ExcelReadError as e:
+            # 流式读取在产出数据前失败(如不兼容的 .et 文件),降级为整体加载并尝试兼容处理
+            logger.warning(f"Excel流式读取失败，降级为整体加载: {e}")
+
+        with open(source_path, 'rb') as f:
+            df = read_excel_dataset(f.read(), filename)
+        logger.info(f"Excel文件解析成功: {len(df)} 行, {len(df.columns)} 列")
+        for start in range(0, max(len(df), 1), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+            if on_progress:
+                on_progress(min((start + chunk_rows) / max(len(df), 1), 1.0))
+    else:
+        raise ValueError(f"不支持的文件格式: {filename}")
+
+
+def _unique_column_names(names: List[str]) -> List[str]:
+    """清理后重名的列追加序号"""
+    result = []
+    used = set()
+    for name in names:
+        candidate, index = name, 0
+        while candidate in used:
+            index += 1
+            candidate = f"{name}_{index}"
+        used.add(candidate)
+        result.append(candidate)
+    return result
+
+
+def _column_kinds(df_clean: pd.DataFrame) -> Dict[str, str]:
+    """按第一块清理后的类型确定各列的存储类型,后续各块统一转换为该类型"""
+    kinds = {}
+    for col in df_clean.columns:
+        dtype = df_clean[col].dtype
+        if pd.api.types.is_bool_dtype(dtype):
+            kinds[col] = 'bool'
+        elif pd.api.types.is_numeric_dtype(dtype):
+            kinds[col] = 'numeric'
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            kinds[col] = 'datetime'
+        else:
+            kinds[col] = 'string'
+    return kinds
+
+
+def _string_array(col: pd.Series) -> pa.Array:
+    return pa.array(col.astype(str).where(col.notna(), None), type=pa.string(), from_pandas=True)
+
+
+def _convert_column(col: pd.Series, kind: str) -> Optional[pa.Array]:
+    """转换为指定存储类型,有非空值无法转换时返回None"""
+    if kind == 'numeric':
+        values = pd.to_numeric(col, errors='coerce')
+        if values.isna().sum() > col.isna().sum():
+            # 存在非数值文本
+            return None
+        if pd.api.types.is_float_dtype(values):
+            # Inf按空值存储
+            values = values.replace([np.inf, -np.inf], np.nan)
+        return pa.array(values, from_pandas=True)
+    if kind == 'datetime':
+        import warnings
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            values = pd.to_datetime(col, errors='coerce')
+        if values.isna().sum() > col.isna().sum():
+            # 存在无法解析为日期的值
+            return None
+        return pa.array(values, from_pandas=True)
+    if kind == 'bool':
+        if not col.dropna().isin([True, False]).all():
+            return None
+        return pa.array(col.astype('boolean'), type=pa.bool_(), from_pandas=True)
+    return _string_array(col)
+
+
+def _conform_chunk(chunk: pd.DataFrame, kinds: Dict[str, str]) -> pa.Table:
+    """
+    将一块数据转换为各列的存储类型
 
-    try:
-        if pd.api.types.is_float_dtype(col_data):
-            return 'float'
-    except:
-        pass
+    有值无法转换时不置空,而是将该列改为字符串类型(kinds 中同步修改,之前写入的分块在合并时转换)
+    """
+    arrays = []
+    for name, kind in kinds.items():
+        col = chunk[name]
+        try:
+            array = _convert_column(col, kind)
+        except (TypeError, ValueError, pa.ArrowException):
+            array = None
+        if array is None:
+            logger.info(f"列 {name} 存在无法转换为 {kind} 的值，改为字符串类型")
+            kinds[name] = 'string'
+            array = _string_array(col)
 
-    # 尝试转换为数值
-    try:
-        non_null = col_data.dropna()
-        if len(non_null) == 0:
-            return 'string'
+        if pa.types.is_null(array.type):
+            array = array.cast(pa.string())
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, names=list(kinds))
 
-        # 尝试转换为数值
-        numeric_data = pd.to_numeric(non_null, errors='raise')
 
-        # 检查是否为整数
-        try:
-            # 检查所有值是否等于其整数版本
-            if all(val == int(val) for val in numeric_data if not pd.isna(val)):
-                return 'int'
-        except (ValueError, TypeError, OverflowError):
-            pass
-        return 'float'
-    except:
-        pass
-
-    # 尝试转换为日期
-    try:
-        non_null = col_data.dropna()
-        if len(non_null) > 0:
-            # 抑制警告
-            import warnings
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                pd.to_datetime(non_null, errors='raise')
-            return 'date'
-    except:
-        pass
-
-    # 默认为字符串
-    return 'string'
-
-
-def generate_column_stats(col_data: pd.Series, dtype: str) -> Dict[str, Any]:
+def convert_chunks_to_parquet(chunks: Iterator[pd.DataFrame], work_dir: str) -> Dict[str, Any]:
     """
-    生成列的统计信息
+    逐块推断Schema、累加统计信息,并将每块写为本地Parquet文件
+
+    同一时间只有一块数据在内存中;列统计在进程池中按列并行计算,与写入Parquet同时进行
 
     Args:
-        col_data: pandas Series
-        dtype: 列类型
+        chunks: 数据块迭代器(iter_file_chunks)
+        work_dir: 本地工作目录
 
     Returns:
-        统计信息字典
+        {'chunk_dir': 分块文件目录, 'schema': Arrow schema, 'schema_info': 列信息列表,
+         'row_count': 总行数, 'bytes_per_row': 平均行宽}
     """
-    stats = {
-        'null_count': int(col_data.isna().sum()),
-        'unique_count': int(col_data.nunique()),
-        'total_count': len(col_data)
+    chunk_dir = os.path.join(work_dir, 'chunks')
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    names = None
+    profilers: Dict[str, ColumnProfiler] = {}
+    kinds = None
+    schema = None
+    row_count = 0
+    total_bytes = 0
+
+    for idx, chunk in enumerate(chunks):
+        if names is None:
+            # 清理列名(移除特殊字符)
+            names = _unique_column_names([clean_column_name(col) for col in chunk.columns])
+            profilers = {name: ColumnProfiler(name) for name in names}
+        chunk = chunk.set_axis(names, axis=1)
+
+        profile_futures = submit_chunk_profile(chunk, seed=idx)
+
+        if kinds is None:
+            # 清理数据类型,确保PyArrow能够正确转换
+            kinds = _column_kinds(clean_dataframe_for_parquet(chunk))
+
+        table = _conform_chunk(chunk, kinds)
+        if schema is None:
+            schema = table.schema
+        else:
+            # 后续块中改为字符串的列
+            for name in table.column_names:
+                field_index = schema.get_field_index(name)
+                if schema.field(field_index).type != table.schema.field(name).type and kinds[name] == 'string':
+                    schema = schema.set(field_index, pa.field(name, pa.string()))
+        pq.write_table(table, os.path.join(chunk_dir, f"chunk_{idx:06d}.parquet"), compression='snappy')
+        merge_chunk_profile(profilers, profile_futures)
+
+        row_count += table.num_rows
+        total_bytes += table.nbytes
+        logger.debug(f"已处理第 {idx + 1} 块: 累计 {row_count} 行")
+
+    if names is None:
+        raise ValueError("文件中没有数据")
+
+    return {
+        'chunk_dir': chunk_dir,
+        'schema': schema,
+        'schema_info': [profiler.result() for profiler in profilers.values()],
+        'row_count': row_count,
+        'bytes_per_row': total_bytes / row_count if row_count else 1
     }
 
-    # 数值类型统计
-    if dtype in ['int', 'float']:
-        try:
-            stats['min'] = float(col_data.min()) if not pd.isna(col_data.min()) else None
-            stats['max'] = float(col_data.max()) if not pd.isna(col_data.max()) else None
-            stats['mean'] = float(col_data.mean()) if not pd.isna(col_data.mean()) else None
-            stats['std'] = float(col_data.std()) if not pd.isna(col_data.std()) else None
-            stats['median'] = float(col_data.median()) if not pd.isna(col_data.median()) else None
-        except:
-            pass
-
-    # 字符串类型统计
-    elif dtype == 'string':
-        try:
-            stats['max_length'] = int(col_data.astype(str).str.len().max())
-            stats['min_length'] = int(col_data.astype(str).str.len().min())
-            stats['avg_length'] = float(col_data.astype(str).str.len().mean())
-        except:
-            pass
-
-    # 日期类型统计
-    elif dtype == 'date':
-        try:
-            stats['min_date'] = str(col_data.min()) if not pd.isna(col_data.min()) else None
-            stats['max_date'] = str(col_data.max()) if not pd.isna(col_data.max()) else None
-        except:
-            pass
 
-    return stats
+# 字符串日期列排序时尝试的格式(ISO格式由 TRY_CAST 处理)
+_DATE_SORT_FORMATS = [
+    '%Y/%m/%d %H:%M:%S', '%Y/%m/%d', '%Y%m%d', '%m/%d/%Y', '%d.%m.%Y', '%Y年%m月%d日'
+]
+
+
+def _sort_expression(schema: pa.Schema, schema_info: List[Dict[str, Any]], name: str) -> str:
+    """排序表达式: 以字符串存储的日期列按解析后的时间排序,无法解析的值排在最后"""
+    quoted = '"' + name.replace('"', '""') + '"'
+    column_types = {col['name']: col.get('type') for col in schema_info}
+    if not (pa.types.is_string(schema.field(name).type) and column_types.get(name) == 'date'):
+        return quoted
+    formats = ', '.join(f"'{fmt}'" for fmt in _DATE_SORT_FORMATS)
+    return f"COALESCE(TRY_CAST({quoted} AS TIMESTAMP), TRY_STRPTIME({quoted}, [{formats}])) NULLS LAST, {quoted}"
 
 
-def get_sample_values(col_data: pd.Series, num_samples: int = 5) -> List[Any]:
+def finalize_parquet(conversion: Dict[str, Any], output_path: str) -> Dict[str, Any]:
     """
-    获取列的示例值
+    按选定布局将分块文件合并为一个Parquet文件(排序、控制行组大小)
+
+    使用独立的DuckDB连接执行,排序超出内存限制时溢写到临时目录
 
     Args:
-        col_data: pandas Series
-        num_samples: 示例数量
+        conversion: convert_chunks_to_parquet 的返回值
+        output_path: 输出文件路径
 
     Returns:
-        示例值列表
+        布局信息 {'sort_by', 'row_group_size'}
     """
-    # 移除空值
-    non_null_data = col_data.dropna()
-
-    if len(non_null_data) == 0:
-        return []
-
-    # 获取前N个唯一值
-    samples = non_null_data.drop_duplicates().head(num_samples).tolist()
-
-    # 转换为可序列化的格式
-    serializable_samples = []
-    for sample in samples:
-        if isinstance(sample, (np.integer, np.floating)):
-            serializable_samples.append(float(sample))
-        elif isinstance(sample, (datetime, pd.Timestamp)):
-            serializable_samples.append(str(sample))
-        elif pd.isna(sample):
-            continue
-        else:
-            serializable_samples.append(str(sample))
+    layout = choose_parquet_layout(
+        conversion['schema'],
+        conversion['schema_info'],
+        conversion['row_count'],
+        conversion['bytes_per_row']
+    )
+
+    source = os.path.join(conversion['chunk_dir'], '*.parquet').replace("'", "''")
+    # 各分块按最终Schema统一类型(后续块中改为字符串的列,之前的分块在此转换)
+    select_list = ', '.join(
+        (f'CAST({quoted} AS VARCHAR) AS {quoted}' if pa.types.is_string(field.type) else quoted)
+        for field in conversion['schema']
+        for quoted in ['"' + field.name.replace('"', '""') + '"']
+    )
+    escaped_output = output_path.replace("'", "''")
+    order_by = ''
+    if layout['sort_by'] and conversion['row_count'] > 1:
+        order_by = ' ORDER BY ' + ', '.join(
+            _sort_expression(conversion['schema'], conversion['schema_info'], name)
+            for name in layout['sort_by']
+        )
+
+    conn = duckdb.connect(config={
+        'threads': settings.DUCKDB_THREADS,
+        'memory_limit': settings.DUCKDB_MEMORY_LIMIT,
+        'temp_directory': settings.DUCKDB_TEMP_DIRECTORY
+    })
+    try:
+        conn.execute(
+            f"COPY (SELECT {select_list} FROM read_parquet('{source}', union_by_name = true){order_by}) "
+            f"TO '{escaped_output}' "
+            f"(FORMAT parquet, COMPRESSION snappy, ROW_GROUP_SIZE {layout['row_group_size']})"
+        )
+    finally:
+        conn.close()
 
-    return serializable_samples
+    return layout
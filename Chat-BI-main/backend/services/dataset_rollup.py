@@ -0,0 +1,495 @@
+"""
+数据集汇总表服务
+解析完成后,为常用的 维度×指标 组合预先聚合生成小型汇总Parquet文件;
+查询时将单维度的分组聚合SQL改写到汇总表上执行,避免扫描全量数据
+"""
+import asyncio
+import logging
+import os
+import re
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+from core.config import settings
+from core.minio_client import minio_client
+from models.sys_dataset import SysDataset
+from services.arrow_utils import fetch_arrow_table, normalize_arrow_table, arrow_to_dataframe
+from services.duckdb_engine import duckdb_engine, bind_dataset_sql
+from services.metadata_query import get_parquet_schema, describe_query_result
+from services.parquet_cache import parquet_cache
+from services.query_executor import query_executor, QueryContext
+from services.query_result_cache import query_result_cache
+
+logger = logging.getLogger(__name__)
+
+# 汇总表中每组的行数列
+ROLLUP_COUNT_COLUMN = '__count'
+
+# 汇总表中指标列的后缀: 每个指标保存 SUM/COUNT/MIN/MAX,可还原 SUM/COUNT/MIN/MAX/AVG
+ROLLUP_MEASURE_SUFFIXES = ('sum', 'count', 'min', 'max')
+
+_IDENTIFIER = r'"(?:[^"]|"")+"|[^\W\d]\w*'
+
+# 单引号字符串和注释(改写时跳过)
+_LITERAL_PATTERN = re.compile(r"('(?:[^']|'')*')|(--[^\n]*)|(/\*.*?\*/)", re.DOTALL)
+
+_AGGREGATE_CALL = re.compile(
+    rf'\b(?P<func>sum|count|min|max|avg)\s*\(\s*(?P<distinct>distinct\s+)?(?P<arg>\*|1|{_IDENTIFIER})\s*\)',
+    re.IGNORECASE
+)
+
+_ANY_AGGREGATE_CALL = re.compile(r'\b(sum|count|min|max|avg)\s*\(', re.IGNORECASE)
+
+_FUNCTION_CALL = re.compile(r'\b([^\W\d]\w*)\s*\(')
+
+_IDENTIFIER_TOKEN = re.compile(_IDENTIFIER)
+
+_UNSUPPORTED_KEYWORDS = re.compile(
+    r'\b(join|over|union|intersect|except|qualify|sample|tablesample|window|lateral)\b',
+    re.IGNORECASE
+)
+
+# 汇总表上可以安全使用的函数和后接括号的关键字
+_ALLOWED_FUNCTIONS = {
+    'sum', 'count', 'min', 'max', 'avg',
+    'in', 'and', 'or', 'not', 'as', 'by', 'when', 'then', 'else', 'on',
+    'cast', 'try_cast', 'coalesce', 'ifnull', 'nullif', 'round', 'abs', 'greatest', 'least',
+    'date_trunc', 'date_part', 'datepart', 'extract', 'strftime', 'year', 'month', 'day',
+    'quarter', 'week', 'yearweek', 'dayofweek', 'upper', 'lower', 'concat', 'substr', 'substring'
+}
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _unquote(identifier: str) -> str:
+    if identifier.startswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier
+
+
+def select_rollup_candidates(schema_info: List[Dict[str, Any]], row_count: int) -> List[Dict[str, Any]]:
+    """
+    从解析生成的列信息(schema_info)中选择汇总表的维度和指标
+
+    - 维度: 日期列优先,其次是低基数的分类列(不同值数量远小于行数)
+    - 指标: 数值列(排除每行取值都不同的ID类整数列)
+
+    Args:
+        schema_info: 列信息列表
+        row_count: 数据集行数
+
+    Returns:
+        [{'dimension': 维度列, 'measures': [指标列]}],数据量较小或没有合适列时返回空列表
+    """
+    if row_count < settings.ROLLUP_MIN_ROWS:
+        return []
+
+    dimensions = []
+    measures = []
+    for col in schema_info:
+        stats = col.get('stats') or {}
+        unique_count = stats.get('unique_count') or 0
+        is_low_cardinality = (
+            1 < unique_count <= settings.ROLLUP_MAX_DIMENSION_CARDINALITY
+            and unique_count * 10 <= row_count
+        )
+
+        if col['type'] in ('date', 'string', 'bool') and is_low_cardinality:
+            # 日期列优先,其次是分类列,均按基数从小到大
+            dimensions.append((0 if col['type'] == 'date' else 1, unique_count, col['name']))
+        elif col['type'] in ('int', 'float'):
+            # 低基数整数列(如年份、等级)也可作为维度,但排在其他维度之后
+            if col['type'] == 'int' and is_low_cardinality:
+                dimensions.append((2, unique_count, col['name']))
+            if col['type'] == 'int' and unique_count >= row_count:
+                continue
+            measures.append(col['name'])
+
+    if not dimensions or not measures:
+        return []
+
+    dimensions.sort()
+    candidates = []
+    for _, _, name in dimensions[:settings.ROLLUP_MAX_DIMENSIONS]:
+        dimension_measures = [m for m in measures if m != name][:settings.ROLLUP_MAX_MEASURES]
+        if dimension_measures:
+            candidates.append({'dimension': name, 'measures': dimension_measures})
+    return candidates
+
+
+def _build_rollup_file(
+    ctx: QueryContext,
+    dataset_id: str,
+    object_name: str,
+    parquet_version: Optional[str],
+    dimension: str,
+    measures: List[str],
+    output_path: str
+) -> int:
+    """
+    在查询执行器线程中执行: 按维度分组聚合并写入本地Parquet文件
+
+    Returns:
+        汇总表行数
+    """
+    parquet_path = parquet_cache.get_local_path(dataset_id, object_name, version=parquet_version)
+    ctx.check_cancelled()
+    view_name = duckdb_engine.register_dataset(dataset_id, parquet_path)
+
+    select_items = [_quote(dimension), f"COUNT(*) AS {_quote(ROLLUP_COUNT_COLUMN)}"]
+    for measure in measures:
+        for suffix in ROLLUP_MEASURE_SUFFIXES:
+            select_items.append(
+                f"{suffix.upper()}({_quote(measure)}) AS {_quote(f'{measure}__{suffix}')}"
+            )
+
+    escaped_path = output_path.replace("'", "''")
+    copy_sql = (
+        f"COPY (SELECT {', '.join(select_items)} FROM {view_name} "
+        f"GROUP BY {_quote(dimension)} ORDER BY {_quote(dimension)}) "
+        f"TO '{escaped_path}' (FORMAT parquet)"
+    )
+
+    with duckdb_engine.cursor() as cur:
+        ctx.bind_cursor(cur)
+        try:
+            cur.execute(copy_sql)
+            return cur.execute(
+                f"SELECT COUNT(*) FROM read_parquet('{escaped_path}')"
+            ).fetchone()[0]
+        finally:
+            ctx.release_cursor()
+
+
+async def build_dataset_rollups(
+    dataset_id: str,
+    object_name: str,
+    parquet_version: Optional[str],
+    schema_info: List[Dict[str, Any]],
+    row_count: int
+) -> List[Dict[str, Any]]:
+    """
+    构建数据集的汇总表并上传MinIO
+
+    Args:
+        dataset_id: 数据集ID
+        object_name: 数据集Parquet文件在MinIO中的对象名称
+        parquet_version: Parquet文件版本(ETag)
+        schema_info: 解析生成的列信息
+        row_count: 数据集行数
+
+    Returns:
+        汇总表信息列表,保存到 SysDataset.extra_metadata['rollups']
+    """
+    candidates = select_rollup_candidates(schema_info, row_count)
+    if not candidates:
+        logger.info(f"数据集 {dataset_id} 无需构建汇总表")
+        return []
+
+    dataset_id = str(dataset_id)
+    rollups = []
+    # 构建目录需在DuckDB允许访问的目录下(见 DUCKDB_RESTRICT_FILE_ACCESS)
+    os.makedirs(settings.PARSE_TEMP_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=settings.PARSE_TEMP_DIR) as tmp_dir:
+        for idx, candidate in enumerate(candidates):
+            local_path = os.path.join(tmp_dir, f"rollup_{idx}.parquet")
+            rollup_rows = await query_executor.run(
+                _build_rollup_file,
+                dataset_id,
+                object_name,
+                parquet_version,
+                candidate['dimension'],
+                candidate['measures'],
+                local_path
+            )
+
+            rollup_object = f"parquet/rollup/{dataset_id}_{idx}.parquet"
+            await asyncio.to_thread(
+                minio_client.upload_local_file,
+                local_path,
+                rollup_object,
+                content_type="application/x-parquet"
+            )
+            rollup_stats = await asyncio.to_thread(minio_client.get_file_stats, rollup_object)
+
+            rollups.append({
+                'dimension': candidate['dimension'],
+                'measures': candidate['measures'],
+                'object_name': rollup_object,
+                'etag': rollup_stats['etag'] if rollup_stats else None,
+                'row_count': rollup_rows
+            })
+            logger.info(
+                f"汇总表已生成: {rollup_object}, 维度={candidate['dimension']}, "
+                f"指标数={len(candidate['measures'])}, {row_count} 行 -> {rollup_rows} 行"
+            )
+
+    return rollups
+
+
+def delete_dataset_rollups(rollups: Optional[List[Dict[str, Any]]]):
+    """删除MinIO中的汇总表文件"""
+    for rollup in rollups or []:
+        try:
+            minio_client.delete_file(rollup['object_name'])
+        except Exception as e:
+            logger.warning(f"删除汇总表失败: {rollup.get('object_name')}, {e}")
+
+
+def _split_literals(sql_query: str) -> List[tuple]:
+    """拆分为 (是否为代码, 片段) 列表,字符串字面量和注释不参与改写"""
+    segments = []
+    last_end = 0
+    for match in _LITERAL_PATTERN.finditer(sql_query):
+        segments.append((True, sql_query[last_end:match.start()]))
+        segments.append((False, match.group(0)))
+        last_end = match.end()
+    segments.append((True, sql_query[last_end:]))
+    return segments
+
+
+def _resolve_name(identifier: str, names: List[str]) -> Optional[str]:
+    """匹配列名: 带引号时精确匹配,否则忽略大小写"""
+    if identifier.startswith('"'):
+        name = _unquote(identifier)
+        return name if name in names else None
+    matches = [name for name in names if name.lower() == identifier.lower()]
+    return matches[0] if len(matches) == 1 else None
+
+
+def choose_rollup(sql_query: str, rollups: List[Dict[str, Any]]) -> Optional[int]:
+    """
+    选择可以回答查询的汇总表
+
+    聚合函数之外只能引用一个汇总维度;不引用任何维度(整体聚合)时选择行数最少的汇总表
+
+    Returns:
+        汇总表下标,没有合适的汇总表返回None
+    """
+    code = ' '.join(segment for is_code, segment in _split_literals(sql_query) if is_code)
+    # 聚合函数内的列按指标处理,只看聚合之外引用的列
+    identifiers = _IDENTIFIER_TOKEN.findall(_AGGREGATE_CALL.sub(' ', code))
+    dimensions = [rollup['dimension'] for rollup in rollups]
+
+    referenced = set()
+    for identifier in identifiers:
+        name = _resolve_name(identifier, dimensions)
+        if name is not None:
+            referenced.add(name)
+
+    if len(referenced) > 1:
+        return None
+    if referenced:
+        return dimensions.index(referenced.pop())
+    return min(range(len(rollups)), key=lambda i: rollups[i].get('row_count') or 0)
+
+
+def rewrite_for_rollup(sql_query: str, rollup: Dict[str, Any]) -> Optional[str]:
+    """
+    将分组聚合SQL改写为在汇总表上执行
+
+    - SUM(指标) -> SUM(指标__sum)
+    - COUNT(指标) -> SUM(指标__count)
+    - MIN/MAX(指标) -> MIN(指标__min) / MAX(指标__max)
+    - AVG(指标) -> SUM(指标__sum) / SUM(指标__count)
+    - COUNT(*) -> SUM(__count)
+    - COUNT(维度) -> 维度非空时的 SUM(__count)
+    - MIN/MAX(维度)、COUNT(DISTINCT 维度) 保持不变
+
+    Args:
+        sql_query: SQL查询语句(表名为 dataset)
+        rollup: 汇总表信息
+
+    Returns:
+        改写后的SQL,无法安全改写时返回None
+    """
+    dimension = rollup['dimension']
+    measures = rollup['measures']
+    segments = _split_literals(sql_query)
+    code = ' '.join(segment for is_code, segment in segments if is_code)
+    code_lower = code.lower()
+
+    # 只支持单表、单层SELECT
+    if len(re.findall(r'\bselect\b', code_lower)) != 1:
+        return None
+    if len(re.findall(r'\bfrom\s+dataset\b', code_lower)) != 1:
+        return None
+    if re.search(r'\bfrom\s+dataset\s*,', code_lower) or _UNSUPPORTED_KEYWORDS.search(code):
+        return None
+
+    # 只允许可在汇总表上还原的聚合和标量函数
+    for func in _FUNCTION_CALL.findall(code):
+        if func.lower() not in _ALLOWED_FUNCTIONS:
+            return None
+
+    # 汇总表每个维度值只有一行: 必须是分组/去重/聚合查询,不能返回明细行
+    aggregate_calls = _ANY_AGGREGATE_CALL.findall(code)
+    if not (aggregate_calls or re.search(r'\bgroup\s+by\b|\bselect\s+distinct\b', code_lower)):
+        return None
+
+    rewritten_count = 0
+    unsupported = False
+
+    def replace(match: re.Match) -> str:
+        nonlocal rewritten_count, unsupported
+        func = match.group('func').lower()
+        arg = match.group('arg')
+        rewritten_count += 1
+
+        if arg in ('*', '1'):
+            if func == 'count' and not match.group('distinct'):
+                return f"SUM({_quote(ROLLUP_COUNT_COLUMN)})"
+            unsupported = True
+            return match.group(0)
+
+        if _resolve_name(arg, [dimension]) is not None:
+            if match.group('distinct'):
+                return match.group(0) if func == 'count' else _mark_unsupported()
+            if func in ('min', 'max'):
+                return match.group(0)
+            if func == 'count':
+                return (
+                    f"COALESCE(SUM(CASE WHEN {_quote(dimension)} IS NOT NULL "
+                    f"THEN {_quote(ROLLUP_COUNT_COLUMN)} END), 0)"
+                )
+            return _mark_unsupported()
+
+        measure = _resolve_name(arg, measures)
+        if measure is None or match.group('distinct'):
+            return _mark_unsupported()
+
+        if func == 'avg':
+            return (
+                f"(SUM({_quote(f'{measure}__sum')}) / SUM({_quote(f'{measure}__count')}))"
+            )
+        if func == 'count':
+            return f"COALESCE(SUM({_quote(f'{measure}__count')}), 0)"
+        column = _quote(f"{measure}__{func}")
+        return f"{func.upper()}({column})"
+
+    def _mark_unsupported() -> str:
+        nonlocal unsupported
+        unsupported = True
+        return ''
+
+    rewritten_segments = []
+    for is_code, segment in segments:
+        if is_code:
+            segment = _AGGREGATE_CALL.sub(replace, segment)
+        rewritten_segments.append(segment)
+
+    # 存在无法改写的聚合(如 SUM(a * b)、带CASE的COUNT)时放弃
+    if unsupported or rewritten_count != len(aggregate_calls):
+        return None
+
+    return ''.join(rewritten_segments)
+
+
+def _execute_rollup_query(
+    ctx: QueryContext,
+    dataset_id: str,
+    object_name: str,
+    parquet_version: Optional[str],
+    rollup_key: str,
+    rollup: Dict[str, Any],
+    sql_query: str,
+    rewritten_sql: str,
+    limit: Optional[int],
+    cache_key: Optional[str]
+) -> pa.Table:
+    """
+    在查询执行器线程中执行: 在汇总表上执行改写后的SQL,结果列名和类型与原查询保持一致
+    """
+    base_schema = get_parquet_schema(ctx, dataset_id, object_name, parquet_version)
+    rollup_path = parquet_cache.get_local_path(dataset_id, rollup['object_name'], version=rollup['etag'])
+    ctx.check_cancelled()
+    view_name = duckdb_engine.register_dataset(rollup_key, rollup_path)
+
+    if limit and 'LIMIT' not in sql_query.upper():
+        sql_query += f" LIMIT {limit}"
+        rewritten_sql += f" LIMIT {limit}"
+
+    with duckdb_engine.cursor() as cur:
+        ctx.bind_cursor(cur)
+        try:
+            expected_schema = describe_query_result(cur, base_schema, sql_query)
+            table = fetch_arrow_table(cur.execute(bind_dataset_sql(rewritten_sql, view_name)))
+        finally:
+            ctx.release_cursor()
+
+    if table.num_columns != len(expected_schema):
+        raise ValueError("汇总表查询结果列数与原查询不一致")
+
+    expected_schema = normalize_arrow_table(expected_schema.empty_table()).schema
+    table = normalize_arrow_table(table.rename_columns(expected_schema.names)).cast(expected_schema)
+
+    if cache_key:
+        try:
+            query_result_cache.set(cache_key, dataset_id, table)
+        except Exception as e:
+            logger.warning(f"写入查询结果缓存失败: {e}")
+    return table
+
+
+async def query_with_rollup(
+    dataset_info: SysDataset,
+    object_name: str,
+    parquet_version: Optional[str],
+    sql_query: str,
+    limit: Optional[int],
+    cache_key: Optional[str] = None
+) -> Optional[pd.DataFrame]:
+    """
+    尝试在汇总表上回答分组聚合查询
+
+    Args:
+        dataset_info: 数据集记录
+        object_name: 数据集Parquet文件在MinIO中的对象名称
+        parquet_version: Parquet文件版本(ETag)
+        sql_query: SQL查询语句
+        limit: 最大返回行数
+        cache_key: 查询结果缓存键
+
+    Returns:
+        查询结果DataFrame,无法使用汇总表时返回None(由调用方查询原始数据)
+    """
+    rollups = (dataset_info.extra_metadata or {}).get('rollups') or []
+    if not rollups:
+        return None
+
+    rollup_index = choose_rollup(sql_query, rollups)
+    if rollup_index is None:
+        return None
+
+    rollup = rollups[rollup_index]
+    rewritten_sql = rewrite_for_rollup(sql_query, rollup)
+    if rewritten_sql is None:
+        return None
+
+    dataset_id = str(dataset_info.id)
+    try:
+        table = await query_executor.run(
+            _execute_rollup_query,
+            dataset_id,
+            object_name,
+            parquet_version,
+            f"{dataset_id}__rollup_{rollup_index}",
+            rollup,
+            sql_query,
+            rewritten_sql,
+            limit,
+            cache_key
+        )
+    except (duckdb.Error, ValueError, pa.ArrowException) as e:
+        # 引用了汇总表中不存在的列等情况,回退到原始数据
+        logger.info(f"汇总表无法回答查询,回退到原始数据: {e}")
+        return None
+
+    logger.info(f"查询已改写到汇总表(维度={rollup['dimension']}),返回 {table.num_rows} 行数据")
+    return arrow_to_dataframe(table)
@@ -0,0 +1,161 @@
+"""
+数据集分片、向量化任务
+由任务队列(services.dataset_jobs)在worker进程中执行,失败时标记状态后抛出异常,由队列决定是否重试
+"""
+import logging
+from typing import Any, Dict, List
+
+from sqlalchemy import select
+
+from db.session import async_session
+from models.sys_dataset import SysDataset, SysDatasetColumn
+from services.progress_reporter import DatasetProgressReporter
+
+logger = logging.getLogger(__name__)
+
+
+async def _load_schema_info(session, dataset_id: str) -> List[Dict[str, Any]]:
+    """从列信息表构造schema_info"""
+    col_result = await session.execute(
+        select(SysDatasetColumn)
+        .where(SysDatasetColumn.dataset_id == dataset_id)
+        .order_by(SysDatasetColumn.col_index)
+    )
+    columns = col_result.scalars().all()
+    if not columns:
+        raise ValueError(f"数据集 {dataset_id} 没有列信息")
+
+    return [
+        {
+            'name': col.col_name,
+            'type': col.col_type,
+            'stats': col.stats or {},
+            'samples': col.sample_values or []
+        }
+        for col in columns
+    ]
+
+
+def _build_chunked_data(schema_info: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    from services.embedding_service import build_column_description
+    return [
+        {
+            'index': idx,
+            'col_info': col_info,
+            'description': build_column_description(col_info)
+        }
+        for idx, col_info in enumerate(schema_info)
+    ]
+
+
+async def chunk_dataset_task(dataset_id: str):
+    """
+    数据分片: 为每一列构造描述文本,完成后由队列继续执行向量化
+    """
+    progress = DatasetProgressReporter(dataset_id, 'chunk')
+    async with async_session() as session:
+        result = await session.execute(select(SysDataset).where(SysDataset.id == dataset_id))
+        dataset = result.scalar_one()
+        try:
+            schema_info = await _load_schema_info(session, dataset_id)
+
+            dataset.chunk_status = 'chunking'
+            dataset.chunk_progress = 0
+            dataset.chunk_error = None
+            await session.commit()
+            await progress.checkpoint(0, "开始分片", persist=False)
+
+            from services.embedding_service import build_column_description
+            for idx, col_info in enumerate(schema_info):
+                build_column_description(col_info)
+                await progress.update(
+                    int((idx + 1) / len(schema_info) * 100),
+                    f"已处理 {idx + 1}/{len(schema_info)} 列"
+                )
+
+            dataset.chunk_status = 'completed'
+            dataset.chunk_progress = 100
+            await session.commit()
+            await progress.checkpoint(100, "分片完成", persist=False)
+            logger.info(f"数据集 {dataset_id} 分片准备完成，共 {len(schema_info)} 个列")
+
+        except Exception as e:
+            logger.error(f"数据分片失败: {e}")
+            await session.rollback()
+            dataset.chunk_status = 'failed'
+            dataset.chunk_error = str(e)
+            await session.commit()
+            await progress.fail(str(e))
+            raise
+
+
+async def vectorize_dataset_task(dataset_id: str):
+    """
+    向量化: 按列描述生成向量并存入Qdrant(需分片已完成)
+    """
+    from services.embedding_service import vectorize_columns
+
+    progress = DatasetProgressReporter(dataset_id, 'vectorize')
+    async with async_session() as session:
+        result = await session.execute(select(SysDataset).where(SysDataset.id == dataset_id))
+        dataset = result.scalar_one()
+        try:
+            if dataset.chunk_status != 'completed':
+                raise ValueError(f"分片状态为 {dataset.chunk_status}，必须先完成分片")
+            chunked_data = _build_chunked_data(await _load_schema_info(session, dataset_id))
+
+            dataset.vectorize_status = 'vectorizing'
+            dataset.vectorize_progress = 0
+            dataset.vectorize_error = None
+            await session.commit()
+            await progress.checkpoint(0, "开始向量化", persist=False)
+
+            await vectorize_columns(str(dataset_id), chunked_data, progress)
+
+            dataset.vectorize_status = 'completed'
+            dataset.vectorize_progress = 100
+            await session.commit()
+            await progress.checkpoint(100, "向量化完成", persist=False)
+            logger.info(f"数据集 {dataset_id} 向量化完成")
+
+        except Exception as e:
+            logger.error(f"向量化失败: {e}")
+            await session.rollback()
+            dataset.vectorize_status = 'failed'
+            dataset.vectorize_error = str(e)
+            await session.commit()
+            await progress.fail(str(e))
+            raise
+
+
+async def embedding_dataset_task(dataset_id: str):
+    """
+    重新生成列embedding(旧流程,保留以向后兼容)
+    """
+    from services.embedding_service import generate_column_embeddings
+
+    async with async_session() as session:
+        result = await session.execute(select(SysDataset).where(SysDataset.id == dataset_id))
+        dataset = result.scalar_one()
+        try:
+            schema_info = await _load_schema_info(session, dataset_id)
+
+            dataset.embedding_status = 'embedding'
+            dataset.embedding_progress = 0
+            dataset.embedding_error = None
+            await session.commit()
+
+            await generate_column_embeddings(str(dataset_id), schema_info)
+
+            dataset.embedding_status = 'completed'
+            dataset.embedding_progress = 100
+            await session.commit()
+            logger.info(f"数据集 {dataset_id} embedding重新生成成功")
+
+        except Exception as e:
+            logger.error(f"数据集 {dataset_id} embedding重新生成失败: {e}")
+            await session.rollback()
+            dataset.embedding_status = 'failed'
+            dataset.embedding_error = str(e)
+            await session.commit()
+            raise
@@ -0,0 +1,286 @@
+"""
+DuckDB引擎服务
+进程内共享一个DuckDB数据库实例,维护有界游标池,每个数据集只注册一次视图
+"""
+import duckdb
+import logging
+import math
+import os
+import queue
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def bind_dataset_sql(sql_query: str, table_name: str) -> str:
+    """
+    将SQL中的占位表名 dataset 替换为实际视图名
+
+    使用正则表达式替换，支持多行和空白字符
+    匹配 "FROM dataset" 或 "FROM\n    dataset" 等各种情况
+    """
+    return re.sub(
+        r'FROM\s+dataset\b',
+        f'FROM {table_name}',
+        sql_query,
+        flags=re.IGNORECASE
+    )
+
+
+def sql_literal(value: Any) -> str:
+    """
+    将参数值转换为类型明确的SQL字面量(用于 EXECUTE 语句的实参)
+
+    只接受基础类型,字符串按SQL规则转义,其他类型直接拒绝
+
+    Raises:
+        ValueError: 非有限浮点数
+        TypeError: 不支持的参数类型
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, int):
+        return str(int(value))
+    if isinstance(value, (float, Decimal)):
+        if not math.isfinite(float(value)):
+            raise ValueError(f"不支持的数值参数: {value}")
+        return f"{float(value)!r}::DOUBLE" if isinstance(value, float) else str(value)
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, datetime):
+        return f"TIMESTAMP '{value.isoformat(sep=' ')}'"
+    if isinstance(value, date):
+        return f"DATE '{value.isoformat()}'"
+    # numpy标量
+    if hasattr(value, 'item'):
+        return sql_literal(value.item())
+    raise TypeError(f"不支持的参数类型: {type(value).__name__}")
+
+
+class DuckDBEngine:
+    """
+    DuckDB连接管理器
+
+    - 一个内存数据库实例,按配置限制线程数和内存
+    - 游标(cursor)池: 每个游标是同一数据库上的独立连接,可在不同线程并发使用
+    - 数据集视图注册在共享catalog中,所有游标可见
+    """
+
+    def __init__(
+        self,
+        pool_size: int,
+        threads: int,
+        memory_limit: str,
+        temp_directory: Optional[str] = None,
+        max_temp_directory_size: Optional[str] = None,
+        acquire_timeout: float = 30.0,
+        prepared_cache_size: int = 128,
+        allowed_directories: Optional[List[str]] = None
+    ):
+        self.pool_size = pool_size
+        self.threads = threads
+        self.memory_limit = memory_limit
+        self.temp_directory = temp_directory
+        self.max_temp_directory_size = max_temp_directory_size
+        self.acquire_timeout = acquire_timeout
+        self.prepared_cache_size = prepared_cache_size
+        # 不为None时只允许访问这些目录下的文件
+        self.allowed_directories = allowed_directories
+
+        self._conn: Optional[duckdb.DuckDBPyConnection] = None
+        self._pool: "queue.Queue[duckdb.DuckDBPyConnection]" = queue.Queue(maxsize=pool_size)
+        self._views: Dict[str, str] = {}
+        # 每个游标各自的预编译语句缓存: id(游标) -> {SQL模板: 语句名}
+        self._prepared: Dict[int, "OrderedDict[str, str]"] = {}
+        self._prepared_counter = 0
+        self._init_lock = threading.Lock()
+        self._catalog_lock = threading.Lock()
+
+    def _get_connection(self) -> duckdb.DuckDBPyConnection:
+        """延迟创建数据库实例和游标池"""
+        if self._conn is not None:
+            return self._conn
+
+        with self._init_lock:
+            if self._conn is None:
+                config = {
+                    'threads': self.threads,
+                    'memory_limit': self.memory_limit
+                }
+                if self.temp_directory:
+                    os.makedirs(self.temp_directory, exist_ok=True)
+                    config['temp_directory'] = self.temp_directory
+                if self.max_temp_directory_size:
+                    config['max_temp_directory_size'] = self.max_temp_directory_size
+
+                conn = duckdb.connect(database=':memory:', config=config)
+                if self.allowed_directories is not None:
+                    self._restrict_file_access(conn)
+                for _ in range(self.pool_size):
+                    cur = conn.cursor()
+                    self._prepared[id(cur)] = OrderedDict()
+                    self._pool.put(cur)
+                self._conn = conn
+                logger.info(
+                    f"DuckDB引擎初始化成功: pool_size={self.pool_size}, "
+                    f"threads={self.threads}, memory_limit={self.memory_limit}"
+                )
+        return self._conn
+
+    def _restrict_file_access(self, conn: duckdb.DuckDBPyConnection):
+        """
+        禁止访问白名单目录以外的文件
+
+        用户SQL中的 FROM '路径'、read_csv 等即使绕过SQL校验也无法读取其他文件;
+        enable_external_access 关闭后不能再打开,必须在数据库启动后设置
+        """
+        directories = []
+        for directory in self.allowed_directories:
+            os.makedirs(directory, exist_ok=True)
+            directories.append(os.path.join(os.path.abspath(directory), ''))
+        directory_list = ', '.join(
+            "'" + directory.replace("'", "''") + "'" for directory in directories
+        )
+        conn.execute(f"SET allowed_directories = [{directory_list}]")
+        conn.execute("SET enable_external_access = false")
+        logger.info(f"DuckDB文件访问已限制在: {directories}")
+
+    @contextmanager
+    def cursor(self):
+        """
+        从池中借用一个游标,使用完毕自动归还
+
+        Raises:
+            TimeoutError: 等待游标超时
+        """
+        self._get_connection()
+        try:
+            cur = self._pool.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"等待DuckDB连接超时({self.acquire_timeout}s)")
+        try:
+            yield cur
+        finally:
+            self._pool.put(cur)
+
+    def execute_prepared(self, cur, sql_template: str, params: List[Any]):
+        """
+        使用预编译语句执行参数化查询
+
+        同一游标上相同的SQL模板只编译一次,之后仅传入新的参数值执行(复用查询计划)
+
+        Args:
+            cur: 从cursor()借用的游标
+            sql_template: 使用 $1, $2... 占位符的SQL
+            params: 参数值列表
+
+        Returns:
+            执行结果(游标)
+        """
+        statements = self._prepared.setdefault(id(cur), OrderedDict())
+        args = ', '.join(sql_literal(value) for value in params)
+
+        for attempt in range(2):
+            name = statements.get(sql_template)
+            if name is None:
+                with self._init_lock:
+                    self._prepared_counter += 1
+                    name = f"prepared_{self._prepared_counter}"
+                cur.execute(f"PREPARE {name} AS {sql_template}")
+                statements[sql_template] = name
+                while len(statements) > self.prepared_cache_size:
+                    _, evicted = statements.popitem(last=False)
+                    self._deallocate(cur, evicted)
+            else:
+                statements.move_to_end(sql_template)
+
+            try:
+                return cur.execute(f"EXECUTE {name}({args})" if params else f"EXECUTE {name}")
+            except duckdb.CatalogException:
+                # 视图已被删除或重建,重新编译一次
+                statements.pop(sql_template, None)
+                self._deallocate(cur, name)
+                if attempt:
+                    raise
+
+    @staticmethod
+    def _deallocate(cur, name: str):
+        try:
+            cur.execute(f"DEALLOCATE {name}")
+        except duckdb.Error:
+            pass
+
+    @staticmethod
+    def view_name(dataset_id: str) -> str:
+        """数据集对应的视图名"""
+        return f"dataset_{str(dataset_id).replace('-', '_')}"
+
+    def register_dataset(self, dataset_id: str, parquet_path: str) -> str:
+        """
+        注册数据集视图,同一路径只注册一次
+
+        Args:
+            dataset_id: 数据集ID
+            parquet_path: 本地Parquet文件路径
+
+        Returns:
+            视图名
+        """
+        dataset_id = str(dataset_id)
+        view_name = self.view_name(dataset_id)
+        if self._views.get(dataset_id) == parquet_path:
+            return view_name
+
+        conn = self._get_connection()
+        with self._catalog_lock:
+            if self._views.get(dataset_id) != parquet_path:
+                escaped_path = parquet_path.replace("'", "''")
+                conn.execute(
+                    f"CREATE OR REPLACE VIEW {view_name} AS "
+                    f"SELECT * FROM read_parquet('{escaped_path}')"
+                )
+                self._views[dataset_id] = parquet_path
+                logger.info(f"DuckDB视图已注册: {view_name} -> {parquet_path}")
+        return view_name
+
+    def unregister_dataset(self, dataset_id: str):
+        """删除数据集视图(包括该数据集的汇总表视图)"""
+        dataset_id = str(dataset_id)
+        if self._conn is None:
+            return
+
+        with self._catalog_lock:
+            keys = [
+                key for key in self._views
+                if key == dataset_id or key.startswith(f"{dataset_id}__")
+            ]
+            for key in keys:
+                self._conn.execute(f"DROP VIEW IF EXISTS {self.view_name(key)}")
+                self._views.pop(key, None)
+                logger.info(f"DuckDB视图已删除: {self.view_name(key)}")
+
+
+# 全局单例
+duckdb_engine = DuckDBEngine(
+    pool_size=settings.DUCKDB_POOL_SIZE,
+    threads=settings.DUCKDB_THREADS,
+    memory_limit=settings.DUCKDB_MEMORY_LIMIT,
+    temp_directory=settings.DUCKDB_TEMP_DIRECTORY,
+    max_temp_directory_size=settings.DUCKDB_MAX_TEMP_DIRECTORY_SIZE,
+    allowed_directories=[
+        settings.PARQUET_CACHE_DIR,
+        settings.QUERY_RESULT_DIR,
+        settings.DUCKDB_TEMP_DIRECTORY,
+        settings.PARSE_TEMP_DIR
+    ] if settings.DUCKDB_RESTRICT_FILE_ACCESS else None
+)
@@ -2,20 +2,33 @@
 DuckDB查询服务
 用于查询用户上传的Parquet文件
 """
-import duckdb
+import asyncio
+import re
 import pandas as pd
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import logging
-import tempfile
-import os
-import re
-from core.minio_client import minio_client
+from core.config import settings
+from services.parquet_cache import parquet_cache
+from services.duckdb_engine import duckdb_engine, bind_dataset_sql
+from services.query_executor import query_executor, QueryContext
+from services.query_result_cache import query_result_cache
+from services.query_builder import build_dataset_query
+from services.query_guard import admit_query, QueryRejectedError
+from services.metadata_query import answer_from_metadata, invalidate_footer_stats, get_unique_counts
+from services.dataset_rollup import query_with_rollup
+from services.arrow_utils import fetch_arrow_table, normalize_arrow_table, arrow_to_dataframe
 from sqlalchemy import select
 from models.sys_dataset import SysDataset
 from db.session import async_session
 
 logger = logging.getLogger(__name__)
 
+# 多数据集查询中的表名: dataset_1, dataset_2 ... 按数据集顺序编号
+_MULTI_DATASET_TABLE = re.compile(r'\bdataset_(\d+)\b', re.IGNORECASE)
+
+# 字符串字面量和带引号的标识符(绑定表名时跳过)
+_QUOTED_PATTERN = re.compile(r"('(?:[^']|'')*')|(\"(?:[^\"]|\"\")*\")")
+
 
 async def query_parquet_with_duckdb(
     dataset_id: str,
@@ -32,82 +45,302 @@ async def query_parquet_with_duckdb(
 
     Returns:
         查询结果DataFrame,失败返回None
-    """
-    temp_file = None
 
+    Raises:
+        QueryRejectedError: 查询计划代价过高,被准入检查拒绝
+    """
     try:
         # 1. 从数据库获取数据集信息
-        async with async_session() as session:
-            result = await session.execute(
-                select(SysDataset).where(SysDataset.id == dataset_id)
-            )
-            dataset_info = result.scalar_one_or_none()
-
-            if not dataset_info:
-                logger.error(f"数据集不存在: {dataset_id}")
-                return None
-
-            if dataset_info.parse_status != 'parsed':
-                logger.error(f"数据集未解析完成: {dataset_info.parse_status}")
-                return None
-
-            if not dataset_info.parsed_path:
-                logger.error(f"数据集Parquet路径为空")
-                return None
-
-        # 2. 从MinIO下载Parquet文件到临时文件
-        parquet_filename = dataset_info.parsed_path.split('/')[-1]
-        parquet_data = minio_client.download_file(f"parquet/{parquet_filename}")
-
-        # 创建临时文件
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.parquet')
-        temp_file.write(parquet_data)
-        temp_file.close()
-
-        logger.info(f"Parquet文件已下载到临时路径: {temp_file.name}")
-
-        # 3. 使用DuckDB执行查询
-        con = duckdb.connect()
-        
-        # 注册Parquet文件为表
-        table_name = f"dataset_{dataset_id.replace('-', '_')}"
-        con.execute(f"CREATE TABLE {table_name} AS SELECT * FROM read_parquet('{temp_file.name}')")
-        
-        # 执行查询
-        # 注意: 这里需要替换SQL中的表名
-        # 使用正则表达式替换，支持多行和空白字符
-        # 匹配 "FROM dataset" 或 "FROM\n    dataset" 等各种情况
-        modified_sql = re.sub(
-            r'FROM\s+dataset\b',
-            f'FROM {table_name}',
+        dataset_info = await get_parsed_dataset(dataset_id)
+        if dataset_info is None:
+            return None
+
+        object_name, parquet_version = get_parquet_location(dataset_info)
+
+        # 2. 简单聚合(COUNT/MIN/MAX/COUNT DISTINCT)直接由统计信息回答,无需下载和扫描数据
+        metadata_df = await answer_from_metadata(dataset_info, object_name, parquet_version, sql_query)
+        if metadata_df is not None:
+            return metadata_df
+
+        # 3. 查询结果缓存(键包含数据集MD5和Parquet版本,重新解析后自动失效)
+        cache_key = query_result_cache.build_key(
+            str(dataset_id),
+            f"{dataset_info.file_md5}:{parquet_version}",
             sql_query,
-            flags=re.IGNORECASE
+            limit
+        )
+        cached_table = query_result_cache.get(cache_key)
+        if cached_table is not None:
+            logger.info(f"命中查询结果缓存,返回 {cached_table.num_rows} 行数据")
+            return arrow_to_dataframe(cached_table)
+
+        # 4. 单维度分组聚合优先改写到汇总表执行
+        rollup_df = await query_with_rollup(
+            dataset_info, object_name, parquet_version, sql_query, limit, cache_key
+        )
+        if rollup_df is not None:
+            return rollup_df
+
+        # 5. 列去重计数用于准入检查估算分组结果行数
+        unique_counts = await get_unique_counts(dataset_info.id) if settings.QUERY_GUARD_ENABLED else None
+
+        # 6. 下载/读取缓存和DuckDB查询都是阻塞操作,交给查询执行器在线程池中执行
+        df = await query_executor.run(
+            _execute_parquet_query,
+            str(dataset_id),
+            object_name,
+            parquet_version,
+            sql_query,
+            limit,
+            cache_key,
+            None,
+            unique_counts
         )
-        
-        # 添加LIMIT保护
-        if limit and 'LIMIT' not in modified_sql.upper():
-            modified_sql += f" LIMIT {limit}"
-        
-        logger.info(f"执行DuckDB查询: {modified_sql}")
-        
-        df = con.execute(modified_sql).df()
-        con.close()
 
         logger.info(f"查询成功,返回 {len(df)} 行数据")
         return df
 
+    except QueryRejectedError:
+        # 准入检查拒绝的原因需要反馈给SQL生成环节重试
+        raise
     except Exception as e:
         logger.error(f"DuckDB查询失败: {e}", exc_info=True)
         return None
 
-    finally:
-        # 清理临时文件
-        if temp_file and os.path.exists(temp_file.name):
-            try:
-                os.unlink(temp_file.name)
-                logger.debug(f"临时文件已删除: {temp_file.name}")
-            except:
-                pass
+
+async def get_parsed_dataset(dataset_id: str) -> Optional[SysDataset]:
+    """
+    获取已解析完成的数据集记录
+
+    Args:
+        dataset_id: 数据集ID
+
+    Returns:
+        数据集记录,不存在或未解析完成时返回None
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            select(SysDataset).where(SysDataset.id == dataset_id)
+        )
+        dataset_info = result.scalar_one_or_none()
+
+    if not dataset_info:
+        logger.error(f"数据集不存在: {dataset_id}")
+        return None
+
+    if dataset_info.parse_status != 'parsed':
+        logger.error(f"数据集未解析完成: {dataset_info.parse_status}")
+        return None
+
+    if not dataset_info.parsed_path:
+        logger.error(f"数据集Parquet路径为空")
+        return None
+
+    return dataset_info
+
+
+def get_parquet_location(dataset_info: SysDataset) -> Tuple[str, Optional[str]]:
+    """
+    获取数据集Parquet文件在MinIO中的对象名称和版本(ETag)
+
+    Returns:
+        (对象名称, 版本)
+    """
+    parquet_filename = dataset_info.parsed_path.split('/')[-1]
+    parquet_version = (dataset_info.extra_metadata or {}).get('parquet_etag')
+    return f"parquet/{parquet_filename}", parquet_version
+
+
+def resolve_dataset_view(
+    ctx: QueryContext,
+    dataset_id: str,
+    object_name: str,
+    parquet_version: Optional[str]
+) -> str:
+    """
+    在查询执行器线程中执行: 准备本地Parquet文件并注册DuckDB视图
+
+    Returns:
+        视图名
+    """
+    # 获取本地缓存的Parquet文件(未命中时从MinIO下载)
+    parquet_path = parquet_cache.get_local_path(dataset_id, object_name, version=parquet_version)
+    ctx.check_cancelled()
+
+    # 在共享DuckDB引擎中注册数据集视图(同一文件只注册一次)
+    return duckdb_engine.register_dataset(dataset_id, parquet_path)
+
+
+def _execute_parquet_query(
+    ctx: QueryContext,
+    dataset_id: str,
+    object_name: str,
+    parquet_version: Optional[str],
+    sql_query: str,
+    limit: Optional[int],
+    cache_key: Optional[str] = None,
+    params: Optional[List[Any]] = None,
+    unique_counts: Optional[Dict[str, int]] = None
+) -> pd.DataFrame:
+    """
+    在查询执行器线程中执行: 获取本地Parquet文件、注册视图、执行查询并写入结果缓存
+
+    Args:
+        ctx: 查询上下文(用于超时中断)
+        dataset_id: 数据集ID
+        object_name: Parquet文件在MinIO中的对象名称
+        parquet_version: Parquet文件版本(ETag)
+        sql_query: SQL查询语句
+        limit: 最大返回行数
+        cache_key: 查询结果缓存键
+        params: 参数列表,不为None时SQL为参数化模板,使用预编译语句执行
+        unique_counts: 列去重计数(准入检查估算分组结果行数)
+
+    Returns:
+        查询结果DataFrame
+    """
+    table_name = resolve_dataset_view(ctx, dataset_id, object_name, parquet_version)
+    modified_sql = bind_dataset_sql(sql_query, table_name)
+
+    # 添加LIMIT保护
+    if limit and 'LIMIT' not in modified_sql.upper():
+        modified_sql += f" LIMIT {limit}"
+
+    with duckdb_engine.cursor() as cur:
+        ctx.bind_cursor(cur)
+        try:
+            if params is not None:
+                logger.info(f"执行DuckDB查询: {modified_sql}")
+                result = duckdb_engine.execute_prepared(cur, modified_sql, params)
+            else:
+                # 自由SQL(通常由LLM生成)先做代价检查
+                modified_sql = admit_query(cur, modified_sql, limit, unique_counts)
+                logger.info(f"执行DuckDB查询: {modified_sql}")
+                result = cur.execute(modified_sql)
+            table = fetch_arrow_table(result)
+        finally:
+            ctx.release_cursor()
+
+    table = normalize_arrow_table(table)
+    if cache_key:
+        try:
+            query_result_cache.set(cache_key, dataset_id, table)
+        except Exception as e:
+            logger.warning(f"写入查询结果缓存失败: {e}")
+
+    return arrow_to_dataframe(table)
+
+
+def bind_multi_dataset_sql(sql_query: str, table_names: List[str]) -> str:
+    """
+    将SQL中的 dataset_1, dataset_2 ... 替换为对应数据集的视图名(字符串和带引号的标识符内不替换)
+
+    Raises:
+        ValueError: 引用了不存在的数据集编号
+    """
+    def replace(match: re.Match) -> str:
+        index = int(match.group(1)) - 1
+        if not 0 <= index < len(table_names):
+            raise ValueError(f"SQL引用了不存在的数据集: {match.group(0)}")
+        return table_names[index]
+
+    parts = []
+    last_end = 0
+    for match in _QUOTED_PATTERN.finditer(sql_query):
+        parts.append(_MULTI_DATASET_TABLE.sub(replace, sql_query[last_end:match.start()]))
+        parts.append(match.group(0))
+        last_end = match.end()
+    parts.append(_MULTI_DATASET_TABLE.sub(replace, sql_query[last_end:]))
+    return ''.join(parts)
+
+
+def _execute_multi_dataset_query(
+    ctx: QueryContext,
+    table_names: List[str],
+    sql_query: str,
+    limit: Optional[int]
+) -> pd.DataFrame:
+    """
+    在查询执行器线程中执行: 在共享DuckDB引擎中对多个数据集视图执行一条SQL
+    """
+    modified_sql = bind_multi_dataset_sql(sql_query, table_names)
+    if limit and 'LIMIT' not in modified_sql.upper():
+        modified_sql += f" LIMIT {limit}"
+
+    with duckdb_engine.cursor() as cur:
+        ctx.bind_cursor(cur)
+        try:
+            modified_sql = admit_query(cur, modified_sql, limit)
+            logger.info(f"执行DuckDB多数据集查询: {modified_sql}")
+            table = fetch_arrow_table(cur.execute(modified_sql))
+        finally:
+            ctx.release_cursor()
+
+    return arrow_to_dataframe(normalize_arrow_table(table))
+
+
+async def query_datasets_with_duckdb(
+    dataset_ids: List[str],
+    sql_query: str,
+    limit: Optional[int] = 1000
+) -> Optional[pd.DataFrame]:
+    """
+    在一条DuckDB查询中同时访问多个数据集(支持跨数据集JOIN)
+
+    各数据集的Parquet文件并发准备并注册为视图,然后在同一引擎中执行查询,
+    总耗时约为最慢的数据集准备时间加一次查询,而不是逐个查询之和
+
+    Args:
+        dataset_ids: 数据集ID列表,SQL中依次用 dataset_1, dataset_2 ... 引用
+        sql_query: SQL查询语句
+        limit: 最大返回行数
+
+    Returns:
+        查询结果DataFrame,失败返回None
+
+    Raises:
+        QueryRejectedError: 查询计划代价过高,被准入检查拒绝
+    """
+    try:
+        datasets = await asyncio.gather(*(get_parsed_dataset(dataset_id) for dataset_id in dataset_ids))
+        if any(dataset_info is None for dataset_info in datasets):
+            return None
+
+        table_names = await asyncio.gather(*(
+            query_executor.run(
+                resolve_dataset_view,
+                str(dataset_info.id),
+                *get_parquet_location(dataset_info)
+            )
+            for dataset_info in datasets
+        ))
+
+        df = await query_executor.run(_execute_multi_dataset_query, list(table_names), sql_query, limit)
+        logger.info(f"多数据集查询成功,返回 {len(df)} 行数据")
+        return df
+
+    except QueryRejectedError:
+        raise
+    except Exception as e:
+        logger.error(f"DuckDB多数据集查询失败: {e}", exc_info=True)
+        return None
+
+
+def invalidate_dataset_cache(dataset_id: str):
+    """
+    清理数据集相关的查询缓存(数据集删除或重新解析时调用)
+
+    Args:
+        dataset_id: 数据集ID
+    """
+    dataset_id = str(dataset_id)
+    duckdb_engine.unregister_dataset(dataset_id)
+    parquet_cache.invalidate(dataset_id)
+    query_result_cache.invalidate(dataset_id)
+    invalidate_footer_stats(dataset_id)
+
+    from services.multi_dataset_query import invalidate_datasets_metadata
+    invalidate_datasets_metadata(dataset_id)
 
 
 async def get_dataset_sample(dataset_id: str, limit: int = 10) -> Optional[pd.DataFrame]:
@@ -125,6 +358,59 @@ async def get_dataset_sample(dataset_id: str, limit: int = 10) -> Optional[pd.Da
     return await query_parquet_with_duckdb(dataset_id, sql)
 
 
+async def query_dataset_with_params(
+    dataset_id: str,
+    sql_template: str,
+    params: List[Any]
+) -> Optional[pd.DataFrame]:
+    """
+    执行参数化的数据集查询(预编译语句按查询形状缓存,过滤值变化时复用查询计划)
+
+    Args:
+        dataset_id: 数据集ID
+        sql_template: 使用 $1, $2... 占位符的SQL(表名为 dataset)
+        params: 参数列表
+
+    Returns:
+        查询结果DataFrame,失败返回None
+    """
+    try:
+        dataset_info = await get_parsed_dataset(dataset_id)
+        if dataset_info is None:
+            return None
+
+        object_name, parquet_version = get_parquet_location(dataset_info)
+
+        cache_key = query_result_cache.build_key(
+            str(dataset_id),
+            f"{dataset_info.file_md5}:{parquet_version}",
+            sql_template,
+            params=params
+        )
+        cached_table = query_result_cache.get(cache_key)
+        if cached_table is not None:
+            logger.info(f"命中查询结果缓存,返回 {cached_table.num_rows} 行数据")
+            return arrow_to_dataframe(cached_table)
+
+        df = await query_executor.run(
+            _execute_parquet_query,
+            str(dataset_id),
+            object_name,
+            parquet_version,
+            sql_template,
+            None,
+            cache_key,
+            params
+        )
+
+        logger.info(f"查询成功,返回 {len(df)} 行数据")
+        return df
+
+    except Exception as e:
+        logger.error(f"DuckDB参数化查询失败: {e}", exc_info=True)
+        return None
+
+
 async def execute_dataset_query(
     dataset_id: str,
     columns: Optional[List[str]] = None,
@@ -139,46 +425,19 @@ async def execute_dataset_query(
     Args:
         dataset_id: 数据集ID
         columns: 查询的列名列表,None表示所有列
-        filters: 过滤条件字典 {col_name: value}
+        filters: 过滤条件,支持等值、IN、范围、LIKE,格式见 query_builder.build_filter_conditions
         group_by: 分组列
-        order_by: 排序列
+        order_by: 排序列,列名前加 "-" 表示降序
         limit: 最大返回行数
 
     Returns:
         查询结果DataFrame
     """
-    # 构建SQL
-    if columns:
-        cols_str = ', '.join([f'"{col}"' for col in columns])
-    else:
-        cols_str = '*'
-
-    sql_parts = [f"SELECT {cols_str} FROM dataset"]
-
-    # WHERE条件
-    if filters:
-        where_clauses = []
-        for col, value in filters.items():
-            if isinstance(value, str):
-                where_clauses.append(f'"{col}" = \'{value}\'')
-            else:
-                where_clauses.append(f'"{col}" = {value}')
-        if where_clauses:
-            sql_parts.append("WHERE " + " AND ".join(where_clauses))
-
-    # GROUP BY
-    if group_by:
-        group_cols = ', '.join([f'"{col}"' for col in group_by])
-        sql_parts.append(f"GROUP BY {group_cols}")
-
-    # ORDER BY
-    if order_by:
-        order_cols = ', '.join([f'"{col}"' for col in order_by])
-        sql_parts.append(f"ORDER BY {order_cols}")
-
-    # LIMIT
-    sql_parts.append(f"LIMIT {limit}")
-
-    sql = ' '.join(sql_parts)
-
-    return await query_parquet_with_duckdb(dataset_id, sql, limit=None)
\ No newline at end of file
+    sql_template, params = build_dataset_query(
+        columns=columns,
+        filters=filters,
+        group_by=group_by,
+        order_by=order_by,
+        limit=limit
+    )
+    return await query_dataset_with_params(dataset_id, sql_template, params)
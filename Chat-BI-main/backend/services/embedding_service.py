@@ -569,13 +569,14 @@ def build_column_description(col_info: Dict[str, Any]) -> str:
     return ', '.join(parts)
 
 
-async def vectorize_columns(dataset_id: str, chunked_data: List[Dict[str, Any]]):
+async def vectorize_columns(dataset_id: str, chunked_data: List[Dict[str, Any]], progress=None):
     """
     对已分片的列数据进行向量化并存入Qdrant
 
     Args:
         dataset_id: 数据集ID
         chunked_data: 分片数据列表，每项包含 {index, col_info, description}
+        progress: 进度上报(DatasetProgressReporter),为空时不上报
 
     Raises:
         Exception: 向量化失败时抛出异常
@@ -598,11 +599,6 @@ async def vectorize_columns(dataset_id: str, chunked_data: List[Dict[str, Any]])
     try:
         logger.info(f"开始为数据集 {dataset_id} 向量化 {len(chunked_data)} 个列")
 
-        # 获取数据库会话以更新进度
-        from db.session import async_session
-        from models.sys_dataset import SysDataset
-        from sqlalchemy import select
-
         points = []
         for item in chunked_data:
             idx = item['index']
@@ -637,16 +633,12 @@ async def vectorize_columns(dataset_id: str, chunked_data: List[Dict[str, Any]])
                 )
                 points.append(point)
 
-                # 更新向量化进度
-                progress = int((idx + 1) / len(chunked_data) * 100)
-                async with async_session() as session:
-                    result = await session.execute(
-                        select(SysDataset).where(SysDataset.id == dataset_id)
+                # 更新向量化进度(节流后发布,检查点才写入数据库)
+                if progress:
+                    await progress.update(
+                        int((idx + 1) / len(chunked_data) * 100),
+                        f"已向量化 {idx + 1}/{len(chunked_data)} 列"
                     )
-                    dataset = result.scalar_one_or_none()
-                    if dataset:
-                        dataset.vectorize_progress = progress
-                        await session.commit()
 
                 logger.debug(f"列 '{col_info['name']}' 向量化完成 ({idx+1}/{len(chunked_data)})")
 
@@ -859,6 +851,49 @@ async def get_dataset_columns(dataset_id: str) -> List[Dict[str, Any]]:
         return []
 
 
+async def get_column_vectors(dataset_id: str) -> Dict[str, List[float]]:
+    """
+    从当前维度的Qdrant集合获取数据集各列的向量
+
+    Args:
+        dataset_id: 数据集ID
+
+    Returns:
+        列名 -> 向量,Qdrant不可用或数据集未向量化时返回空字典
+    """
+    if not qdrant_client:
+        return {}
+
+    try:
+        collection_name = await _get_or_prepare_collection_name()
+        if not collection_name:
+            return {}
+
+        points, _ = qdrant_client.scroll(
+            collection_name=collection_name,
+            scroll_filter=Filter(
+                must=[
+                    FieldCondition(
+                        key="dataset_id",
+                        match=MatchValue(value=str(dataset_id))
+                    )
+                ]
+            ),
+            limit=1000,
+            with_payload=["col_name"],
+            with_vectors=True
+        )
+        return {
+            point.payload.get('col_name'): point.vector
+            for point in points
+            if point.payload.get('col_name') and point.vector
+        }
+
+    except Exception as e:
+        logger.warning(f"获取数据集 {dataset_id} 的列向量失败: {e}")
+        return {}
+
+
 async def delete_dataset_embeddings(dataset_id: str):
     """
     删除数据集的所有embedding
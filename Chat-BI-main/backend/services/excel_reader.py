@@ -0,0 +1,329 @@
+"""
+Excel读取工具
+以只读流式方式打开工作簿(openpyxl read_only / xlrd),只加载一次:
+先用开头几行检测多行表头,再从同一个行迭代器继续分块读出数据
+"""
+import itertools
+import logging
+from typing import Any, BinaryIO, Callable, Iterator, List, Optional, Tuple, Union
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 检测表头时最多检查的行数
+HEADER_SCAN_ROWS = 10
+
+# openpyxl以字符串形式返回的错误值,与pandas一致视为空值
+_EXCEL_ERROR_VALUES = {'#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A', '#GETTING_DATA'}
+
+
+class ExcelReadError(Exception):
+    """所有引擎都无法打开工作簿"""
+
+
+def excel_engines(filename: str) -> List[str]:
+    """按文件扩展名确定依次尝试的解析引擎"""
+    if filename.endswith('.xlsx'):
+        return ['openpyxl']
+    if filename.endswith('.xls'):
+        return ['xlrd']
+    if filename.endswith('.et'):
+        # .et文件尝试所有可用引擎
+        return ['openpyxl', 'xlrd']
+    return []
+
+
+def _convert_value(value: Any) -> Any:
+    # 与pandas读取Excel时的转换一致: 整数值的浮点数转为整数,空字符串和错误值视为空
+    if type(value) is float:
+        return int(value) if value.is_integer() else value
+    if type(value) is str and (value == '' or value in _EXCEL_ERROR_VALUES):
+        return None
+    return value
+
+
+def _open_openpyxl_rows(source: Union[str, BinaryIO]) -> Tuple[Iterator[list], Optional[int], Callable[[], None]]:
+    import openpyxl
+
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True, keep_links=False)
+    ws = wb.worksheets[0]
+    # 工作表记录的区域可能不准确,只用于估计进度;按实际单元格读取
+    total_rows = ws.max_row
+    ws.reset_dimensions()
+    rows = ([_convert_value(v) for v in row] for row in ws.iter_rows(values_only=True))
+    return rows, total_rows, wb.close
+
+
+def _open_xlrd_rows(source: Union[str, BinaryIO]) -> Tuple[Iterator[list], Optional[int], Callable[[], None]]:
+    import xlrd
+
+    if isinstance(source, str):
+        book = xlrd.open_workbook(source, on_demand=True)
+    else:
+        book = xlrd.open_workbook(file_contents=source.read(), on_demand=True)
+    sheet = book.sheet_by_index(0)
+
+    def convert(cell):
+        if cell.ctype == xlrd.XL_CELL_DATE:
+            try:
+                return xlrd.xldate_as_datetime(cell.value, book.datemode)
+            except (ValueError, OverflowError):
+                return cell.value
+        if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+            return bool(cell.value)
+        if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+            return None
+        return _convert_value(cell.value)
+
+    rows = ([convert(cell) for cell in sheet.row(i)] for i in range(sheet.nrows))
+    return rows, sheet.nrows, book.release_resources
+
+
+def open_excel_rows(source: Union[str, BinaryIO], engine: str) -> Tuple[Iterator[list], Optional[int], Callable[[], None]]:
+    """
+    打开工作簿的第一个工作表
+
+    Args:
+        source: 文件路径或文件对象
+        engine: openpyxl / xlrd
+
+    Returns:
+        (逐行的值列表迭代器, 估计行数(未知时为None), 关闭函数)
+    """
+    if engine == 'openpyxl':
+        return _open_openpyxl_rows(source)
+    if engine == 'xlrd':
+        return _open_xlrd_rows(source)
+    raise ValueError(f"不支持的Excel引擎: {engine}")
+
+
+def _trim_row(row: list) -> list:
+    while row and row[-1] is None:
+        row.pop()
+    return row
+
+
+def detect_header_rows_in_preview(
+    preview_df: pd.DataFrame,
+    max_rows: int = HEADER_SCAN_ROWS,
+    min_data_confidence: float = 0.7
+) -> List[int]:
+    """
+    根据工作表开头几行检测表头行数(支持任意层级)
+
+    策略：动态检测，直到遇到明显的数据行为止
+
+    Args:
+        preview_df: 开头 max_rows+2 行(header=None)
+        max_rows: 最大检测行数
+        min_data_confidence: 判断为数据行的最小置信度（0-1）
+
+    Returns:
+        表头行索引列表，例如 [0] 表示单行表头，[0, 1, 2] 表示三行表头
+    """
+    if len(preview_df) == 0:
+        return [0]
+
+    # 检查每行的特征，动态判断
+    header_candidates = [0]  # 至少第一行是表头
+
+    for i in range(1, min(max_rows, len(preview_df))):
+        row = preview_df.iloc[i]
+
+        if len(row) == 0:
+            # 空行，跳过
+            continue
+
+        # 计算各种特征
+        null_ratio = row.isna().sum() / len(row)
+        unique_ratio = row.nunique() / len(row)
+
+        # 检查数据类型：表头通常是字符串，数据行通常有数值
+        string_count = sum(1 for val in row if pd.notna(val) and isinstance(val, str))
+        numeric_count = sum(1 for val in row if pd.notna(val) and isinstance(val, (int, float)))
+        string_ratio = string_count / len(row) if len(row) > 0 else 0
+        numeric_ratio = numeric_count / len(row) if len(row) > 0 else 0
+
+        # 判断是否为表头行的综合指标
+        is_likely_header = False
+
+        # 条件1：空值比例高（可能是合并单元格）
+        if null_ratio > 0.3:
+            is_likely_header = True
+
+        # 条件2：唯一值比例低（可能是重复的表头结构）
+        elif unique_ratio < 0.5:
+            is_likely_header = True
+
+        # 条件3：整行都是字符串（更可能是表头）
+        elif string_ratio > 0.8 and numeric_ratio < 0.2:
+            is_likely_header = True
+
+        # 条件4：与上一行对比，如果结构相似（都有空值），可能是同一层级表头
+        prev_row = preview_df.iloc[i - 1]
+        prev_null_ratio = prev_row.isna().sum() / len(prev_row) if len(prev_row) > 0 else 0
+        # 如果两行都有较高的空值比例，可能是多层级表头
+        if null_ratio > 0.2 and prev_null_ratio > 0.2:
+            is_likely_header = True
+
+        if is_likely_header:
+            header_candidates.append(i)
+        else:
+            # 这一行看起来像数据，停止检测
+            # 但需要确认：如果数值比例很高，几乎肯定是数据行
+            if numeric_ratio > min_data_confidence:
+                logger.info(f"在第 {i+1} 行检测到数据特征（数值比例: {numeric_ratio:.2f}），停止检测")
+                break
+
+    # 如果检测到多行表头，返回所有候选行
+    if len(header_candidates) > 1:
+        logger.info(f"检测到 {len(header_candidates)} 行表头: {header_candidates}")
+        return header_candidates
+
+    # 默认单行表头
+    return [0]
+
+
+def merge_header_rows(header_values: List[list], width: int) -> List[Any]:
+    """
+    由表头行生成列名
+
+    单行表头与pandas一致(空单元格为 Unnamed: i);多行表头先按pandas的规则
+    向右填充上层的合并单元格,再用下划线连接各层的非空值
+    """
+    if len(header_values) == 1:
+        row = header_values[0]
+        return [
+            row[i] if i < len(row) and row[i] is not None else f'Unnamed: {i}'
+            for i in range(width)
+        ]
+
+    levels = [[row[i] if i < len(row) else None for i in range(width)] for row in header_values]
+    # 上层的合并单元格只在第一个单元格有值,向右填充,但不跨越更上层的分组边界
+    control = [True] * width
+    for level in levels[:-1]:
+        last = level[0] if width else None
+        for i in range(1, width):
+            if not control[i]:
+                last = level[i]
+            if level[i] is None:
+                level[i] = last
+            else:
+                control[i] = False
+                last = level[i]
+
+    columns = []
+    for i in range(width):
+        parts = []
+        for level in levels:
+            part = str(level[i]).strip() if level[i] is not None else ''
+            if part and part.lower() not in ('nan', 'none'):
+                parts.append(part)
+        columns.append('_'.join(parts) if parts else f'Column_{i}')
+
+    logger.info(f"多表头合并完成，列名示例: {columns[:5]}")
+    return columns
+
+
+def _drop_trailing_empty(rows: Iterator[list]) -> Iterator[list]:
+    """丢弃工作表末尾的空行(中间的空行保留)"""
+    pending = []
+    for row in rows:
+        if row:
+            yield from pending
+            pending.clear()
+            yield row
+        else:
+            pending.append(row)
+
+
+def _iter_frames(
+    preview: List[list],
+    rows: Iterator[list],
+    total_rows: Optional[int],
+    chunk_rows: int,
+    detect_headers: bool,
+    on_progress: Optional[Callable[[float], None]]
+) -> Iterator[pd.DataFrame]:
+    if not any(preview):
+        yield pd.DataFrame()
+        return
+
+    width = max(len(row) for row in preview)
+    preview = [row + [None] * (width - len(row)) for row in preview]
+    header_rows = detect_header_rows_in_preview(pd.DataFrame(preview)) if detect_headers else [0]
+    if len(header_rows) > 1:
+        logger.info(f"使用多行表头读取: header={header_rows}")
+    columns = merge_header_rows([preview[i] for i in header_rows], width)
+
+    data_start = header_rows[-1] + 1
+    rows_read = data_start
+    truncated = False
+    chunk: List[list] = []
+    for row in _drop_trailing_empty(itertools.chain(preview[data_start:], rows)):
+        if len(row) > width:
+            if not truncated:
+                # 列数以表头区域为准,超出部分的单元格无法对应列名
+                logger.warning(f"第 {rows_read + len(chunk) + 1} 行起存在超出表头范围的单元格，已忽略")
+                truncated = True
+            row = row[:width]
+        elif len(row) < width:
+            row = row + [None] * (width - len(row))
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            rows_read += len(chunk)
+            yield pd.DataFrame(chunk, columns=columns)
+            chunk = []
+            if on_progress and total_rows:
+                on_progress(min(rows_read / total_rows, 1.0))
+    if chunk or rows_read == data_start:
+        yield pd.DataFrame(chunk, columns=columns)
+
+
+def iter_excel_chunks(
+    source: Union[str, BinaryIO],
+    engines: List[str],
+    chunk_rows: int,
+    detect_headers: bool = True,
+    on_progress: Optional[Callable[[float], None]] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    分块读取Excel/WPS文件的第一个工作表,多行表头合并为单层列名
+
+    工作簿只打开一次: 表头检测使用的开头几行与后续数据来自同一个行迭代器
+
+    Args:
+        source: 文件路径或文件对象
+        engines: 依次尝试的引擎(见 excel_engines)
+        chunk_rows: 每块行数
+        detect_headers: 是否自动检测表头行数
+        on_progress: 每读出一块后以读取进度(0~1,按工作表记录的行数估计)回调
+
+    Raises:
+        ExcelReadError: 所有引擎都无法打开工作簿(尚未产出任何数据)
+    """
+    errors = []
+    for engine in engines:
+        close = None
+        try:
+            if not isinstance(source, str):
+                source.seek(0)
+            rows, total_rows, close = open_excel_rows(source, engine)
+            rows = (_trim_row(row) for row in rows)
+            preview = list(itertools.islice(rows, HEADER_SCAN_ROWS + 2))
+        except Exception as e:
+            if close:
+                close()
+            errors.append(f"{engine}: {e}")
+            logger.warning(f"{engine}打开工作簿失败: {e}")
+            continue
+
+        logger.info(f"使用{engine}引擎流式读取工作簿")
+        try:
+            yield from _iter_frames(preview, rows, total_rows, chunk_rows, detect_headers, on_progress)
+        finally:
+            close()
+        return
+
+    raise ExcelReadError('; '.join(errors) or "没有可用的解析引擎")
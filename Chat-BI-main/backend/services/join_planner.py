@@ -0,0 +1,332 @@
+"""
+跨数据集连接规划
+解析时为候选键列生成取值草图(取值哈希中最小的k个,KMV),查询时结合列名相似度、
+列向量相似度和草图估计的取值重合度找出数据集之间的连接键,
+生成一条DuckDB JOIN查询,代替逐个查询后在pandas中拼接
+"""
+import difflib
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 可作为连接键的列类型
+_KEY_TYPES = {'int', 'string'}
+
+# 哈希值右移位数: 保留53位,JSON中的整数在前端也不丢失精度
+_HASH_SHIFT = 11
+
+_NAME_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def _normalize_key_values(col_data: pd.Series, dtype: str) -> Optional[np.ndarray]:
+    """
+    将键列的不同非空值统一为字符串形式,使整数列和数字字符串列可以比较
+
+    先去重再转换,重复取值多的列只需转换和哈希一次
+
+    Returns:
+        去重后的字符串对象数组,不适合作为连接键时返回None
+    """
+    non_null = col_data.dropna()
+    if dtype == 'int':
+        numeric = pd.to_numeric(non_null, errors='coerce').dropna().to_numpy()
+        if len(numeric) == 0 or not (numeric == np.round(numeric)).all():
+            return None
+        # PyArrow转换整数为字符串比逐个调用str()快一个数量级
+        integers = pd.unique(numeric.astype(np.int64))
+        return pa.array(integers).cast(pa.string()).to_numpy(zero_copy_only=False)
+    if dtype == 'string':
+        values = pd.Series(pd.unique(non_null.to_numpy(dtype=object))).astype(str).str.strip()
+        return pd.unique(values[values != ''].to_numpy(dtype=object))
+    return None
+
+
+def value_hashes(col_data: pd.Series, dtype: str) -> Optional[np.ndarray]:
+    """
+    计算键列不同取值的哈希(升序去重)
+
+    Returns:
+        哈希数组,列类型不适合作为连接键时返回None
+    """
+    if dtype not in _KEY_TYPES:
+        return None
+
+    values = _normalize_key_values(col_data, dtype)
+    if values is None:
+        return None
+    return hash_values(values)
+
+
+def hash_values(values: Union[pd.Series, np.ndarray]) -> np.ndarray:
+    """计算取值的哈希(升序去重)"""
+    if isinstance(values, pd.Series):
+        values = values.to_numpy()
+    # hash_array 使用固定密钥,不同进程中同一取值的哈希相同;
+    # 先去重,且不再在内部分类(categorize),取值多的列可省去一次分解
+    values = pd.unique(values)
+    return sorted_unique(pd.util.hash_array(values, categorize=False) >> _HASH_SHIFT)
+
+
+def sorted_unique(hashes: np.ndarray) -> np.ndarray:
+    """哈希数组排序去重(对uint64数组比 np.unique 快得多)"""
+    hashes = np.sort(hashes)
+    if len(hashes) < 2:
+        return hashes
+    return hashes[np.concatenate(([True], hashes[1:] != hashes[:-1]))]
+
+
+def make_value_sketch(hashes: np.ndarray, distinct: int, count: int, size: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    由升序哈希构造取值草图
+
+    Args:
+        hashes: 升序去重的取值哈希(至少包含最小的 size 个)
+        distinct: 不同值数
+        count: 非空行数
+        size: 保存的哈希数,默认 JOIN_SKETCH_SIZE
+    """
+    if distinct < 2 or len(hashes) == 0:
+        return None
+
+    size = size or settings.JOIN_SKETCH_SIZE
+    return {
+        'hashes': [int(value) for value in hashes[:size]],
+        'distinct': int(distinct),
+        'count': int(count)
+    }
+
+
+def estimate_overlap(sketch_a: Dict[str, Any], sketch_b: Dict[str, Any]) -> float:
+    """
+    估计两列取值的重合度: 较小的取值集合中出现在另一列的比例
+
+    用两个草图合并后的最小k个哈希估计Jaccard系数,再换算为包含度
+    """
+    hashes_a = np.asarray(sketch_a['hashes'], dtype=np.uint64)
+    hashes_b = np.asarray(sketch_b['hashes'], dtype=np.uint64)
+    distinct_a, distinct_b = sketch_a['distinct'], sketch_b['distinct']
+
+    union = np.union1d(hashes_a, hashes_b)
+    if len(hashes_a) < distinct_a or len(hashes_b) < distinct_b:
+        # 草图不完整时只有双方最小k个范围内的哈希可比较
+        union = union[:min(len(hashes_a), len(hashes_b))]
+    if len(union) == 0:
+        return 0.0
+
+    common = np.intersect1d(np.intersect1d(hashes_a, hashes_b), union)
+    jaccard = len(common) / len(union)
+    intersection = jaccard * (distinct_a + distinct_b) / (1 + jaccard)
+    return float(min(1.0, intersection / min(distinct_a, distinct_b)))
+
+
+def _normalize_name(name: str) -> str:
+    return _NAME_SEPARATORS.sub('', name.lower())
+
+
+def _name_similarity(name_a: str, name_b: str) -> float:
+    normalized_a, normalized_b = _normalize_name(name_a), _normalize_name(name_b)
+    if not normalized_a or not normalized_b:
+        return 0.0
+    if normalized_a == normalized_b:
+        return 1.0
+    return difflib.SequenceMatcher(None, normalized_a, normalized_b).ratio()
+
+
+def _cosine_similarity(vector_a: Optional[List[float]], vector_b: Optional[List[float]]) -> Optional[float]:
+    if vector_a is None or vector_b is None or len(vector_a) != len(vector_b):
+        return None
+    a, b = np.asarray(vector_a, dtype=float), np.asarray(vector_b, dtype=float)
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / norm) if norm else None
+
+
+def _is_unique_key(sketch: Dict[str, Any]) -> bool:
+    return sketch['distinct'] >= sketch['count'] * settings.JOIN_KEY_MIN_UNIQUE_RATIO
+
+
+def score_join_key(
+    col_a: Dict[str, Any],
+    col_b: Dict[str, Any],
+    vector_a: Optional[List[float]] = None,
+    vector_b: Optional[List[float]] = None
+) -> Optional[Dict[str, float]]:
+    """
+    计算两列作为连接键的得分
+
+    Args:
+        col_a, col_b: 列元数据 {col_name, col_type, value_sketch}
+        vector_a, vector_b: 列向量(可选)
+
+    Returns:
+        {'score', 'name', 'embedding', 'overlap'},不适合作为连接键时返回None
+    """
+    if col_a.get('col_type') not in _KEY_TYPES or col_b.get('col_type') not in _KEY_TYPES:
+        return None
+
+    name = _name_similarity(col_a['col_name'], col_b['col_name'])
+    embedding = _cosine_similarity(vector_a, vector_b)
+    sketch_a, sketch_b = col_a.get('value_sketch'), col_b.get('value_sketch')
+
+    if sketch_a and sketch_b:
+        if not (_is_unique_key(sketch_a) or _is_unique_key(sketch_b)):
+            return None
+        overlap = estimate_overlap(sketch_a, sketch_b)
+        if overlap < settings.JOIN_MIN_OVERLAP:
+            return None
+        if embedding is None:
+            score = 0.6 * overlap + 0.4 * name
+        else:
+            score = 0.5 * overlap + 0.3 * name + 0.2 * max(embedding, 0.0)
+    else:
+        # 解析时未生成草图(早期数据集): 只接受同名列
+        if name < 1.0:
+            return None
+        overlap = None
+        score = name if embedding is None else 0.7 * name + 0.3 * max(embedding, 0.0)
+
+    if score < settings.JOIN_MIN_SCORE:
+        return None
+    return {'score': score, 'name': name, 'embedding': embedding, 'overlap': overlap}
+
+
+def find_join_keys(
+    dataset_a: Dict[str, Any],
+    dataset_b: Dict[str, Any],
+    column_vectors: Optional[Dict[Tuple[str, str], List[float]]] = None
+) -> List[Dict[str, Any]]:
+    """
+    找出两个数据集之间的候选连接键,按得分降序
+
+    Args:
+        dataset_a, dataset_b: 数据集元数据(get_datasets_metadata 的返回项)
+        column_vectors: (dataset_id, col_name) -> 列向量
+
+    Returns:
+        [{'left_column', 'right_column', 'left_type', 'right_type', 'score', ...}]
+    """
+    column_vectors = column_vectors or {}
+    candidates = []
+    for col_a in dataset_a['columns']:
+        for col_b in dataset_b['columns']:
+            result = score_join_key(
+                col_a,
+                col_b,
+                column_vectors.get((dataset_a['id'], col_a['col_name'])),
+                column_vectors.get((dataset_b['id'], col_b['col_name']))
+            )
+            if result:
+                candidates.append({
+                    'left_column': col_a['col_name'],
+                    'right_column': col_b['col_name'],
+                    'left_type': col_a['col_type'],
+                    'right_type': col_b['col_type'],
+                    **result
+                })
+    candidates.sort(key=lambda candidate: candidate['score'], reverse=True)
+    return candidates
+
+
+def plan_joins(
+    datasets_metadata: List[Dict[str, Any]],
+    column_vectors: Optional[Dict[Tuple[str, str], List[float]]] = None
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    为多个数据集规划连接: 取各数据集对的最佳连接键,按得分构造最大生成树
+
+    以行数最多的数据集(通常是明细表)为根,其余数据集依次LEFT JOIN
+
+    Args:
+        datasets_metadata: 数据集元数据列表,SQL中依次用 dataset_1, dataset_2 ... 引用
+        column_vectors: (dataset_id, col_name) -> 列向量
+
+    Returns:
+        连接步骤列表 [{'left': 已连接数据集序号, 'right': 新连接数据集序号,
+        'left_column', 'right_column', 'left_type', 'right_type', 'score', ...}](序号从0开始),
+        无法把所有数据集连起来时返回None
+    """
+    count = len(datasets_metadata)
+    if count < 2:
+        return None
+
+    edges = []
+    for i in range(count):
+        for j in range(i + 1, count):
+            candidates = find_join_keys(datasets_metadata[i], datasets_metadata[j], column_vectors)
+            if candidates:
+                edges.append((candidates[0]['score'], i, j, candidates[0]))
+
+    # Kruskal: 按得分从高到低选边,跳过成环的边
+    parent = list(range(count))
+
+    def find(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    tree: Dict[int, List[Tuple[int, Dict[str, Any], bool]]] = {i: [] for i in range(count)}
+    for _, i, j, candidate in sorted(edges, key=lambda edge: edge[0], reverse=True):
+        root_i, root_j = find(i), find(j)
+        if root_i == root_j:
+            continue
+        parent[root_i] = root_j
+        tree[i].append((j, candidate, False))
+        tree[j].append((i, candidate, True))
+
+    if len({find(i) for i in range(count)}) > 1:
+        return None
+
+    root = max(range(count), key=lambda i: datasets_metadata[i].get('row_count') or 0)
+    steps = []
+    visited = {root}
+    queue = [root]
+    while queue:
+        node = queue.pop(0)
+        for neighbor, candidate, swapped in tree[node]:
+            if neighbor in visited:
+                continue
+            visited.add(neighbor)
+            queue.append(neighbor)
+            if swapped:
+                # 候选键按 (较小序号, 较大序号) 方向记录,从较大序号一侧连接时交换左右
+                candidate = {
+                    **candidate,
+                    'left_column': candidate['right_column'],
+                    'right_column': candidate['left_column'],
+                    'left_type': candidate['right_type'],
+                    'right_type': candidate['left_type']
+                }
+            steps.append({'left': node, 'right': neighbor, **candidate})
+
+    return steps
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def build_join_clause(join_plan: List[Dict[str, Any]]) -> str:
+    """
+    生成 FROM ... LEFT JOIN ... 子句,数据集 i 使用别名 t{i+1}
+
+    两侧列类型不同(整数与字符串)时统一转换为VARCHAR比较
+    """
+    root = join_plan[0]['left']
+    clause = [f"FROM dataset_{root + 1} AS t{root + 1}"]
+    for step in join_plan:
+        left = f"t{step['left'] + 1}.{_quote_identifier(step['left_column'])}"
+        right = f"t{step['right'] + 1}.{_quote_identifier(step['right_column'])}"
+        if step['left_type'] != step['right_type']:
+            left, right = f"CAST({left} AS VARCHAR)", f"CAST({right} AS VARCHAR)"
+        clause.append(
+            f"LEFT JOIN dataset_{step['right'] + 1} AS t{step['right'] + 1} ON {left} = {right}"
+        )
+    return '\n'.join(clause)
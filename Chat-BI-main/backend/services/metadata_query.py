@@ -0,0 +1,404 @@
+"""
+统计信息短路查询
+对 COUNT(*)、COUNT(列)、MIN/MAX(列)、APPROX_COUNT_DISTINCT(列) 这类不带条件的简单聚合,
+直接使用Parquet文件尾部的统计信息和解析时生成的列统计(SysDatasetColumn.stats)回答,
+无需下载和扫描数据文件
+"""
+import logging
+import re
+import struct
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select
+
+from core.minio_client import minio_client
+from db.session import async_session
+from models.sys_dataset import SysDataset, SysDatasetColumn
+from services.arrow_utils import fetch_arrow_table, arrow_to_dataframe
+from services.duckdb_engine import duckdb_engine, bind_dataset_sql
+from services.parquet_cache import parquet_cache
+from services.query_executor import query_executor, QueryContext
+
+logger = logging.getLogger(__name__)
+
+# 首次读取的文件尾部长度,绝大多数Parquet元数据都在此范围内
+FOOTER_READ_BYTES = 64 * 1024
+
+# 进程内缓存的文件统计信息条数
+FOOTER_CACHE_SIZE = 256
+
+_IDENTIFIER = r'"(?:[^"]|"")+"|[^\W\d]\w*'
+
+_SIMPLE_AGGREGATE_SQL = re.compile(
+    r'^\s*select\s+(?P<items>.+?)\s+from\s+dataset\s*(?:limit\s+(?P<limit>\d+)\s*)?;?\s*$',
+    re.IGNORECASE | re.DOTALL
+)
+
+_AGGREGATE_ITEM = re.compile(
+    rf'^(?P<func>count|min|max|approx_count_distinct)\s*\(\s*(?P<distinct>distinct\s+)?'
+    rf'(?P<arg>\*|1|{_IDENTIFIER})\s*\)'
+    rf'(?:\s+(?:as\s+)?(?:{_IDENTIFIER}))?$',
+    re.IGNORECASE
+)
+
+# 可以直接使用文件统计信息回答MIN/MAX的列类型
+_MINMAX_TYPES = (
+    pa.types.is_integer,
+    pa.types.is_floating,
+    pa.types.is_string,
+    pa.types.is_large_string,
+    pa.types.is_date,
+    pa.types.is_timestamp,
+    pa.types.is_boolean
+)
+
+_footer_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_footer_cache_lock = threading.Lock()
+
+
+def _unquote(identifier: str) -> str:
+    if identifier.startswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier
+
+
+def _split_select_items(items: str) -> List[str]:
+    """按顶层逗号拆分SELECT列表(忽略引号内的逗号)"""
+    parts = []
+    current = []
+    in_quote = False
+    depth = 0
+    for ch in items:
+        if ch == '"':
+            in_quote = not in_quote
+        elif not in_quote:
+            if ch == '(':
+                depth += 1
+            elif ch == ')':
+                depth -= 1
+            elif ch == ',' and depth == 0:
+                parts.append(''.join(current).strip())
+                current = []
+                continue
+        current.append(ch)
+    parts.append(''.join(current).strip())
+    return parts
+
+
+def parse_simple_aggregate(sql_query: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    识别不带WHERE/GROUP BY的简单聚合SQL
+
+    Args:
+        sql_query: SQL查询语句(表名为 dataset)
+
+    Returns:
+        聚合项列表 [{'func', 'distinct', 'column', 'expression'}],不是简单聚合时返回None
+    """
+    # 带字符串字面量或注释的SQL不做识别
+    if "'" in sql_query or '--' in sql_query or '/*' in sql_query:
+        return None
+
+    match = _SIMPLE_AGGREGATE_SQL.match(sql_query)
+    if not match:
+        return None
+    if match.group('limit') is not None and int(match.group('limit')) < 1:
+        return None
+
+    aggregates = []
+    for item in _split_select_items(match.group('items')):
+        item_match = _AGGREGATE_ITEM.match(item)
+        if not item_match:
+            return None
+
+        func = item_match.group('func').lower()
+        distinct = bool(item_match.group('distinct'))
+        arg = item_match.group('arg')
+
+        if distinct:
+            # 解析时的去重数超过 PARSE_EXACT_DISTINCT_LIMIT 后为估计值,且统计的是清洗前的取值,
+            # 不能回答精确的 COUNT(DISTINCT 列)
+            return None
+
+        if arg in ('*', '1'):
+            # 只支持 COUNT(*) / COUNT(1)
+            if func != 'count':
+                return None
+            column = None
+        else:
+            column = _unquote(arg)
+
+        if func == 'approx_count_distinct':
+            func, distinct = 'count', True
+
+        aggregates.append({
+            'func': func,
+            'distinct': distinct,
+            'column': column,
+            'expression': item
+        })
+
+    return aggregates
+
+
+def _read_footer_metadata(dataset_id: str, object_name: str, version: Optional[str]) -> pq.FileMetaData:
+    """读取Parquet文件元数据: 优先使用本地缓存文件,否则按字节范围从MinIO读取文件尾部"""
+    if version:
+        local_path = parquet_cache.find_local_path(dataset_id, object_name, version)
+        if local_path:
+            return pq.read_metadata(local_path)
+
+    file_stats = minio_client.get_file_stats(object_name)
+    if not file_stats:
+        raise FileNotFoundError(f"Parquet文件不存在: {object_name}")
+    file_size = file_stats['size']
+
+    read_bytes = min(file_size, FOOTER_READ_BYTES)
+    tail = minio_client.download_range(object_name, file_size - read_bytes, read_bytes)
+    if tail[-4:] != b'PAR1':
+        raise ValueError(f"不是有效的Parquet文件: {object_name}")
+
+    footer_length = struct.unpack('<I', tail[-8:-4])[0]
+    if footer_length + 8 > len(tail):
+        tail = minio_client.download_range(
+            object_name, file_size - footer_length - 8, footer_length + 8
+        )
+
+    # 只需要文件尾部: 拼接文件头标识后即可由pyarrow解析元数据
+    return pq.read_metadata(pa.BufferReader(b'PAR1' + tail[-(footer_length + 8):]))
+
+
+def _collect_footer_stats(
+    ctx: QueryContext,
+    dataset_id: str,
+    object_name: str,
+    version: Optional[str]
+) -> Dict[str, Any]:
+    """
+    在查询执行器线程中执行: 汇总各行组的列统计信息
+
+    Returns:
+        {'num_rows': 行数, 'columns': {列名: {'null_count', 'min', 'max', 'has_min_max'}}, 'schema': Arrow Schema}
+    """
+    cache_key = (dataset_id, version)
+    if version:
+        with _footer_cache_lock:
+            cached = _footer_cache.get(cache_key)
+            if cached is not None:
+                _footer_cache.move_to_end(cache_key)
+                return cached
+
+    metadata = _read_footer_metadata(dataset_id, object_name, version)
+    ctx.check_cancelled()
+
+    arrow_schema = metadata.schema.to_arrow_schema()
+    columns = {}
+    for i in range(metadata.num_columns):
+        name = metadata.schema.column(i).path
+        if name not in arrow_schema.names:
+            # 嵌套列不处理
+            continue
+        field_type = arrow_schema.field(name).type
+        column_stats = {
+            'null_count': 0,
+            'min': None,
+            'max': None,
+            'has_min_max': any(check(field_type) for check in _MINMAX_TYPES),
+            'has_null_count': True
+        }
+
+        for rg in range(metadata.num_row_groups):
+            row_group = metadata.row_group(rg)
+            statistics = row_group.column(i).statistics
+            if statistics is None or not statistics.has_null_count:
+                column_stats['has_null_count'] = False
+                column_stats['has_min_max'] = False
+                break
+            column_stats['null_count'] += statistics.null_count
+
+            if statistics.null_count == row_group.num_rows:
+                # 整个行组为空值,不参与MIN/MAX
+                continue
+            if not statistics.has_min_max:
+                column_stats['has_min_max'] = False
+                continue
+            if column_stats['has_min_max']:
+                if column_stats['min'] is None or statistics.min < column_stats['min']:
+                    column_stats['min'] = statistics.min
+                if column_stats['max'] is None or statistics.max > column_stats['max']:
+                    column_stats['max'] = statistics.max
+
+        if column_stats['has_null_count'] and column_stats['null_count'] == metadata.num_rows:
+            # 全部为空值时MIN/MAX均为NULL,与列类型无关
+            column_stats['has_min_max'] = True
+
+        columns[name] = column_stats
+
+    result = {'num_rows': metadata.num_rows, 'columns': columns, 'schema': arrow_schema}
+    if version:
+        with _footer_cache_lock:
+            _footer_cache[cache_key] = result
+            while len(_footer_cache) > FOOTER_CACHE_SIZE:
+                _footer_cache.popitem(last=False)
+    return result
+
+
+def get_parquet_schema(
+    ctx: QueryContext,
+    dataset_id: str,
+    object_name: str,
+    version: Optional[str]
+) -> pa.Schema:
+    """在查询执行器线程中执行: 从文件元数据获取数据集的Arrow Schema(不下载数据)"""
+    return _collect_footer_stats(ctx, dataset_id, object_name, version)['schema']
+
+
+def describe_query_result(cur, schema: pa.Schema, sql_query: str) -> pa.Schema:
+    """
+    对同结构的空表执行查询,得到与真实查询一致的结果列名和类型
+
+    Args:
+        cur: DuckDB游标
+        schema: 数据集的Arrow Schema
+        sql_query: SQL查询语句(表名为 dataset)
+
+    Returns:
+        结果的Arrow Schema
+    """
+    cur.register('metadata_empty', schema.empty_table())
+    try:
+        bound_sql = bind_dataset_sql(sql_query, 'metadata_empty')
+        return fetch_arrow_table(cur.execute(bound_sql)).schema
+    finally:
+        cur.unregister('metadata_empty')
+
+
+def _build_result(
+    ctx: QueryContext,
+    schema: pa.Schema,
+    aggregates: List[Dict[str, Any]],
+    values: List[Any]
+) -> pa.Table:
+    """
+    在查询执行器线程中执行: 按真实查询的结果列名和类型构造单行结果
+    """
+    select_sql = f"SELECT {', '.join(agg['expression'] for agg in aggregates)} FROM dataset"
+    with duckdb_engine.cursor() as cur:
+        ctx.bind_cursor(cur)
+        try:
+            result_schema = describe_query_result(cur, schema, select_sql)
+        finally:
+            ctx.release_cursor()
+
+    arrays = [
+        pa.array([value], type=field.type)
+        for value, field in zip(values, result_schema)
+    ]
+    return pa.Table.from_arrays(arrays, schema=result_schema)
+
+
+def invalidate_footer_stats(dataset_id: str):
+    """清理数据集的文件统计信息缓存"""
+    dataset_id = str(dataset_id)
+    with _footer_cache_lock:
+        for key in [k for k in _footer_cache if k[0] == dataset_id]:
+            _footer_cache.pop(key, None)
+
+
+def _resolve_column(name: str, columns: List[str]) -> Optional[str]:
+    """匹配列名: 优先精确匹配,否则忽略大小写匹配(与DuckDB标识符规则一致)"""
+    if name in columns:
+        return name
+    matches = [col for col in columns if col.lower() == name.lower()]
+    return matches[0] if len(matches) == 1 else None
+
+
+async def get_unique_counts(dataset_id: str) -> Dict[str, Optional[int]]:
+    """读取解析时生成的列去重计数"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(SysDatasetColumn.col_name, SysDatasetColumn.stats)
+            .where(SysDatasetColumn.dataset_id == dataset_id)
+        )
+        return {
+            col_name: (stats or {}).get('unique_count')
+            for col_name, stats in result.all()
+        }
+
+
+async def answer_from_metadata(
+    dataset_info: SysDataset,
+    object_name: str,
+    parquet_version: Optional[str],
+    sql_query: str
+) -> Optional[pd.DataFrame]:
+    """
+    尝试使用统计信息回答简单聚合查询
+
+    - COUNT(*) / COUNT(1): 文件元数据中的行数
+    - COUNT(列): 行数减去空值数
+    - MIN/MAX(列): 各行组统计信息的最小/最大值
+    - APPROX_COUNT_DISTINCT(列): 解析时统计的去重数(可能为估计值)
+
+    Args:
+        dataset_info: 数据集记录
+        object_name: Parquet文件在MinIO中的对象名称
+        parquet_version: Parquet文件版本(ETag)
+        sql_query: SQL查询语句
+
+    Returns:
+        单行结果DataFrame,无法回答时返回None(由调用方执行实际查询)
+    """
+    aggregates = parse_simple_aggregate(sql_query)
+    if not aggregates:
+        return None
+
+    dataset_id = str(dataset_info.id)
+    try:
+        footer = await query_executor.run(
+            _collect_footer_stats, dataset_id, object_name, parquet_version
+        )
+        column_names = list(footer['columns'].keys())
+
+        unique_counts = None
+        if any(agg['distinct'] for agg in aggregates):
+            unique_counts = await get_unique_counts(dataset_info.id)
+
+        values = []
+        for agg in aggregates:
+            if agg['column'] is None:
+                values.append(footer['num_rows'])
+                continue
+
+            column = _resolve_column(agg['column'], column_names)
+            if column is None:
+                # 列不存在时交给DuckDB报错
+                return None
+            column_stats = footer['columns'][column]
+
+            if agg['distinct']:
+                unique_count = unique_counts.get(column) if unique_counts else None
+                if unique_count is None:
+                    return None
+                values.append(unique_count)
+            elif agg['func'] == 'count':
+                if not column_stats['has_null_count']:
+                    return None
+                values.append(footer['num_rows'] - column_stats['null_count'])
+            else:
+                if not column_stats['has_min_max']:
+                    return None
+                values.append(column_stats[agg['func']])
+
+        table = await query_executor.run(_build_result, footer['schema'], aggregates, values)
+        logger.info(f"简单聚合查询由统计信息直接回答: {sql_query}")
+        return arrow_to_dataframe(table)
+
+    except Exception as e:
+        logger.warning(f"统计信息短路查询失败,回退到DuckDB查询: {e}")
+        return None
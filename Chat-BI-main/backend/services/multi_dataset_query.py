@@ -3,18 +3,130 @@
 
 支持用户选择多个数据集进行智能查询
 """
+import asyncio
 import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from typing import List, Dict, Optional, Tuple
 import pandas as pd
-from sqlalchemy import select
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import aliased
 from sqlalchemy.ext.asyncio import AsyncSession
 from models.sys_dataset import SysDataset, SysDatasetColumn
-from services.duckdb_query import query_parquet_with_duckdb
+from core.config import settings
+from services.duckdb_query import query_parquet_with_duckdb, query_datasets_with_duckdb
+from services.embedding_service import get_column_vectors
+from services.join_planner import plan_joins, build_join_clause
+from services.query_result_store import InvalidQueryError, validate_readonly_sql
 from api.utils.ai_utils import call_configured_ai_model
 
 logger = logging.getLogger(__name__)
 
 
+# 每个数据集加载的最大列数
+METADATA_MAX_COLUMNS = 50
+
+# 数据集元数据进程内缓存: dataset_id -> (过期时间, 元数据)
+_metadata_cache: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+_metadata_cache_lock = threading.Lock()
+
+
+def _get_cached_metadata(dataset_id: str) -> Optional[Dict]:
+    with _metadata_cache_lock:
+        entry = _metadata_cache.get(dataset_id)
+        if entry is None:
+            return None
+        expire_at, metadata = entry
+        if expire_at < time.monotonic():
+            _metadata_cache.pop(dataset_id, None)
+            return None
+        _metadata_cache.move_to_end(dataset_id)
+        return metadata
+
+
+def _set_cached_metadata(dataset_id: str, metadata: Dict):
+    if settings.DATASET_METADATA_CACHE_TTL <= 0:
+        return
+    with _metadata_cache_lock:
+        _metadata_cache[dataset_id] = (time.monotonic() + settings.DATASET_METADATA_CACHE_TTL, metadata)
+        _metadata_cache.move_to_end(dataset_id)
+        while len(_metadata_cache) > settings.DATASET_METADATA_CACHE_MAX_ENTRIES:
+            _metadata_cache.popitem(last=False)
+
+
+def invalidate_datasets_metadata(dataset_id: Optional[str] = None):
+    """
+    清理数据集元数据缓存(数据集创建、重新解析、删除时调用)
+
+    Args:
+        dataset_id: 数据集ID,为空时清理全部
+    """
+    with _metadata_cache_lock:
+        if dataset_id is None:
+            _metadata_cache.clear()
+        else:
+            _metadata_cache.pop(str(dataset_id), None)
+
+
+async def _load_datasets_metadata(
+    dataset_ids: List[str],
+    async_session: AsyncSession
+) -> Dict[str, Dict]:
+    """
+    一次查询加载多个数据集及其列信息(每个数据集最多 METADATA_MAX_COLUMNS 列)
+
+    Returns:
+        dataset_id -> 元数据,不存在的数据集不包含在内
+    """
+    column_rank = func.row_number().over(
+        partition_by=SysDatasetColumn.dataset_id,
+        order_by=(SysDatasetColumn.col_index, SysDatasetColumn.id)
+    ).label('column_rank')
+    ranked_columns = (
+        select(SysDatasetColumn, column_rank)
+        .where(SysDatasetColumn.dataset_id.in_(dataset_ids))
+        .subquery()
+    )
+    column_alias = aliased(SysDatasetColumn, ranked_columns)
+
+    result = await async_session.execute(
+        select(SysDataset, column_alias)
+        .outerjoin(
+            column_alias,
+            and_(
+                column_alias.dataset_id == SysDataset.id,
+                ranked_columns.c.column_rank <= METADATA_MAX_COLUMNS
+            )
+        )
+        .where(SysDataset.id.in_(dataset_ids))
+        .order_by(SysDataset.id, ranked_columns.c.column_rank)
+    )
+
+    loaded: Dict[str, Dict] = {}
+    for dataset, col in result.all():
+        dataset_id = str(dataset.id)
+        metadata = loaded.get(dataset_id)
+        if metadata is None:
+            metadata = loaded[dataset_id] = {
+                'id': dataset_id,
+                'name': dataset.name,
+                'logical_name': dataset.logical_name or dataset.name,
+                'row_count': dataset.row_count,
+                'column_count': dataset.column_count,
+                'columns': []
+            }
+        if col is not None:
+            metadata['columns'].append({
+                'col_name': col.col_name,
+                'col_type': col.col_type,
+                'sample_values': col.sample_values if col.sample_values else [],
+                'value_sketch': (col.stats or {}).get('value_sketch')
+            })
+    return loaded
+
+
 async def get_datasets_metadata(
     dataset_ids: List[str],
     async_session: AsyncSession
@@ -22,62 +134,59 @@ async def get_datasets_metadata(
     """
     获取多个数据集的元数据
 
+    优先读取进程内缓存,未命中的数据集用一次批量查询加载
+
     Args:
         dataset_ids: 数据集ID列表
         async_session: 数据库会话
 
     Returns:
-        数据集元数据列表，每个包含：
+        数据集元数据列表(与 dataset_ids 顺序一致)，每个包含：
         - id: 数据集ID
         - name: 数据集名称
         - logical_name: 逻辑名称
         - columns: 列信息列表
     """
-    datasets_metadata = []
-
+    # 统一为标准UUID格式并去重,保持原顺序
+    normalized_ids: List[str] = []
     for dataset_id in dataset_ids:
         try:
-            # 查询数据集信息
-            result = await async_session.execute(
-                select(SysDataset).where(SysDataset.id == dataset_id)
-            )
-            dataset = result.scalar_one_or_none()
+            normalized_ids.append(str(uuid.UUID(str(dataset_id))))
+        except ValueError:
+            logger.warning(f"数据集ID无效: {dataset_id}")
+    normalized_ids = list(dict.fromkeys(normalized_ids))
+
+    found: Dict[str, Dict] = {}
+    missing: List[str] = []
+    for dataset_id in normalized_ids:
+        metadata = _get_cached_metadata(dataset_id)
+        if metadata is not None:
+            found[dataset_id] = metadata
+        else:
+            missing.append(dataset_id)
 
-            if not dataset:
+    if missing:
+        try:
+            loaded = await _load_datasets_metadata(missing, async_session)
+        except Exception as e:
+            logger.error(f"获取数据集元数据失败 {missing}: {e}")
+            loaded = {}
+
+        for dataset_id in missing:
+            metadata = loaded.get(dataset_id)
+            if metadata is None:
                 logger.warning(f"数据集不存在: {dataset_id}")
                 continue
-
-            # 查询数据集的列信息
-            columns_result = await async_session.execute(
-                select(SysDatasetColumn).where(
-                    SysDatasetColumn.dataset_id == dataset_id
-                ).limit(50)  # 限制列数
-            )
-            columns = columns_result.scalars().all()
-
-            # 构建元数据
-            metadata = {
-                'id': str(dataset.id),
-                'name': dataset.name,
-                'logical_name': dataset.logical_name or dataset.name,
-                'row_count': dataset.row_count,
-                'column_count': dataset.column_count,
-                'columns': [
-                    {
-                        'col_name': col.col_name,
-                        'col_type': col.col_type,
-                        'sample_values': col.sample_values if col.sample_values else []
-                    }
-                    for col in columns
-                ]
-            }
-
-            datasets_metadata.append(metadata)
+            _set_cached_metadata(dataset_id, metadata)
+            found[dataset_id] = metadata
             logger.info(f"加载数据集元数据: {metadata['logical_name']} ({len(metadata['columns'])}列)")
 
-        except Exception as e:
-            logger.error(f"获取数据集元数据失败 {dataset_id}: {e}")
-            continue
+    # 浅拷贝,避免调用方修改缓存内容
+    datasets_metadata = [
+        {**found[dataset_id], 'columns': list(found[dataset_id]['columns'])}
+        for dataset_id in normalized_ids
+        if dataset_id in found
+    ]
 
     return datasets_metadata
 
@@ -297,9 +406,113 @@ SELECT ...
     return sql_queries
 
 
+async def generate_joined_sql(
+    user_query: str,
+    datasets_metadata: List[Dict],
+    join_plan: List[Dict],
+    user_id: int = 1
+) -> Optional[str]:
+    """
+    按连接规划生成一条跨数据集查询SQL
+
+    Args:
+        user_query: 用户问题
+        datasets_metadata: 数据集元数据列表,SQL中依次用 dataset_1, dataset_2 ... 引用
+        join_plan: plan_joins 返回的连接步骤
+        user_id: 用户ID
+
+    Returns:
+        SQL查询,生成失败返回None
+    """
+    schema_sections = []
+    for idx, dataset in enumerate(datasets_metadata, 1):
+        col_descriptions = []
+        for col in dataset['columns'][:20]:
+            samples = col.get('sample_values', [])
+            sample_str = ', '.join([str(s) for s in samples[:3]]) if samples else ''
+            col_desc = f"- t{idx}.\"{col['col_name']}\" ({col.get('col_type', 'unknown')})"
+            if sample_str:
+                col_desc += f" - 示例: {sample_str}"
+            col_descriptions.append(col_desc)
+        schema_sections.append(
+            f"**t{idx}: {dataset['logical_name']}** (dataset_{idx}, {dataset['row_count']}行)\n"
+            + '\n'.join(col_descriptions)
+        )
+
+    schema_context = '\n\n'.join(schema_sections)
+    join_clause = build_join_clause(join_plan)
+
+    system_prompt = f"""你是一个专业的SQL查询生成助手。根据用户问题和多个数据集的schema生成一条DuckDB SQL查询。
+
+**数据集Schema:**
+{schema_context}
+
+**已确定的表连接(必须原样使用):**
+```sql
+{join_clause}
+```
+
+**重要规则:**
+1. 必须使用上面给出的 FROM/JOIN 子句,不要修改连接条件,不要增加其他表
+2. 列名必须带表别名并用双引号包裹,如 t1."column_name"
+3. 只能使用提供的列名,不要编造列名
+4. 过滤条件直接写在WHERE中并引用所属表的别名,DuckDB会把它下推到对应数据集的扫描
+5. 涉及明细时先聚合,查询结果限制在100行以内
+6. 不要使用注释,只生成一条SQL语句
+
+**用户问题:** {user_query}
+
+请生成SQL查询,使用以下格式返回:
+```sql
+SELECT ...
+```
+"""
+
+    try:
+        ai_response = await call_configured_ai_model(system_prompt, user_query, user_id=user_id)
+        if not ai_response:
+            return None
+
+        sql_start = ai_response.find("```sql")
+        if sql_start == -1:
+            return None
+        sql_start += len("```sql")
+        sql_end = ai_response.find("```", sql_start)
+        sql_query = ai_response[sql_start:sql_end if sql_end != -1 else None].strip()
+
+        sql_query = validate_readonly_sql(sql_query)
+        if 'dataset_' not in sql_query.lower():
+            logger.warning(f"跨数据集SQL未引用数据集: {sql_query[:100]}")
+            return None
+
+        logger.info(f"生成跨数据集SQL: {sql_query[:200]}...")
+        return sql_query
+
+    except InvalidQueryError as e:
+        logger.warning(f"跨数据集SQL校验失败: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"生成跨数据集SQL失败: {e}")
+        return None
+
+
+async def _query_joined(dataset_ids: List[str], joined_sql: str) -> Optional[pd.DataFrame]:
+    """执行跨数据集查询,失败或结果为空返回None"""
+    try:
+        df = await query_datasets_with_duckdb(dataset_ids, joined_sql)
+        if df is not None and not df.empty:
+            logger.info(f"跨数据集查询成功: {len(df)} 行")
+            return df
+        logger.warning("跨数据集查询返回空结果")
+    except Exception as e:
+        logger.error(f"跨数据集查询失败: {e}")
+    return None
+
+
 async def query_multiple_datasets(
     dataset_ids: List[str],
-    sql_queries: Dict[str, str]
+    sql_queries: Dict[str, str],
+    joined_sql: Optional[str] = None
 ) -> Optional[pd.DataFrame]:
     """
     查询多个数据集并合并结果
@@ -307,31 +520,43 @@ async def query_multiple_datasets(
     Args:
         dataset_ids: 数据集ID列表
         sql_queries: 数据集ID到SQL查询的映射
+        joined_sql: 跨数据集查询SQL(依次用 dataset_1, dataset_2 ... 引用各数据集),
+                    提供时在同一DuckDB引擎中执行一条查询,失败再回退到逐个查询
 
     Returns:
         合并后的DataFrame，如果所有查询都失败则返回None
     """
-    dfs = []
+    if joined_sql and len(dataset_ids) > 1:
+        df = await _query_joined(dataset_ids, joined_sql)
+        if df is not None:
+            return df
+        logger.warning("回退到逐个查询")
 
-    for dataset_id in dataset_ids:
+    semaphore = asyncio.Semaphore(settings.MULTI_DATASET_QUERY_CONCURRENCY)
+
+    async def query_one(dataset_id: str) -> Optional[pd.DataFrame]:
         sql_query = sql_queries.get(dataset_id)
         if not sql_query:
             logger.warning(f"数据集 {dataset_id} 没有对应的SQL查询")
-            continue
+            return None
 
         try:
-            df = await query_parquet_with_duckdb(dataset_id, sql_query)
+            async with semaphore:
+                df = await query_parquet_with_duckdb(dataset_id, sql_query)
             if df is not None and not df.empty:
                 # 添加数据集来源列
                 df['_source_dataset'] = dataset_id
-                dfs.append(df)
                 logger.info(f"数据集 {dataset_id} 查询成功: {len(df)} 行")
-            else:
-                logger.warning(f"数据集 {dataset_id} 查询返回空结果")
+                return df
+            logger.warning(f"数据集 {dataset_id} 查询返回空结果")
 
         except Exception as e:
             logger.error(f"查询数据集 {dataset_id} 失败: {e}")
-            continue
+        return None
+
+    # 各数据集并发查询(受并发上限约束),总耗时取决于最慢的一个
+    results = await asyncio.gather(*(query_one(dataset_id) for dataset_id in dataset_ids))
+    dfs = [df for df in results if df is not None]
 
     if not dfs:
         logger.error("所有数据集查询都失败")
@@ -367,8 +592,8 @@ async def smart_multi_dataset_query(
     完整流程：
     1. 获取所有数据集的元数据
     2. 使用LLM选择与问题相关的数据集
-    3. 为每个选中的数据集生成SQL查询
-    4. 执行查询并合并结果
+    3. 选中多个数据集时规划连接键,生成并执行一条跨数据集JOIN查询
+    4. 无法连接时为每个数据集生成SQL查询,执行并合并结果
 
     Args:
         user_query: 用户问题
@@ -403,20 +628,42 @@ async def smart_multi_dataset_query(
     ]
 
     logger.info(f"选中 {len(selected_metadata)} 个数据集进行查询")
+    selected_ids = [ds['id'] for ds in selected_metadata]
+
+    # 步骤3: 多个数据集之间能找到连接键时,生成并执行一条JOIN查询
+    df = None
+    if settings.JOIN_PLANNER_ENABLED and len(selected_metadata) > 1:
+        column_vectors = {}
+        for dataset_id in selected_ids:
+            vectors = await get_column_vectors(dataset_id)
+            column_vectors.update({(dataset_id, col_name): vector for col_name, vector in vectors.items()})
+
+        join_plan = plan_joins(selected_metadata, column_vectors)
+        if join_plan:
+            logger.info("连接规划: " + ', '.join(
+                f"dataset_{step['left'] + 1}.{step['left_column']} = "
+                f"dataset_{step['right'] + 1}.{step['right_column']} ({step['score']:.2f})"
+                for step in join_plan
+            ))
+            joined_sql = await generate_joined_sql(user_query, selected_metadata, join_plan, user_id)
+            if joined_sql:
+                df = await _query_joined(selected_ids, joined_sql)
+        else:
+            logger.info("未找到数据集之间的连接键,逐个查询")
 
-    # 步骤3: 生成SQL查询
-    sql_queries = await generate_sql_for_multi_datasets(
-        user_query,
-        selected_metadata,
-        user_id
-    )
+    if df is None:
+        # 步骤4: 为每个选中的数据集生成SQL查询,执行并合并结果
+        sql_queries = await generate_sql_for_multi_datasets(
+            user_query,
+            selected_metadata,
+            user_id
+        )
 
-    if not sql_queries:
-        logger.error("未能生成任何SQL查询")
-        return None, "无法生成查询语句"
+        if not sql_queries:
+            logger.error("未能生成任何SQL查询")
+            return None, "无法生成查询语句"
 
-    # 步骤4: 执行查询并合并结果
-    df = await query_multiple_datasets(selected_ids, sql_queries)
+        df = await query_multiple_datasets(selected_ids, sql_queries)
 
     # 构建数据源描述
     dataset_names = [ds['logical_name'] for ds in selected_metadata]
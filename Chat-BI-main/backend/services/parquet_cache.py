@@ -0,0 +1,187 @@
+"""
+Parquet本地磁盘缓存
+按 数据集ID + 文件版本(ETag) 缓存MinIO中的Parquet文件,重复查询直接读取本地磁盘
+"""
+import glob
+import hashlib
+import logging
+import os
+import re
+import threading
+from typing import Optional
+
+from core.config import settings
+from core.minio_client import minio_client
+
+logger = logging.getLogger(__name__)
+
+
+class ParquetCache:
+    """
+    磁盘LRU缓存
+
+    - 缓存文件名: {dataset_id}__{对象名哈希}__{版本}.parquet
+    - 容量按总字节数限制,以文件修改时间作为LRU依据(命中时刷新)
+    - 状态完全由缓存目录决定,多个worker进程可共享同一目录
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _normalize_version(version: str) -> str:
+        """ETag可能带引号或'-分片数'后缀,只保留文件名安全字符"""
+        return re.sub(r'[^0-9A-Za-z]', '', str(version))
+
+    def _cache_path(self, dataset_id: str, object_name: str, version: str) -> str:
+        name_hash = hashlib.md5(object_name.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.cache_dir, f"{dataset_id}__{name_hash}__{version}.parquet")
+
+    def _get_key_lock(self, path: str) -> threading.Lock:
+        """同一缓存文件只允许一个线程下载"""
+        with self._lock:
+            lock = self._key_locks.get(path)
+            if lock is None:
+                lock = threading.Lock()
+                self._key_locks[path] = lock
+            return lock
+
+    def _drop_key_lock(self, path: str):
+        """缓存文件删除后释放对应的锁,避免锁表随缓存文件数无限增长(正在使用的锁保留)"""
+        with self._lock:
+            lock = self._key_locks.get(path)
+            if lock is not None and not lock.locked():
+                del self._key_locks[path]
+
+    def get_local_path(
+        self,
+        dataset_id: str,
+        object_name: str,
+        version: Optional[str] = None
+    ) -> str:
+        """
+        获取Parquet文件的本地路径,未命中时从MinIO下载
+
+        Args:
+            dataset_id: 数据集ID
+            object_name: MinIO对象名称,如 parquet/xxx.parquet
+            version: 文件版本(ETag),为空时通过stat_object获取
+
+        Returns:
+            本地Parquet文件路径
+        """
+        if not version:
+            file_stats = minio_client.get_file_stats(object_name)
+            if not file_stats:
+                raise FileNotFoundError(f"Parquet文件不存在: {object_name}")
+            version = file_stats['etag']
+
+        path = self._cache_path(dataset_id, object_name, self._normalize_version(version))
+
+        with self._get_key_lock(path):
+            if os.path.exists(path):
+                # 刷新修改时间,作为LRU访问记录
+                try:
+                    os.utime(path, None)
+                except OSError:
+                    pass
+                logger.debug(f"Parquet缓存命中: {path}")
+                return path
+
+            # 同一对象的旧版本已失效,直接清理
+            self._remove_stale_versions(path)
+
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            try:
+                minio_client.download_to_file(object_name, tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    try:
+                        os.unlink(tmp_path)
+                    except OSError:
+                        pass
+
+            logger.info(f"Parquet文件已缓存到本地: {path} ({os.path.getsize(path)} bytes)")
+
+        self._evict(keep=path)
+        return path
+
+    def find_local_path(self, dataset_id: str, object_name: str, version: str) -> Optional[str]:
+        """
+        仅检查本地缓存,不触发下载
+
+        Returns:
+            已缓存的本地路径,未缓存返回None
+        """
+        path = self._cache_path(dataset_id, object_name, self._normalize_version(version))
+        return path if os.path.exists(path) else None
+
+    def _remove_stale_versions(self, path: str):
+        """删除同一数据集同一对象的其他版本"""
+        prefix = os.path.basename(path).rsplit('__', 1)[0]
+        for stale in glob.glob(os.path.join(self.cache_dir, f"{glob.escape(prefix)}__*.parquet")):
+            if stale != path:
+                self._remove_file(stale)
+
+    def _evict(self, keep: Optional[str] = None):
+        """超出容量时按最久未访问顺序淘汰"""
+        entries = []
+        total_size = 0
+        for path in glob.glob(os.path.join(self.cache_dir, "*.parquet")):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        if total_size <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            if self._remove_file(path):
+                total_size -= size
+                logger.info(f"Parquet缓存淘汰: {path}")
+
+    def _remove_file(self, path: str) -> bool:
+        try:
+            os.unlink(path)
+            self._drop_key_lock(path)
+            return True
+        except OSError as e:
+            # Windows下文件被占用时无法删除,下次淘汰时再处理
+            logger.debug(f"删除缓存文件失败: {path}, {e}")
+            return False
+
+    def invalidate(self, dataset_id: str) -> int:
+        """
+        删除数据集的全部本地缓存(数据集删除或重新解析时调用)
+
+        Args:
+            dataset_id: 数据集ID
+
+        Returns:
+            删除的文件数
+        """
+        removed = 0
+        pattern = os.path.join(self.cache_dir, f"{glob.escape(str(dataset_id))}__*.parquet")
+        for path in glob.glob(pattern):
+            if self._remove_file(path):
+                removed += 1
+        if removed:
+            logger.info(f"已清理数据集 {dataset_id} 的Parquet缓存: {removed} 个文件")
+        return removed
+
+
+# 全局单例
+parquet_cache = ParquetCache(settings.PARQUET_CACHE_DIR, settings.PARQUET_CACHE_MAX_BYTES)
@@ -0,0 +1,137 @@
+"""
+数据集处理进度上报
+解析/分片/向量化过程中的进度更新先在内存中合并,按时间或进度变化节流后发布到Redis
+(SSE进度流 /api/progress/{dataset_id}:{stage} 实时推送,状态接口读取最新值),
+只在检查点写入 SysDataset,避免逐列提交数据库
+"""
+import json
+import logging
+import time
+from typing import Dict
+
+from api.dependencies.dependencies import redis_client
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 阶段 -> SysDataset 的进度字段
+PROGRESS_COLUMNS = {
+    'parse': 'parse_progress',
+    'chunk': 'chunk_progress',
+    'vectorize': 'vectorize_progress',
+    'embedding': 'embedding_progress',
+}
+
+# 进度记录的保留时间(秒)
+PROGRESS_TTL = 300
+
+
+def progress_task_id(dataset_id: str, stage: str) -> str:
+    """进度流使用的任务ID"""
+    return f"{dataset_id}:{stage}"
+
+
+class DatasetProgressReporter:
+    """
+    单个数据集单个阶段的进度上报
+
+    - update: 距上次发布超过 PROGRESS_PUBLISH_INTERVAL 秒或进度增加 PROGRESS_PUBLISH_STEP 以上时发布;
+      距上次持久化超过 PROGRESS_CHECKPOINT_INTERVAL 秒或进度增加 PROGRESS_CHECKPOINT_STEP 以上时写入数据库
+    - checkpoint: 立即发布,并写入数据库(调用方已在自己的事务中写入时传 persist=False)
+    """
+
+    def __init__(self, dataset_id: str, stage: str):
+        self.dataset_id = str(dataset_id)
+        self.stage = stage
+        self.progress = 0
+        self._published = -1
+        self._published_at = 0.0
+        self._persisted = 0
+        self._persisted_at = time.monotonic()
+
+    async def update(self, progress: int, message: str = ""):
+        progress = int(progress)
+        if progress <= self.progress and self._published >= 0:
+            return
+        self.progress = max(self.progress, progress)
+
+        now = time.monotonic()
+        if (self.progress - self._published >= settings.PROGRESS_PUBLISH_STEP
+                or now - self._published_at >= settings.PROGRESS_PUBLISH_INTERVAL):
+            await self._publish(message)
+
+        if (self.progress - self._persisted >= settings.PROGRESS_CHECKPOINT_STEP
+                or now - self._persisted_at >= settings.PROGRESS_CHECKPOINT_INTERVAL):
+            await self._persist()
+
+    async def checkpoint(self, progress: int, message: str = "", persist: bool = True):
+        self.progress = int(progress)
+        await self._publish(message)
+        if persist:
+            await self._persist()
+        else:
+            self._persisted, self._persisted_at = self.progress, time.monotonic()
+
+    async def fail(self, error: str):
+        """发布失败信息(状态由调用方写入数据库)"""
+        await self._publish(error=error)
+
+    async def _publish(self, message: str = "", error: str = ""):
+        self._published, self._published_at = self.progress, time.monotonic()
+        # 与 progress_stream.ProgressManager 的存储键、频道和消息格式一致
+        task_id = progress_task_id(self.dataset_id, self.stage)
+        progress_data = json.dumps({
+            "task_id": task_id,
+            "step": self.stage,
+            "progress": self.progress,
+            "message": message,
+            "error": error,
+            "timestamp": time.time()
+        })
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.setex(f"progress:{task_id}", PROGRESS_TTL, progress_data)
+                pipe.publish(f"progress_channel:{task_id}", progress_data)
+                await pipe.execute()
+        except Exception as e:
+            # 进度推送失败不影响任务本身
+            logger.warning(f"发布进度失败: {self.dataset_id} {self.stage}: {e}")
+
+    async def _persist(self):
+        from db.session import async_session
+        from models.sys_dataset import SysDataset
+        from sqlalchemy import update
+
+        self._persisted, self._persisted_at = self.progress, time.monotonic()
+        try:
+            async with async_session() as session:
+                await session.execute(
+                    update(SysDataset)
+                    .where(SysDataset.id == self.dataset_id)
+                    .values({PROGRESS_COLUMNS[self.stage]: self.progress})
+                )
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"保存进度失败: {self.dataset_id} {self.stage}: {e}")
+
+
+async def get_live_progress(dataset_id: str) -> Dict[str, int]:
+    """
+    读取各阶段最近发布的进度(比数据库中的检查点新)
+
+    Returns:
+        {阶段: 进度},没有进行中的阶段时为空
+    """
+    stages = list(PROGRESS_COLUMNS)
+    try:
+        values = await redis_client.mget(
+            [f"progress:{progress_task_id(dataset_id, stage)}" for stage in stages]
+        )
+    except Exception as e:
+        logger.warning(f"读取实时进度失败: {dataset_id}: {e}")
+        return {}
+    return {
+        stage: json.loads(value)['progress']
+        for stage, value in zip(stages, values)
+        if value
+    }
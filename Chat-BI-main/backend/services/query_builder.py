@@ -0,0 +1,160 @@
+"""
+数据集查询构建器
+将结构化的查询条件构建为参数化SQL(使用 $1, $2... 占位符),
+只有查询"形状"(列、条件结构)决定SQL文本,过滤值全部作为参数传入,便于复用预编译语句
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+# 比较运算符
+_COMPARISON_OPERATORS = {
+    'eq': '=',
+    'ne': '<>',
+    'gt': '>',
+    'gte': '>=',
+    'lt': '<',
+    'lte': '<=',
+    'like': 'LIKE',
+    'not_like': 'NOT LIKE',
+    'ilike': 'ILIKE'
+}
+
+SUPPORTED_FILTER_OPERATORS = set(_COMPARISON_OPERATORS) | {'in', 'not_in', 'between', 'is_null'}
+
+
+def quote_identifier(name: str) -> str:
+    """列名加双引号(转义内部双引号)"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _in_list_size(count: int) -> int:
+    """
+    IN列表的占位符数量按2的幂取整,不足部分用最后一个值补齐,
+    使不同长度的列表共享少量SQL形状
+    """
+    size = 1
+    while size < count:
+        size *= 2
+    return size
+
+
+class _ParamList:
+    """收集参数并生成占位符"""
+
+    def __init__(self):
+        self.values: List[Any] = []
+
+    def add(self, value: Any) -> str:
+        self.values.append(value)
+        return f"${len(self.values)}"
+
+
+def _build_condition(column: str, operator: str, value: Any, params: _ParamList) -> str:
+    col = quote_identifier(column)
+
+    if operator == 'is_null':
+        return f"{col} IS NULL" if value else f"{col} IS NOT NULL"
+
+    if operator in ('in', 'not_in'):
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        if not values:
+            # 空列表: IN 恒为假, NOT IN 恒为真
+            return 'FALSE' if operator == 'in' else 'TRUE'
+        values += [values[-1]] * (_in_list_size(len(values)) - len(values))
+        placeholders = ', '.join(params.add(v) for v in values)
+        keyword = 'IN' if operator == 'in' else 'NOT IN'
+        return f"{col} {keyword} ({placeholders})"
+
+    if operator == 'between':
+        if not isinstance(value, (list, tuple)) or len(value) != 2:
+            raise ValueError(f"between 条件需要两个值: {column}")
+        return f"{col} BETWEEN {params.add(value[0])} AND {params.add(value[1])}"
+
+    if operator not in _COMPARISON_OPERATORS:
+        raise ValueError(f"不支持的过滤运算符: {operator}")
+    if value is None:
+        if operator == 'eq':
+            return f"{col} IS NULL"
+        if operator == 'ne':
+            return f"{col} IS NOT NULL"
+        raise ValueError(f"{operator} 条件的值不能为空: {column}")
+    return f"{col} {_COMPARISON_OPERATORS[operator]} {params.add(value)}"
+
+
+def build_filter_conditions(filters: Dict[str, Any], params: _ParamList) -> List[str]:
+    """
+    构建WHERE条件
+
+    filters 格式:
+        {"城市": "北京"}                          等值
+        {"城市": None}                            IS NULL
+        {"城市": ["北京", "上海"]}                 IN
+        {"金额": {"gte": 100, "lt": 500}}          范围(多个运算符为AND关系)
+        {"日期": {"between": ["2024-01-01", "2024-06-30"]}}
+        {"名称": {"like": "%手机%"}}
+        {"城市": {"not_in": ["北京"]}}
+
+    Raises:
+        ValueError: 不支持的运算符或参数格式
+    """
+    conditions = []
+    for column, spec in filters.items():
+        if isinstance(spec, dict):
+            if not spec:
+                raise ValueError(f"过滤条件为空: {column}")
+            for operator, value in spec.items():
+                if operator not in SUPPORTED_FILTER_OPERATORS:
+                    raise ValueError(f"不支持的过滤运算符: {operator}")
+                conditions.append(_build_condition(column, operator, value, params))
+        elif isinstance(spec, (list, tuple, set)):
+            conditions.append(_build_condition(column, 'in', spec, params))
+        else:
+            conditions.append(_build_condition(column, 'eq', spec, params))
+    return conditions
+
+
+def build_dataset_query(
+    columns: Optional[List[str]] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    group_by: Optional[List[str]] = None,
+    order_by: Optional[List[str]] = None,
+    limit: Optional[int] = 1000
+) -> Tuple[str, List[Any]]:
+    """
+    构建参数化的数据集查询
+
+    Args:
+        columns: 查询的列名列表,None表示所有列
+        filters: 过滤条件,格式见 build_filter_conditions
+        group_by: 分组列
+        order_by: 排序列,列名前加 "-" 表示降序
+        limit: 最大返回行数
+
+    Returns:
+        (SQL模板, 参数列表),SQL中的表名为 dataset
+    """
+    params = _ParamList()
+
+    cols_str = ', '.join(quote_identifier(col) for col in columns) if columns else '*'
+    sql_parts = [f"SELECT {cols_str} FROM dataset"]
+
+    if filters:
+        conditions = build_filter_conditions(filters, params)
+        if conditions:
+            sql_parts.append("WHERE " + " AND ".join(conditions))
+
+    if group_by:
+        sql_parts.append("GROUP BY " + ', '.join(quote_identifier(col) for col in group_by))
+
+    if order_by:
+        order_items = []
+        for col in order_by:
+            if col.startswith('-'):
+                order_items.append(f"{quote_identifier(col[1:])} DESC")
+            else:
+                order_items.append(quote_identifier(col))
+        sql_parts.append("ORDER BY " + ', '.join(order_items))
+
+    if limit:
+        sql_parts.append(f"LIMIT {params.add(int(limit))}")
+
+    return ' '.join(sql_parts), params.values
@@ -0,0 +1,205 @@
+"""
+DuckDB查询执行器
+将阻塞的下载和查询工作放到独立线程池执行,避免阻塞asyncio事件循环
+支持排队上限、单查询超时、取消(中断DuckDB游标)和队列指标
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class QueryQueueFullError(Exception):
+    """查询排队数超过上限"""
+    pass
+
+
+class QueryTimeoutError(TimeoutError):
+    """查询执行超时"""
+    pass
+
+
+class QueryCancelledError(Exception):
+    """查询已被取消"""
+    pass
+
+
+class QueryContext:
+    """
+    单次查询的执行上下文
+
+    工作线程借用DuckDB游标后绑定到上下文,超时或取消时通过游标中断正在执行的查询
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._cursor = None
+        self._lock = threading.Lock()
+
+    def bind_cursor(self, cursor):
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelledError("查询已被取消")
+            self._cursor = cursor
+
+    def release_cursor(self):
+        with self._lock:
+            self._cursor = None
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise QueryCancelledError("查询已被取消")
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._cursor is not None:
+                try:
+                    self._cursor.interrupt()
+                except Exception as e:
+                    logger.warning(f"中断DuckDB查询失败: {e}")
+
+
+class QueryExecutor:
+    """有界线程池查询执行器"""
+
+    def __init__(self, max_workers: int, max_queue: int, default_timeout: float):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="duckdb-query"
+        )
+        self._stats_lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'timed_out': 0,
+            'cancelled': 0,
+            'rejected': 0,
+            'max_queue_depth': 0,
+            'total_wait_ms': 0.0,
+            'total_run_ms': 0.0
+        }
+
+    def _execute(self, ctx: QueryContext, func: Callable, args: tuple, submitted_at: float):
+        """工作线程中执行查询"""
+        started_at = time.monotonic()
+        with self._stats_lock:
+            self._queued -= 1
+            self._running += 1
+            self._stats['total_wait_ms'] += (started_at - submitted_at) * 1000
+
+        try:
+            ctx.check_cancelled()
+            return func(ctx, *args)
+        finally:
+            with self._stats_lock:
+                self._running -= 1
+                self._stats['total_run_ms'] += (time.monotonic() - started_at) * 1000
+
+    async def run(self, func: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """
+        在线程池中执行查询函数
+
+        Args:
+            func: 同步函数,第一个参数为QueryContext
+            *args: 其余参数
+            timeout: 超时时间(秒),默认使用配置值
+
+        Returns:
+            func的返回值
+
+        Raises:
+            QueryQueueFullError: 排队已满
+            QueryTimeoutError: 执行超时
+        """
+        timeout = timeout or self.default_timeout
+
+        with self._stats_lock:
+            if self._queued >= self.max_queue:
+                self._stats['rejected'] += 1
+                raise QueryQueueFullError(f"查询排队已满({self.max_queue}),请稍后重试")
+            self._queued += 1
+            self._stats['submitted'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self._queued)
+
+        ctx = QueryContext()
+        future = self._executor.submit(self._execute, ctx, func, args, time.monotonic())
+
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._abort(ctx, future)
+            with self._stats_lock:
+                self._stats['timed_out'] += 1
+            logger.warning(f"DuckDB查询超时({timeout}s),已中断")
+            raise QueryTimeoutError(f"查询超时({timeout}s)")
+        except asyncio.CancelledError:
+            self._abort(ctx, future)
+            with self._stats_lock:
+                self._stats['cancelled'] += 1
+            raise
+        except Exception:
+            with self._stats_lock:
+                self._stats['failed'] += 1
+            raise
+
+        with self._stats_lock:
+            self._stats['completed'] += 1
+        return result
+
+    def _abort(self, ctx: QueryContext, future):
+        """取消未开始的任务,中断已开始的查询"""
+        ctx.cancel()
+        if future.cancel():
+            # 任务尚未开始执行,由这里扣减排队数
+            with self._stats_lock:
+                self._queued -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取执行器指标"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            queued = self._queued
+            running = self._running
+
+        started = stats['completed'] + stats['failed'] + stats['timed_out'] + stats['cancelled']
+        return {
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'default_timeout': self.default_timeout,
+            'queue_depth': queued,
+            'running': running,
+            'submitted': stats['submitted'],
+            'completed': stats['completed'],
+            'failed': stats['failed'],
+            'timed_out': stats['timed_out'],
+            'cancelled': stats['cancelled'],
+            'rejected': stats['rejected'],
+            'max_queue_depth': stats['max_queue_depth'],
+            'avg_wait_ms': stats['total_wait_ms'] / started if started else 0.0,
+            'avg_run_ms': stats['total_run_ms'] / started if started else 0.0
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局单例
+query_executor = QueryExecutor(
+    max_workers=settings.QUERY_EXECUTOR_WORKERS,
+    max_queue=settings.QUERY_EXECUTOR_MAX_QUEUE,
+    default_timeout=settings.QUERY_TIMEOUT_SECONDS
+)
@@ -0,0 +1,274 @@
+"""
+查询准入检查
+执行LLM生成的SQL前先用 EXPLAIN 获取DuckDB查询计划,估算各算子的行数和代价,
+拒绝笛卡尔积、超大连接和无界排序等高代价查询,必要时为缺少顶层LIMIT的查询补充LIMIT
+"""
+import json
+import logging
+import math
+import re
+from typing import Any, Dict, List, Optional
+
+import duckdb
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 逐行两两比较的连接算子: 代价为两侧行数之积
+_PRODUCT_JOINS = {'CROSS_PRODUCT', 'NESTED_LOOP_JOIN', 'BLOCKWISE_NL_JOIN'}
+
+# 需要对全部输入排序的算子: 代价为 n*log2(n)
+_SORT_OPERATORS = {'ORDER_BY', 'WINDOW'}
+
+# 限制输出行数的算子
+_LIMIT_OPERATORS = {'TOP_N', 'LIMIT', 'STREAMING_LIMIT', 'LIMIT_PERCENT'}
+
+# 查询计划顶层可能出现的、不改变行数的算子
+_PASSTHROUGH_OPERATORS = {'PROJECTION', 'FILTER', 'RESULT_COLLECTOR', 'ORDER_BY'}
+
+# 分组聚合算子: 输出行数不超过分组键的组合数
+_GROUP_OPERATORS = {'HASH_GROUP_BY', 'PERFECT_HASH_GROUP_BY'}
+
+# 计划中对下层输出列的引用,如 #0、__internal_decompress_integral_bigint(#1, 0)
+_COLUMN_REFERENCE = re.compile(r'#(\d+)|__internal_\w+\(#(\d+)(?:, [^)]*)?\)')
+_COLUMN_NAME = re.compile(r'"([^"]+)"|(\w+)')
+
+
+class QueryRejectedError(Exception):
+    """查询计划代价过高,被准入检查拒绝(消息中包含可反馈给LLM的修改建议)"""
+    pass
+
+
+def explain_plan(cur, sql_query: str) -> Dict[str, Any]:
+    """
+    获取查询计划(JSON格式)
+
+    Args:
+        cur: DuckDB游标
+        sql_query: 已绑定视图名的SQL
+
+    Returns:
+        计划根节点 {'name', 'children', 'extra_info'}
+    """
+    rows = cur.execute(f"EXPLAIN (FORMAT JSON) {sql_query}").fetchall()
+    plan = json.loads(rows[0][1])
+    return plan[0] if isinstance(plan, list) else plan
+
+
+def _estimated_rows(node: Dict[str, Any]) -> Optional[float]:
+    value = (node.get('extra_info') or {}).get('Estimated Cardinality')
+    try:
+        rows = float(value)
+    except (TypeError, ValueError):
+        return None
+    return rows if rows > 0 else None
+
+
+def _derived_rows(node: Dict[str, Any], child_rows: List[float]) -> float:
+    """没有基数估计的算子按子节点推算行数"""
+    name = node.get('name', '').strip().upper()
+    extra_info = node.get('extra_info') or {}
+    if name == 'TOP_N':
+        try:
+            return float(extra_info.get('Top', 0)) + float(extra_info.get('Offset', 0))
+        except (TypeError, ValueError):
+            pass
+    if extra_info.get('Join Type') in ('SEMI', 'ANTI', 'MARK'):
+        # 延迟物化的Top-N会表现为 原表 SEMI JOIN Top-N
+        return min(child_rows, default=1)
+    return max(child_rows, default=1)
+
+
+def _as_list(value) -> List[str]:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _resolve_column(node: Dict[str, Any], index: int) -> Optional[str]:
+    """沿投影链将算子输出的第 index 列解析为原始列名,无法解析(表达式、连接等)时返回None"""
+    while True:
+        name = node.get('name', '').strip().upper()
+        children = node.get('children') or []
+        if name == 'FILTER' and len(children) == 1:
+            node = children[0]
+            continue
+
+        projections = _as_list((node.get('extra_info') or {}).get('Projections'))
+        if index >= len(projections):
+            return None
+        expression = projections[index].strip()
+        reference = _COLUMN_REFERENCE.fullmatch(expression)
+        if reference:
+            if len(children) != 1:
+                return None
+            index = int(reference.group(1) or reference.group(2))
+            node = children[0]
+            continue
+
+        column = _COLUMN_NAME.fullmatch(expression)
+        return (column.group(1) or column.group(2)) if column else None
+
+
+def _group_rows(node: Dict[str, Any], unique_counts: Optional[Dict[str, int]]) -> Optional[float]:
+    """分组输出行数的上限: 各分组键去重计数之积,缺少任一分组键的统计时返回None"""
+    children = node.get('children') or []
+    if not unique_counts or len(children) != 1:
+        return None
+
+    product = 1.0
+    for group in _as_list((node.get('extra_info') or {}).get('Groups')):
+        group = group.strip()
+        reference = _COLUMN_REFERENCE.fullmatch(group)
+        if reference:
+            column = _resolve_column(children[0], int(reference.group(1) or reference.group(2)))
+        else:
+            match = _COLUMN_NAME.fullmatch(group)
+            column = (match.group(1) or match.group(2)) if match else None
+        count = unique_counts.get(column) if column else None
+        if not count:
+            return None
+        product *= count
+    return product
+
+
+def estimate_plan(
+    node: Dict[str, Any],
+    unique_counts: Optional[Dict[str, int]] = None,
+    limited: bool = False
+) -> Dict[str, Any]:
+    """
+    自底向上估算查询计划的输出行数和代价
+
+    DuckDB部分算子(交叉连接、排序、分组等)不给出基数估计,按子节点推算;
+    分组聚合的估计接近输入行数,有列去重计数时按分组键的组合数封顶
+
+    Args:
+        node: 计划节点
+        unique_counts: 列名 -> 去重计数(来自解析时的列统计)
+        limited: 上层(只经过投影/过滤)有LIMIT
+
+    Returns:
+        {'rows': 输出行数, 'cost': 代价, 'issues': [问题描述], 'aggregated': 输出是否为分组结果}
+    """
+    name = node.get('name', '').strip().upper()
+    if name in _LIMIT_OPERATORS:
+        child_limited = True
+    else:
+        child_limited = limited and name in _PASSTHROUGH_OPERATORS
+
+    children = [
+        estimate_plan(child, unique_counts, child_limited)
+        for child in node.get('children') or []
+    ]
+    child_rows = [child['rows'] for child in children]
+    cost = sum(child['cost'] for child in children)
+    issues = [issue for child in children for issue in child['issues']]
+    rows = _estimated_rows(node)
+    aggregated = False
+
+    if name in _PRODUCT_JOINS and len(child_rows) == 2:
+        comparisons = child_rows[0] * child_rows[1]
+        cost += comparisons
+        if comparisons > settings.QUERY_GUARD_MAX_JOIN_ROWS:
+            issues.append(
+                f"存在笛卡尔积或非等值连接({name}),预计比较 {comparisons:.3g} 行;"
+                f"请补充等值连接条件或先聚合再连接"
+            )
+        if rows is None:
+            rows = comparisons
+    elif name in _SORT_OPERATORS:
+        input_rows = max(child_rows, default=0)
+        cost += input_rows * math.log2(input_rows + 2)
+        # 对分组结果排序、或外层有LIMIT的排序不视为全表无界排序(代价仍计入)
+        aggregated = name == 'ORDER_BY' and any(child['aggregated'] for child in children)
+        if (name == 'ORDER_BY' and not aggregated and not limited
+                and input_rows > settings.QUERY_GUARD_MAX_SORT_ROWS):
+            issues.append(
+                f"对约 {input_rows:.3g} 行进行无LIMIT的排序;请为ORDER BY添加LIMIT或先聚合"
+            )
+        if rows is None:
+            rows = input_rows
+    else:
+        cost += sum(child_rows)
+        if rows is None:
+            rows = _derived_rows(node, child_rows)
+        if name in _GROUP_OPERATORS:
+            aggregated = True
+            group_rows = _group_rows(node, unique_counts)
+            if group_rows is not None:
+                rows = min(rows, group_rows)
+        elif name in ('PROJECTION', 'FILTER') and child_rows:
+            # 投影/过滤不会增加行数,下层分组封顶后的行数向上传递
+            aggregated = any(child['aggregated'] for child in children)
+            rows = min(rows, max(child_rows))
+        cost += rows
+
+    if name.endswith('_JOIN') and rows > settings.QUERY_GUARD_MAX_JOIN_ROWS:
+        issues.append(f"连接结果预计 {rows:.3g} 行;请检查连接条件是否遗漏")
+
+    return {'rows': rows, 'cost': cost, 'issues': issues, 'aggregated': aggregated}
+
+
+def _has_top_level_limit(node: Dict[str, Any]) -> bool:
+    """计划顶层(只经过投影/过滤/排序)是否有LIMIT"""
+    while True:
+        name = node.get('name', '').strip().upper()
+        if name in _LIMIT_OPERATORS:
+            return True
+        children = node.get('children') or []
+        if (node.get('extra_info') or {}).get('Join Type') == 'SEMI':
+            return any(child.get('name', '').strip().upper() in _LIMIT_OPERATORS for child in children)
+        if name not in _PASSTHROUGH_OPERATORS or len(children) != 1:
+            return False
+        node = children[0]
+
+
+def admit_query(
+    cur,
+    sql_query: str,
+    max_rows: Optional[int] = None,
+    unique_counts: Optional[Dict[str, int]] = None
+) -> str:
+    """
+    查询准入检查
+
+    Args:
+        cur: DuckDB游标
+        sql_query: 已绑定视图名的SQL
+        max_rows: 最大返回行数,查询顶层缺少LIMIT且预计结果超过该值时补充LIMIT
+        unique_counts: 列名 -> 去重计数,用于估算分组聚合的结果行数
+
+    Returns:
+        可执行的SQL(可能已补充LIMIT)
+
+    Raises:
+        QueryRejectedError: 查询代价超过阈值
+    """
+    if not settings.QUERY_GUARD_ENABLED:
+        return sql_query
+
+    try:
+        plan = explain_plan(cur, sql_query)
+    except duckdb.Error:
+        # 语法或绑定错误交给实际执行时报告
+        return sql_query
+
+    estimate = estimate_plan(plan, unique_counts)
+    if max_rows and not _has_top_level_limit(plan) and estimate['rows'] > max_rows:
+        # 例如 LIMIT 只出现在子查询中: 在外层补充LIMIT,顶层排序随之变为Top-N
+        sql_query = f"SELECT * FROM ({sql_query}) AS guarded_query LIMIT {int(max_rows)}"
+        logger.info(f"查询预计返回 {estimate['rows']:.3g} 行,已补充LIMIT {max_rows}")
+        estimate = estimate_plan(explain_plan(cur, sql_query), unique_counts)
+
+    issues = list(dict.fromkeys(estimate['issues']))
+    if estimate['cost'] > settings.QUERY_GUARD_MAX_COST:
+        issues.append(f"查询预计代价 {estimate['cost']:.3g} 超过上限 {settings.QUERY_GUARD_MAX_COST:.3g}")
+
+    if issues:
+        logger.warning(f"查询被准入检查拒绝: {'; '.join(issues)}")
+        raise QueryRejectedError('; '.join(issues))
+
+    logger.debug(f"查询准入通过: 预计 {estimate['rows']:.3g} 行, 代价 {estimate['cost']:.3g}")
+    return sql_query
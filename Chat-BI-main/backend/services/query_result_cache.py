@@ -0,0 +1,194 @@
+"""
+DuckDB查询结果缓存
+按 (数据集ID, 数据集版本, 规范化SQL) 缓存查询结果,结果以Arrow IPC格式存储在进程内存中
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import pyarrow as pa
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 字符串字面量、带引号的标识符、注释
+_SQL_TOKEN_PATTERN = re.compile(
+    r"('(?:[^']|'')*')|(\"(?:[^\"]|\"\")*\")|(--[^\n]*)|(/\*.*?\*/)",
+    re.DOTALL
+)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    规范化SQL,使仅在大小写、空白、注释和结尾分号上不同的查询得到同一个缓存键
+
+    引号内的字符串和标识符保持原样
+    """
+    parts = []
+    plain = []
+    last_end = 0
+
+    def flush_plain():
+        parts.append(re.sub(r'\s+', ' ', ''.join(plain)).lower())
+        plain.clear()
+
+    for match in _SQL_TOKEN_PATTERN.finditer(sql):
+        plain.append(sql[last_end:match.start()])
+        if match.group(1) or match.group(2):
+            flush_plain()
+            parts.append(match.group(0))
+        else:
+            # 注释替换为空白
+            plain.append(' ')
+        last_end = match.end()
+    plain.append(sql[last_end:])
+    flush_plain()
+
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+def table_to_ipc(table: pa.Table) -> bytes:
+    """Arrow表序列化为IPC流"""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def ipc_to_table(payload: bytes) -> pa.Table:
+    """IPC流反序列化为Arrow表"""
+    return pa.ipc.open_stream(payload).read_all()
+
+
+class QueryResultCache:
+    """
+    进程内LRU结果缓存
+
+    - 总字节数上限,超出时淘汰最久未使用的结果
+    - 单条结果超过上限的1/4时不缓存
+    - 每条结果有TTL,过期后读取视为未命中
+    - 缓存键包含数据集版本,数据集重新解析后旧结果自然失效
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: int, enabled: bool = True):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.max_entry_bytes = max_bytes // 4
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def build_key(
+        dataset_id: str,
+        dataset_version: str,
+        sql: str,
+        limit: Optional[int] = None,
+        params: Optional[List[Any]] = None
+    ) -> str:
+        """生成缓存键(参数化查询的参数值区分大小写,不参与SQL规范化)"""
+        raw = f"{dataset_id}|{dataset_version}|{limit}|{normalize_sql(sql)}"
+        if params is not None:
+            raw += "|" + json.dumps(params, ensure_ascii=False, default=str)
+        return f"{dataset_id}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+    def get(self, key: str) -> Optional[pa.Table]:
+        """读取缓存结果,未命中返回None"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            if entry['expires_at'] < time.monotonic():
+                self._remove(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            payload = entry['payload']
+
+        return ipc_to_table(payload)
+
+    def set(self, key: str, dataset_id: str, table: pa.Table):
+        """写入缓存结果"""
+        if not self.enabled:
+            return
+
+        payload = table_to_ipc(table)
+        if len(payload) > self.max_entry_bytes:
+            logger.debug(f"查询结果过大,不缓存: {len(payload)} bytes")
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                'dataset_id': str(dataset_id),
+                'payload': payload,
+                'expires_at': time.monotonic() + self.ttl_seconds
+            }
+            self._total_bytes += len(payload)
+
+            while self._total_bytes > self.max_bytes and self._entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= len(entry['payload'])
+
+    def invalidate(self, dataset_id: str) -> int:
+        """
+        删除数据集的全部缓存结果
+
+        Args:
+            dataset_id: 数据集ID
+
+        Returns:
+            删除的条目数
+        """
+        dataset_id = str(dataset_id)
+        with self._lock:
+            keys = [k for k, v in self._entries.items() if v['dataset_id'] == dataset_id]
+            for key in keys:
+                self._remove(key)
+        if keys:
+            logger.info(f"已清理数据集 {dataset_id} 的查询结果缓存: {len(keys)} 条")
+        return len(keys)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存指标"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'total_bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0
+            }
+
+
+# 全局单例
+query_result_cache = QueryResultCache(
+    max_bytes=settings.QUERY_RESULT_CACHE_MAX_BYTES,
+    ttl_seconds=settings.QUERY_RESULT_CACHE_TTL,
+    enabled=settings.QUERY_RESULT_CACHE_ENABLED
+)
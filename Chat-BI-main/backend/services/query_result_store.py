@@ -0,0 +1,442 @@
+"""
+查询结果存储服务
+将大结果集物化为本地Parquet文件,通过服务端句柄分页读取或以NDJSON流式输出,
+翻页时无需重新执行查询,单次请求的内存占用与页大小成正比
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from api.dependencies.dependencies import redis_client
+from core.config import settings
+from services.arrow_utils import arrow_to_dataframe, dataframe_to_json_records
+from services.duckdb_engine import duckdb_engine
+from services.duckdb_query import (
+    get_parsed_dataset,
+    get_parquet_location,
+    resolve_dataset_view,
+    bind_dataset_sql
+)
+from services.metadata_query import get_unique_counts
+from services.query_executor import query_executor, QueryContext
+from services.query_guard import admit_query
+
+logger = logging.getLogger(__name__)
+
+QUERY_HANDLE_KEY_PREFIX = "query_handle"
+
+# 结果文件的行组大小,分页时只读取覆盖目标区间的行组
+RESULT_ROW_GROUP_SIZE = 10000
+
+# 字符串字面量、带引号的标识符、注释
+_SQL_LITERAL_PATTERN = re.compile(
+    r"('(?:[^']|'')*')|(\"(?:[^\"]|\"\")*\")|(--[^\n]*)|(/\*.*?\*/)",
+    re.DOTALL
+)
+
+# 禁止的语句关键字(只允许只读查询)
+_FORBIDDEN_KEYWORDS = re.compile(
+    r"\b(insert|update|delete|merge|create|drop|alter|truncate|copy|export|import|"
+    r"attach|detach|install|load|pragma|set|reset|call|checkpoint|vacuum|use)\b",
+    re.IGNORECASE
+)
+
+# 禁止的表函数(可读取任意文件或系统信息)
+_FORBIDDEN_FUNCTIONS = re.compile(
+    r"\b(read_\w+|\w*_scan|glob|sniff_csv|parquet_\w+|query|query_table|duckdb_\w+)\s*\(",
+    re.IGNORECASE
+)
+
+
+# 表引用检查使用的词法单元: 字符串字面量、带引号的标识符、美元符号引用的字符串、单词、括号和逗号
+_SQL_TOKEN_PATTERN = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\$(\w*)\$.*?\$\1\$|\w+|[(),]",
+    re.DOTALL
+)
+
+# 后面紧跟表引用的关键字
+_TABLE_KEYWORDS = {'join', 'pivot', 'unpivot', 'summarize', 'describe'}
+
+# 结束FROM子句的关键字
+_CLAUSE_KEYWORDS = {
+    'select', 'where', 'group', 'having', 'order', 'limit', 'offset', 'qualify',
+    'window', 'union', 'except', 'intersect', 'values'
+}
+
+_PLAIN_IDENTIFIER = re.compile(r'^"\w+"$')
+
+
+class InvalidQueryError(ValueError):
+    """查询语句不是单条只读查询"""
+    pass
+
+
+def validate_readonly_sql(sql_query: str) -> str:
+    """
+    校验SQL为单条只读的 SELECT/WITH 查询
+
+    Args:
+        sql_query: SQL查询语句
+
+    Returns:
+        去掉结尾分号后的SQL
+
+    Raises:
+        InvalidQueryError: 校验不通过
+    """
+    sql_query = (sql_query or '').strip().rstrip(';').strip()
+    if not sql_query:
+        raise InvalidQueryError("SQL不能为空")
+
+    # 去掉字面量和注释后再做关键字检查,避免误判字符串内容
+    stripped = _SQL_LITERAL_PATTERN.sub(
+        lambda m: ' ' if (m.group(3) or m.group(4)) else "''",
+        sql_query
+    ).strip()
+
+    if ';' in stripped:
+        raise InvalidQueryError("只允许执行单条SQL语句")
+
+    first_word = stripped.split(None, 1)[0].lower() if stripped else ''
+    if first_word not in ('select', 'with'):
+        raise InvalidQueryError("只允许执行SELECT查询")
+
+    keyword = _FORBIDDEN_KEYWORDS.search(stripped)
+    if keyword:
+        raise InvalidQueryError(f"SQL包含不允许的关键字: {keyword.group(1)}")
+
+    function = _FORBIDDEN_FUNCTIONS.search(stripped)
+    if function:
+        raise InvalidQueryError(f"SQL包含不允许的函数: {function.group(1)}")
+
+    _check_table_references(sql_query)
+    return sql_query
+
+
+def _check_table_references(sql_query: str):
+    """
+    校验表引用只能是普通标识符
+
+    DuckDB会把 FROM '路径'、FROM "路径" 当作文件读取(替换扫描),
+    FROM/JOIN 及FROM子句中逗号之后出现字符串或非普通的带引号标识符时拒绝
+
+    Raises:
+        InvalidQueryError: 表引用是字符串或文件路径
+    """
+    # 只去掉注释,保留字面量
+    sql_query = _SQL_LITERAL_PATTERN.sub(
+        lambda m: ' ' if (m.group(3) or m.group(4)) else m.group(0),
+        sql_query
+    )
+
+    clauses = [None]  # 每层括号当前所在的子句
+    expect_table = False
+    prev = None
+    for match in _SQL_TOKEN_PATTERN.finditer(sql_query):
+        token = match.group(0)
+        lower = token.lower()
+
+        if token[0] in ('\'', '"', '$'):
+            if expect_table and not _PLAIN_IDENTIFIER.match(token):
+                raise InvalidQueryError(f"不允许以字符串或文件路径作为表: {token[:50]}")
+            expect_table = False
+        elif token == '(':
+            # FROM (...) 括号内的第一个单元仍按表引用检查
+            clauses.append(None)
+        elif token == ')':
+            if len(clauses) > 1:
+                clauses.pop()
+            expect_table = False
+        elif token == ',':
+            expect_table = clauses[-1] == 'from'
+        elif lower == 'from':
+            # 函数参数中的 FROM(如 EXTRACT(year FROM col))不是表引用
+            if clauses[-1] == 'select' or prev == '(':
+                clauses[-1] = 'from'
+                expect_table = True
+        elif lower in _TABLE_KEYWORDS:
+            clauses[-1] = 'from'
+            expect_table = True
+        else:
+            if lower in _CLAUSE_KEYWORDS:
+                clauses[-1] = lower if lower == 'select' else 'other'
+            expect_table = False
+        prev = token
+
+
+_HANDLE_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _result_path(handle: str) -> str:
+    return os.path.join(settings.QUERY_RESULT_DIR, f"{handle}.parquet")
+
+
+def _handle_key(handle: str) -> str:
+    return f"{QUERY_HANDLE_KEY_PREFIX}:{handle}"
+
+
+def _cleanup_expired_results():
+    """删除超过句柄有效期的结果文件(句柄在Redis中过期后文件不再可达)"""
+    expire_before = time.time() - settings.QUERY_HANDLE_TTL
+    for path in glob.glob(os.path.join(settings.QUERY_RESULT_DIR, "*.parquet")):
+        try:
+            if os.path.getmtime(path) < expire_before:
+                os.unlink(path)
+                logger.debug(f"已删除过期查询结果: {path}")
+        except OSError:
+            pass
+
+
+def _materialize_query(
+    ctx: QueryContext,
+    dataset_id: str,
+    object_name: str,
+    parquet_version: Optional[str],
+    sql_query: str,
+    result_path: str,
+    max_rows: int,
+    unique_counts: Optional[Dict[str, int]] = None
+) -> Dict[str, Any]:
+    """
+    在查询执行器线程中执行: 将查询结果写入本地Parquet文件
+
+    Returns:
+        {'row_count': 行数, 'columns': [{'name':..., 'type':...}]}
+    """
+    _cleanup_expired_results()
+
+    table_name = resolve_dataset_view(ctx, dataset_id, object_name, parquet_version)
+    bound_sql = bind_dataset_sql(sql_query, table_name)
+
+    tmp_path = f"{result_path}.part"
+    escaped_path = tmp_path.replace("'", "''")
+    logger.info(f"物化查询结果: {bound_sql}")
+
+    try:
+        with duckdb_engine.cursor() as cur:
+            ctx.bind_cursor(cur)
+            try:
+                bound_sql = admit_query(
+                    cur, f"SELECT * FROM ({bound_sql}) AS q LIMIT {int(max_rows)}",
+                    unique_counts=unique_counts
+                )
+                cur.execute(
+                    f"COPY ({bound_sql}) TO '{escaped_path}' "
+                    f"(FORMAT parquet, ROW_GROUP_SIZE {RESULT_ROW_GROUP_SIZE})"
+                )
+            finally:
+                ctx.release_cursor()
+        os.replace(tmp_path, result_path)
+    finally:
+        if os.path.exists(tmp_path):
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    parquet_file = pq.ParquetFile(result_path)
+    schema = parquet_file.schema_arrow
+    return {
+        'row_count': parquet_file.metadata.num_rows,
+        'columns': [{'name': field.name, 'type': str(field.type)} for field in schema]
+    }
+
+
+def _read_page(ctx: QueryContext, result_path: str, offset: int, limit: int) -> str:
+    """
+    在查询执行器线程中执行: 读取结果文件的一页,只加载覆盖该区间的行组
+
+    Returns:
+        records格式的JSON字符串
+    """
+    parquet_file = pq.ParquetFile(result_path)
+    metadata = parquet_file.metadata
+
+    row_groups = []
+    first_row = None
+    group_start = 0
+    for i in range(metadata.num_row_groups):
+        group_rows = metadata.row_group(i).num_rows
+        group_end = group_start + group_rows
+        if group_end > offset and group_start < offset + limit:
+            if first_row is None:
+                first_row = group_start
+            row_groups.append(i)
+        group_start = group_end
+
+    if not row_groups:
+        return '[]'
+
+    ctx.check_cancelled()
+    table = parquet_file.read_row_groups(row_groups).slice(offset - first_row, limit)
+    return dataframe_to_json_records(arrow_to_dataframe(table))
+
+
+async def create_query_handle(dataset_id: str, sql_query: str) -> Dict[str, Any]:
+    """
+    执行查询并将结果物化为服务端句柄
+
+    Args:
+        dataset_id: 数据集ID
+        sql_query: SQL查询语句(表名使用 dataset)
+
+    Returns:
+        句柄元数据
+
+    Raises:
+        InvalidQueryError: SQL校验不通过
+        LookupError: 数据集不存在或未解析完成
+        QueryRejectedError: 查询计划代价过高
+    """
+    sql_query = validate_readonly_sql(sql_query)
+
+    dataset_info = await get_parsed_dataset(dataset_id)
+    if dataset_info is None:
+        raise LookupError(f"数据集不存在或未解析完成: {dataset_id}")
+
+    object_name, parquet_version = get_parquet_location(dataset_info)
+    unique_counts = await get_unique_counts(dataset_info.id) if settings.QUERY_GUARD_ENABLED else None
+
+    os.makedirs(settings.QUERY_RESULT_DIR, exist_ok=True)
+    handle = uuid.uuid4().hex
+    result = await query_executor.run(
+        _materialize_query,
+        str(dataset_id),
+        object_name,
+        parquet_version,
+        sql_query,
+        _result_path(handle),
+        settings.QUERY_RESULT_MAX_ROWS,
+        unique_counts
+    )
+
+    handle_info = {
+        'handle': handle,
+        'dataset_id': str(dataset_id),
+        'sql': sql_query,
+        'row_count': result['row_count'],
+        'columns': result['columns'],
+        'truncated': result['row_count'] >= settings.QUERY_RESULT_MAX_ROWS,
+        'created_at': datetime.now().isoformat()
+    }
+    await redis_client.set(
+        _handle_key(handle),
+        json.dumps(handle_info, ensure_ascii=False),
+        ex=settings.QUERY_HANDLE_TTL
+    )
+
+    logger.info(f"查询句柄已创建: {handle}, 共 {result['row_count']} 行")
+    return handle_info
+
+
+async def get_query_handle(handle: str) -> Optional[Dict[str, Any]]:
+    """
+    获取句柄元数据并刷新有效期
+
+    Returns:
+        句柄元数据,不存在或已过期返回None
+    """
+    if not _HANDLE_PATTERN.match(handle):
+        return None
+
+    data = await redis_client.get(_handle_key(handle))
+    if not data:
+        return None
+    if not os.path.exists(_result_path(handle)):
+        # 结果文件已被清理(例如在其他实例上创建),句柄视为失效
+        await redis_client.delete(_handle_key(handle))
+        return None
+
+    await redis_client.expire(_handle_key(handle), settings.QUERY_HANDLE_TTL)
+    try:
+        os.utime(_result_path(handle), None)
+    except OSError:
+        pass
+    return json.loads(data)
+
+
+async def fetch_query_page(handle: str, offset: int, limit: int) -> Optional[Dict[str, Any]]:
+    """
+    读取一页查询结果
+
+    Args:
+        handle: 查询句柄
+        offset: 起始行
+        limit: 页大小
+
+    Returns:
+        {'handle', 'offset', 'limit', 'row_count', 'next_offset', 'data_json'},句柄不存在返回None
+    """
+    handle_info = await get_query_handle(handle)
+    if handle_info is None:
+        return None
+
+    data_json = await query_executor.run(_read_page, _result_path(handle), offset, limit)
+
+    row_count = handle_info['row_count']
+    next_offset = offset + limit if offset + limit < row_count else None
+    return {
+        'handle': handle,
+        'offset': offset,
+        'limit': limit,
+        'row_count': row_count,
+        'next_offset': next_offset,
+        'data_json': data_json
+    }
+
+
+async def iter_query_ndjson(handle: str, batch_size: int = 1000) -> AsyncIterator[str]:
+    """
+    以NDJSON格式逐批输出全部查询结果,每次只在内存中保留一个批次
+
+    Args:
+        handle: 查询句柄(调用前需通过get_query_handle确认存在)
+        batch_size: 每批行数
+    """
+    parquet_file = await asyncio.to_thread(pq.ParquetFile, _result_path(handle))
+    batches = parquet_file.iter_batches(batch_size=batch_size)
+
+    def next_chunk() -> Optional[str]:
+        batch = next(batches, None)
+        if batch is None:
+            return None
+        table = pa.Table.from_batches([batch])
+        return dataframe_to_json_records(arrow_to_dataframe(table), lines=True)
+
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next_chunk)
+            if chunk is None:
+                break
+            if chunk:
+                yield chunk
+    finally:
+        parquet_file.close()
+
+
+async def delete_query_handle(handle: str) -> bool:
+    """
+    删除查询句柄及其结果文件
+
+    Returns:
+        句柄是否存在
+    """
+    if not _HANDLE_PATTERN.match(handle):
+        return False
+
+    deleted = await redis_client.delete(_handle_key(handle))
+    try:
+        os.unlink(_result_path(handle))
+    except OSError:
+        pass
+    return bool(deleted)
@@ -0,0 +1,60 @@
+"""
+过期上传清理
+可续传上传创建后长时间未完成(客户端放弃或中断)时,取消MinIO中的分片上传并删除上传记录,
+避免已上传的分片和 parse_status='uploading' 的数据集记录永久残留
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select
+
+from api.dependencies.dependencies import redis_client
+from core.config import settings
+from core.minio_client import minio_client
+
+logger = logging.getLogger(__name__)
+
+# 多个worker进程中每个清理周期只由一个进程执行
+SWEEP_LOCK_KEY = "dataset_upload_sweep"
+
+
+async def expire_stale_uploads() -> int:
+    """
+    清理创建时间超过 UPLOAD_EXPIRE_SECONDS 仍未完成的上传
+
+    Returns:
+        清理的上传数(本周期已由其他进程执行时返回0)
+    """
+    if not await redis_client.set(SWEEP_LOCK_KEY, 1, nx=True, ex=settings.UPLOAD_SWEEP_INTERVAL):
+        return 0
+
+    from db.session import async_session
+    from models.sys_dataset import SysDataset
+
+    deadline = datetime.now(timezone.utc) - timedelta(seconds=settings.UPLOAD_EXPIRE_SECONDS)
+    async with async_session() as session:
+        result = await session.execute(
+            select(SysDataset.id, SysDataset.extra_metadata)
+            .where(SysDataset.parse_status == 'uploading', SysDataset.created_at < deadline)
+        )
+        expired = result.all()
+
+        removed = 0
+        for dataset_id, extra_metadata in expired:
+            upload = (extra_metadata or {}).get('upload')
+            if upload:
+                # 取消失败(如上传已被MinIO清理)时仍删除记录
+                await asyncio.to_thread(
+                    minio_client.abort_multipart_upload, upload['object_name'], upload['upload_id']
+                )
+            # 只删除仍在上传中的记录,期间已完成的上传不受影响
+            deleted = await session.execute(
+                delete(SysDataset)
+                .where(SysDataset.id == dataset_id, SysDataset.parse_status == 'uploading')
+            )
+            await session.commit()
+            if deleted.rowcount:
+                removed += 1
+                logger.info(f"已清理过期上传: {dataset_id}")
+    return removed
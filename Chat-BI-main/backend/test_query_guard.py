@@ -0,0 +1,98 @@
+"""
+测试查询准入检查对分组聚合和排序的估算
+
+运行前确保:
+1. 依赖已安装(duckdb)
+
+使用方法:
+    python test_query_guard.py
+"""
+import os
+import sys
+import tempfile
+
+import duckdb
+
+from core.config import settings
+from services.query_guard import admit_query, estimate_plan, explain_plan, QueryRejectedError
+
+# 测试数据行数,需超过 QUERY_GUARD_MAX_SORT_ROWS
+ROW_COUNT = int(settings.QUERY_GUARD_MAX_SORT_ROWS * 2)
+
+UNIQUE_COUNTS = {'city': 50, 'k': 7, 'amt': ROW_COUNT}
+
+# 普通聚合查询(含物化查询时外层包裹的LIMIT)不应被拒绝
+AGGREGATE_QUERIES = [
+    "SELECT * FROM (SELECT city, SUM(amt) s FROM v GROUP BY city ORDER BY s DESC) q LIMIT 1000000",
+    "SELECT city, SUM(amt) s FROM v GROUP BY city ORDER BY city",
+    "SELECT k, city, SUM(amt) s FROM v GROUP BY 1, 2 HAVING s > 1 ORDER BY s",
+]
+
+
+def _create_view(cur, root: str):
+    path = os.path.join(root, 'data.parquet')
+    cur.execute(
+        f"COPY (SELECT 'c' || (i % 50) AS city, i % 7 AS k, i * 1.0 AS amt "
+        f"FROM range({ROW_COUNT}) t(i)) TO '{path}' (FORMAT parquet)"
+    )
+    cur.execute(f"CREATE VIEW v AS SELECT * FROM read_parquet('{path}')")
+
+
+def test_aggregate_queries(cur):
+    """测试分组聚合后排序不按全表排序拒绝"""
+    print("\n" + "="*60)
+    print("测试1: 分组聚合查询")
+    print("="*60)
+
+    for sql in AGGREGATE_QUERIES:
+        for unique_counts in (UNIQUE_COUNTS, None):
+            admit_query(cur, sql, unique_counts=unique_counts)
+        print(f"✓ 已通过: {sql}")
+
+    estimate = estimate_plan(explain_plan(cur, AGGREGATE_QUERIES[1]), UNIQUE_COUNTS)
+    assert estimate['rows'] <= 50, f"分组结果行数估算错误: {estimate['rows']}"
+    print(f"✓ 按城市分组预计 {estimate['rows']:.0f} 行")
+
+
+def test_unbounded_sort(cur):
+    """测试全表无LIMIT排序仍被拒绝"""
+    print("\n" + "="*60)
+    print("测试2: 全表排序")
+    print("="*60)
+
+    sql = "SELECT city, amt FROM v ORDER BY amt"
+    try:
+        admit_query(cur, sql, unique_counts=UNIQUE_COUNTS)
+    except QueryRejectedError as e:
+        print(f"✓ 已拒绝: {sql} ({e})")
+    else:
+        raise AssertionError(f"未拒绝: {sql}")
+
+    limited_sql = admit_query(cur, sql, max_rows=1000)
+    assert 'LIMIT 1000' in limited_sql, limited_sql
+    print(f"✓ 补充LIMIT后通过: {limited_sql}")
+
+
+def main():
+    if not settings.QUERY_GUARD_ENABLED:
+        print("QUERY_GUARD_ENABLED 未开启,跳过测试")
+        return
+
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            cur = duckdb.connect()
+            _create_view(cur, root)
+            test_aggregate_queries(cur)
+            test_unbounded_sort(cur)
+            cur.close()
+
+        print("\n" + "="*60)
+        print("✅ 所有测试通过!")
+        print("="*60)
+    except (AssertionError, QueryRejectedError) as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+测试用户SQL的只读校验和DuckDB文件访问限制
+
+运行前确保:
+1. 依赖已安装(duckdb>=1.2.0)
+2. MinIO、Redis服务已启动(导入查询服务时会连接)
+
+使用方法:
+    python test_sql_security.py
+"""
+import os
+import sys
+import tempfile
+
+import duckdb
+
+from services.duckdb_engine import DuckDBEngine
+from services.query_result_store import validate_readonly_sql, InvalidQueryError
+
+
+# 以文件路径作为表的查询(DuckDB替换扫描会直接读取文件)
+REJECTED_QUERIES = [
+    "SELECT * FROM '/etc/passwd'",
+    "select * from '/data/*.parquet'",
+    'SELECT * FROM "/tmp/secret.csv"',
+    "SELECT * FROM dataset, '/etc/passwd'",
+    "SELECT * FROM dataset a JOIN dataset b ON a.id = b.id JOIN '/etc/passwd' c ON true",
+    "SELECT * FROM (FROM '/etc/passwd')",
+    "WITH t AS (FROM 'secret.csv') SELECT * FROM t",
+    "SELECT * FROM dataset WHERE id IN (SELECT id FROM 'other.parquet')",
+    "SELECT * FROM /* 注释 */ '/etc/passwd'",
+    "SELECT * FROM $$/etc/passwd$$",
+    "SELECT * FROM read_csv('/etc/passwd')",
+    "SELECT * FROM dataset; DROP TABLE x",
+]
+
+ALLOWED_QUERIES = [
+    "SELECT city, SUM(amount) AS total FROM dataset WHERE name = 'from' GROUP BY city",
+    'SELECT EXTRACT(year FROM order_date) FROM "dataset_1" t JOIN "dataset_2" USING (id, code)',
+    "SELECT * FROM (SELECT city FROM dataset) q, dataset_2",
+    "WITH x AS (SELECT 1 AS a) SELECT * FROM x",
+    "SELECT substring(name FROM 2), 'a,b' FROM dataset",
+]
+
+
+def test_reject_file_table_references():
+    """测试拒绝字符串和路径形式的表引用"""
+    print("\n" + "="*60)
+    print("测试1: SQL校验")
+    print("="*60)
+
+    for sql in REJECTED_QUERIES:
+        try:
+            validate_readonly_sql(sql)
+        except InvalidQueryError as e:
+            print(f"✓ 已拒绝: {sql} ({e})")
+        else:
+            raise AssertionError(f"未拒绝: {sql}")
+
+    for sql in ALLOWED_QUERIES:
+        validate_readonly_sql(sql)
+        print(f"✓ 已通过: {sql}")
+
+
+def test_engine_file_access():
+    """测试DuckDB引擎只能访问白名单目录"""
+    print("\n" + "="*60)
+    print("测试2: DuckDB文件访问限制")
+    print("="*60)
+
+    with tempfile.TemporaryDirectory() as root:
+        allowed_dir = os.path.join(root, 'parquet')
+        secret_path = os.path.join(root, 'secret.csv')
+        with open(secret_path, 'w') as f:
+            f.write("a\n1\n")
+
+        engine = DuckDBEngine(pool_size=1, threads=1, memory_limit='256MB', allowed_directories=[allowed_dir])
+        parquet_path = os.path.join(allowed_dir, 'data.parquet')
+        with engine.cursor() as cur:
+            cur.execute(f"COPY (SELECT 1 AS a) TO '{parquet_path}' (FORMAT parquet)")
+
+        view_name = engine.register_dataset('test', parquet_path)
+        with engine.cursor() as cur:
+            assert cur.execute(f"SELECT a FROM {view_name}").fetchall() == [(1,)]
+            print("✓ 白名单目录中的数据集可正常查询")
+
+            for sql in [
+                f"SELECT * FROM '{secret_path}'",
+                f"SELECT * FROM read_csv('{secret_path}')",
+                f"SELECT * FROM '{allowed_dir}/../secret.csv'",
+                f"COPY (SELECT 1) TO '{root}/out.csv'",
+                "SET enable_external_access = true",
+            ]:
+                try:
+                    cur.execute(sql)
+                except duckdb.Error as e:
+                    print(f"✓ 已拒绝: {sql} ({type(e).__name__})")
+                else:
+                    raise AssertionError(f"未拒绝: {sql}")
+
+
+def main():
+    try:
+        test_reject_file_table_references()
+        test_engine_file_access()
+
+        print("\n" + "="*60)
+        print("✅ 所有测试通过!")
+        print("="*60)
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
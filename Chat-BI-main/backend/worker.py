@@ -0,0 +1,48 @@
+"""
+数据集后台任务worker
+从Redis任务队列领取并执行 解析/分片/向量化 任务,可在多台机器上启动多个进程水平扩展
+
+用法:
+    python worker.py                # 处理全部阶段
+    python worker.py parse          # 只处理指定阶段(parse/chunk/vectorize/embedding)
+"""
+import asyncio
+import logging
+import signal
+import sys
+
+from core.logging import setup_logging
+from services.dataset_jobs import STAGE_HANDLERS, run_worker
+
+logger = logging.getLogger(__name__)
+
+
+async def main(stages):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows不支持,Ctrl+C时直接退出,未完成的任务在租约过期后重新入队
+            pass
+
+    from api.dependencies.dependencies import redis_client, engine
+    from db.session import engine as session_engine
+    from services.column_profiler import shutdown_profile_pool
+    try:
+        await run_worker(stages, stop)
+    finally:
+        shutdown_profile_pool()
+        await redis_client.close()
+        await engine.dispose()
+        await session_engine.dispose()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    stages = sys.argv[1:] or list(STAGE_HANDLERS)
+    unknown = [stage for stage in stages if stage not in STAGE_HANDLERS]
+    if unknown:
+        sys.exit(f"未知的任务阶段: {', '.join(unknown)}. 可选: {', '.join(STAGE_HANDLERS)}")
+    asyncio.run(main(stages))
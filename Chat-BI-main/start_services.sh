@@ -69,10 +69,13 @@ echo "📝 下一步操作:"
 echo "  1. 启动后端服务:"
 echo "     cd backend && python main.py"
 echo ""
-echo "  2. 启动前端服务 (另开终端):"
+echo "  2. 启动数据集任务worker (另开终端,负责解析/分片/向量化):"
+echo "     cd backend && python worker.py"
+echo ""
+echo "  3. 启动前端服务 (另开终端):"
 echo "     cd frontend && pnpm dev"
 echo ""
-echo "  3. 访问应用:"
+echo "  4. 访问应用:"
 echo "     http://localhost:3000"
 echo ""
 echo "======================================"